@@ -0,0 +1,84 @@
+"""Microbenchmark of BibTeX serialization: per-entry cost of `BibTeXEntry.format`
+and of the streaming `.bib` export, next to the former implementation that
+built the JSON schema on every call.
+
+Usage: python -m benchmarks.bibtex_format [--entries 10000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import itertools
+import os
+import timeit
+
+from benchmarks.run import load_corpus
+from src.bib_export import BibWriter
+from src.bibtex import BibTeXEntry
+
+
+def format_via_schema(entry: BibTeXEntry) -> str:
+    """`BibTeXEntry.format` as it was before the field order was precomputed."""
+    lines = [f"@{entry.entry_type}{{{entry.cite_key},"]
+    schema = BibTeXEntry.model_json_schema()
+    for p in schema["properties"]:
+        if p not in schema["required"] and getattr(entry, p) is not None:
+            lines.append(f"  {p} = {{{getattr(entry, p)}}},")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def per_entry_us(seconds: float, entries: int) -> float:
+    return seconds / entries * 1e6
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bibtex_format",
+        description="Measure the per-entry cost of BibTeX serialization.",
+    )
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+
+    corpus = [BibTeXEntry(**item.expected) for item in load_corpus()]
+    # Distinct keys like a real library; repeated keys would measure renaming
+    entries = [
+        entry.model_copy(update={"cite_key": f"{entry.cite_key}{i}"})
+        for i, entry in enumerate(
+            itertools.islice(itertools.cycle(corpus), args.entries)
+        )
+    ]
+
+    def export_to_devnull() -> None:
+        with open(os.devnull, "w") as out:
+            BibWriter(out).write_all(iter(entries))
+
+    def export_per_entry() -> None:
+        writer = BibWriter(io.StringIO())
+        for entry in entries:
+            writer.write(entry)
+
+    cases = {
+        "format (schema per call)": lambda: [format_via_schema(e) for e in entries],
+        "format": lambda: [e.format() for e in entries],
+        "export, one flush": export_to_devnull,
+        "export, flush per entry": export_per_entry,
+    }
+    results = {
+        name: min(timeit.repeat(case, number=1, repeat=args.repeat))
+        for name, case in cases.items()
+    }
+
+    baseline = results["format (schema per call)"]
+    print(f"{args.entries} entries, best of {args.repeat}")
+    for name, seconds in results.items():
+        print(
+            f"  {name:<26} {per_entry_us(seconds, args.entries):8.2f} us/entry"
+            f"  {baseline / seconds:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,96 @@
+"""Microbenchmark of holding many entries: construction cost and memory of
+`BibTeXEntry` models next to `BibTeXRecord` tuples, and the Zotero mapping.
+
+Usage: python -m benchmarks.bibtex_records [--entries 100000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import itertools
+import time
+import tracemalloc
+import typing as typ
+
+from benchmarks.run import load_corpus
+from src.bibtex import BibTeXEntry, BibTeXRecord
+from src.import_to_zotero import bibtex_to_zotero_item
+
+
+def measure(build: typ.Callable[[], list[typ.Any]]) -> tuple[float, int]:
+    """Seconds to build the list and the bytes it holds on to (measured in a
+    second run, tracing allocations slows them down)."""
+    gc.collect()
+    started = time.perf_counter()
+    built = build()
+    elapsed = time.perf_counter() - started
+    del built
+    gc.collect()
+    tracemalloc.start()
+    built = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del built
+    return elapsed, size
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bibtex_records",
+        description="Compare BibTeXEntry and BibTeXRecord for bulk work.",
+    )
+    parser.add_argument("--entries", type=int, default=100_000)
+    args = parser.parse_args()
+    n = args.entries
+
+    corpus = [BibTeXEntry(**item.expected) for item in load_corpus()]
+    # The field values exist before measuring, so only the per-entry container
+    # overhead is counted
+    fields = [
+        entry.model_dump(exclude_none=True) | {"cite_key": f"{entry.cite_key}{i}"}
+        for i, entry in enumerate(itertools.islice(itertools.cycle(corpus), n))
+    ]
+    dumps = [BibTeXEntry(**f).model_dump_json() for f in fields[: min(n, 10_000)]]
+
+    cases = {
+        "BibTeXEntry(**fields)": lambda: [BibTeXEntry(**f) for f in fields],
+        "BibTeXRecord.validate": lambda: [BibTeXRecord.validate(**f) for f in fields],
+        "BibTeXRecord(**fields)": lambda: [BibTeXRecord(**f) for f in fields],
+    }
+    print(f"{n} entries, memory without the field values")
+    results = {name: measure(case) for name, case in cases.items()}
+    baseline_time, baseline_size = results["BibTeXEntry(**fields)"]
+    for name, (elapsed, size) in results.items():
+        print(
+            f"  {name:<24} {elapsed / n * 1e6:7.2f} us/entry"
+            f"  {size / n:7.0f} B/entry  ({baseline_size / size:4.1f}x smaller,"
+            f" {baseline_time / elapsed:5.1f}x faster)"
+        )
+
+    m = len(dumps)
+    started = time.perf_counter()
+    for dump in dumps:
+        BibTeXEntry.model_validate_json(dump)
+    validate_json = time.perf_counter() - started
+    records = [BibTeXRecord.from_json(dump) for dump in dumps]
+    started = time.perf_counter()
+    for record in records:
+        record.to_entry()
+    to_entry = time.perf_counter() - started
+    print(f"Back to the model ({m} entries)")
+    print(f"  {'model_validate_json':<24} {validate_json / m * 1e6:7.2f} us/entry")
+    print(f"  {'BibTeXRecord.to_entry':<24} {to_entry / m * 1e6:7.2f} us/entry")
+
+    entries = [record.to_entry() for record in records]
+    print(f"Zotero item mapping ({m} entries)")
+    for name, source in (("BibTeXEntry", entries), ("BibTeXRecord", records)):
+        started = time.perf_counter()
+        for entry in source:
+            bibtex_to_zotero_item(entry)
+        elapsed = time.perf_counter() - started
+        print(f"  {name:<24} {elapsed / m * 1e6:7.2f} us/entry")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,476 @@
+"""Benchmark of the capture pipeline against local OpenAI and Zotero stand-ins.
+
+Each corpus citation is rendered to an image and run through OCR, citation
+parsing (one at a time and concurrently) and the Zotero writer. The report
+has latency percentiles and throughput per stage next to field-level
+extraction accuracy, so speedups are never traded for wrong citations
+unnoticed. With `--baseline`, a regression beyond `--tolerance` fails the run.
+
+Usage:
+    python -m benchmarks.run [--repeat 3] [--openai-latency 0.5] [--output out.json]
+    python -m benchmarks.run --baseline out.json   # exit status 1 on regressions
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import textwrap
+import time
+import typing as typ
+from pathlib import Path
+
+from PIL import Image as PILImage
+from PIL import ImageDraw, ImageFont
+from PIL.Image import Image
+from pyzotero import zotero
+
+from benchmarks.stand_ins import Behaviour, OpenAIStandIn, ZoteroStandIn
+from src.bibtex import BibTeXEntry
+from src.import_to_zotero import bibtex_to_zotero_item
+from src.library_index import normalize_title
+from src.metrics import get_tracer, percentile, read_spans
+from src.processing import (
+    extract_citation_text,
+    extract_text,
+    find_citation,
+    find_citations,
+)
+from src.zotero_writer import MAX_ITEMS_PER_REQUEST, ZoteroWriter
+
+CORPUS_PATH = Path(__file__).parent / "corpus.jsonl"
+
+# Fields compared for accuracy; cite keys are generated and not compared
+_IGNORED_FIELDS = {"cite_key"}
+_TITLE_LIKE = {"title", "journal", "booktitle", "publisher"}
+
+
+class CorpusItem(typ.NamedTuple):
+    id: str
+    text: str
+    expected: dict[str, typ.Any]
+
+
+def load_corpus(path: Path = CORPUS_PATH) -> list[CorpusItem]:
+    with path.open() as f:
+        return [CorpusItem(**json.loads(line)) for line in f if line.strip()]
+
+
+def render(text: str, *, width: int = 1000, font_size: int = 24) -> Image:
+    """Draw the citation like a screenshot of a paragraph: black on white."""
+    font = ImageFont.load_default(size=font_size)
+    lines = textwrap.wrap(text, width=int(width / (font_size * 0.5)))
+    line_height = int(font_size * 1.4)
+    img = PILImage.new("RGB", (width, line_height * len(lines) + 40), "white")
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(lines):
+        draw.text((20, 20 + i * line_height), line, fill="black", font=font)
+    return img
+
+
+def load_image(item: CorpusItem, images_dir: Path | None) -> Image:
+    """A real screenshot `<id>.png` from `images_dir` if there is one."""
+    if images_dir is not None and (path := images_dir / f"{item.id}.png").exists():
+        with PILImage.open(path) as img:
+            return img.convert("RGB")
+    return render(item.text)
+
+
+# Accuracy
+
+
+def field_matches(field: str, expected: typ.Any, actual: typ.Any) -> bool:
+    if actual is None:
+        return False
+    if field == "author":
+        return _last_names(str(expected)) == _last_names(str(actual))
+    if field in _TITLE_LIKE:
+        return normalize_title(str(expected)) == normalize_title(str(actual))
+    if field == "pages":
+        return _dashes(str(expected)) == _dashes(str(actual))
+    return str(expected).strip().casefold() == str(actual).strip().casefold()
+
+
+def _last_names(authors: str) -> list[str]:
+    names = []
+    for author in re.split(r"\s+and\s+", authors):
+        if author.strip().casefold() in ("others", "et al."):
+            continue
+        # "Last, First" or "First Last"
+        last = author.split(",")[0] if "," in author else author.split()[-1]
+        names.append(normalize_title(last))
+    return names
+
+
+def _dashes(pages: str) -> str:
+    return re.sub(r"\s*[-‐-―]+\s*", "-", pages.strip())
+
+
+class Accuracy:
+    __slots__ = ("fields", "entries", "exact_entries", "failed_entries")
+
+    def __init__(self) -> None:
+        # field -> [correct, expected]
+        self.fields: dict[str, list[int]] = {}
+        self.entries = 0
+        self.exact_entries = 0
+        self.failed_entries = 0
+
+    def add(self, expected: dict[str, typ.Any], actual: BibTeXEntry | None) -> None:
+        self.entries += 1
+        if actual is None:
+            self.failed_entries += 1
+        all_correct = actual is not None
+        for field, value in expected.items():
+            if field in _IGNORED_FIELDS:
+                continue
+            correct = actual is not None and field_matches(
+                field, value, getattr(actual, field, None)
+            )
+            counts = self.fields.setdefault(field, [0, 0])
+            counts[0] += correct
+            counts[1] += 1
+            all_correct &= correct
+        self.exact_entries += all_correct
+
+    def as_dict(self) -> dict[str, typ.Any]:
+        correct = sum(c for c, _ in self.fields.values())
+        total = sum(t for _, t in self.fields.values())
+        return {
+            "field_accuracy": correct / total if total else 0.0,
+            "exact_entries": self.exact_entries / self.entries if self.entries else 0.0,
+            "failed_entries": self.failed_entries,
+            "fields": {f: c / t for f, (c, t) in sorted(self.fields.items())},
+        }
+
+
+# Stages
+
+
+def bench_ocr(
+    corpus: list[CorpusItem], images_dir: Path | None, repeat: int
+) -> tuple[dict[str, str], float] | None:
+    """OCR text per item and wall time, or None without a working OCR engine."""
+    images = {item.id: load_image(item, images_dir) for item in corpus}
+    tracer = get_tracer()
+    tracer.enabled = False  # The probe is not part of the measurement
+    try:
+        extract_text(render("probe"))
+    except Exception as e:
+        print(f"Skipping OCR (no working Tesseract: {e}); using corpus text")
+        return None
+    finally:
+        tracer.enabled = True
+
+    texts: dict[str, str] = {}
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in corpus:
+            texts[item.id] = extract_citation_text(images[item.id]).text
+    return texts, time.perf_counter() - started
+
+
+def bench_citations(
+    corpus: list[CorpusItem], texts: dict[str, str], *, repeat: int, model_only: bool
+) -> tuple[dict[str, BibTeXEntry | None], float]:
+    results: dict[str, BibTeXEntry | None] = {}
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in corpus:
+            try:
+                results[item.id] = find_citation(
+                    texts[item.id],
+                    use_cache=False,
+                    use_identifiers=False,
+                    use_heuristics=not model_only,
+                )
+            except Exception as e:
+                print(f"{item.id}: {e}")
+                results[item.id] = None
+    return results, time.perf_counter() - started
+
+
+def bench_citations_async(
+    corpus: list[CorpusItem],
+    texts: dict[str, str],
+    *,
+    repeat: int,
+    concurrency: int,
+    model_only: bool,
+) -> tuple[int, float]:
+    batch = [texts[item.id] for item in corpus] * repeat
+    started = time.perf_counter()
+    results = asyncio.run(
+        find_citations(
+            batch,
+            concurrency=concurrency,
+            use_cache=False,
+            use_identifiers=False,
+            use_heuristics=not model_only,
+        )
+    )
+    failed = sum(isinstance(r, BaseException) for r in results)
+    return failed, time.perf_counter() - started
+
+
+def bench_zotero(
+    citations: list[BibTeXEntry], client: zotero.Zotero, *, repeat: int
+) -> tuple[int, float]:
+    writer = ZoteroWriter(client)
+    items = [bibtex_to_zotero_item(c) for c in citations] * repeat
+    failed = 0
+    started = time.perf_counter()
+    for start in range(0, len(items), MAX_ITEMS_PER_REQUEST):
+        batch = items[start : start + MAX_ITEMS_PER_REQUEST]
+        try:
+            results = writer.send(batch)
+        except Exception:
+            failed += len(batch)
+            continue
+        failed += sum(r.status == "failed" for r in results)
+    return failed, time.perf_counter() - started
+
+
+# Report
+
+
+def stage_stats(
+    spans_path: Path, throughput: dict[str, float]
+) -> dict[str, dict[str, float]]:
+    durations: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    for span in read_spans(spans_path):
+        durations.setdefault(span["stage"], []).append(span["ms"])
+        errors[span["stage"]] = errors.get(span["stage"], 0) + bool(span.get("error"))
+    stats: dict[str, dict[str, float]] = {}
+    for stage, values in durations.items():
+        values.sort()
+        stats[stage] = {
+            "count": len(values),
+            "errors": errors[stage],
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+        }
+    for stage, per_second in throughput.items():
+        stats.setdefault(stage, {})["per_second"] = per_second
+    return stats
+
+
+def find_regressions(
+    result: dict[str, typ.Any], baseline: dict[str, typ.Any], tolerance: float
+) -> list[str]:
+    regressions = []
+    for stage, before in baseline["stages"].items():
+        after = result["stages"].get(stage)
+        if after is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            # Sub-millisecond stages are all noise
+            if metric in before and before[metric] >= 1:
+                if after[metric] > before[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{stage} {metric}: {before[metric]:.1f} -> {after[metric]:.1f}"
+                    )
+        if "per_second" in before and "per_second" in after:
+            if after["per_second"] < before["per_second"] * (1 - tolerance):
+                regressions.append(
+                    f"{stage} throughput: {before['per_second']:.1f}/s -> "
+                    f"{after['per_second']:.1f}/s"
+                )
+    # Accuracy must not drop at all beyond rounding: the corpus is deterministic
+    before_acc = baseline["accuracy"]["field_accuracy"]
+    after_acc = result["accuracy"]["field_accuracy"]
+    if after_acc < before_acc - 0.005:
+        regressions.append(f"field accuracy: {before_acc:.1%} -> {after_acc:.1%}")
+    return regressions
+
+
+def format_report(result: dict[str, typ.Any]) -> str:
+    lines = [
+        f"{'stage':<16} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'per s':>8}"
+    ]
+    for stage, s in result["stages"].items():
+        lines.append(
+            f"{stage:<16} {s.get('count', ''):>6} {s.get('errors', ''):>6} "
+            f"{s.get('p50_ms', float('nan')):>9.1f} "
+            f"{s.get('p95_ms', float('nan')):>9.1f} "
+            f"{s.get('per_second', float('nan')):>8.1f}"
+        )
+    accuracy = result["accuracy"]
+    lines.append("")
+    lines.append(
+        f"Field accuracy {accuracy['field_accuracy']:.1%}, "
+        f"exact entries {accuracy['exact_entries']:.1%}, "
+        f"failed entries {accuracy['failed_entries']}"
+    )
+    fields = accuracy["fields"].items()
+    lines.append("  " + ", ".join(f"{field} {share:.0%}" for field, share in fields))
+    lines.append(f"Citation sources: {result['paths']}")
+    lines.append(f"Model tiers: {result['models']}")
+    return "\n".join(lines)
+
+
+def run(args: argparse.Namespace) -> dict[str, typ.Any]:
+    corpus = load_corpus(args.corpus)
+    openai_stand_in = OpenAIStandIn(
+        {item.text: item.expected for item in corpus},
+        Behaviour(
+            latency=args.openai_latency,
+            jitter=args.openai_jitter,
+            failure_rate=args.openai_failure_rate,
+            seed=args.seed,
+        ),
+        wrong_answers=dict(args.wrong_answers),
+        seed=args.seed + 2,
+    )
+    zotero_stand_in = ZoteroStandIn(
+        Behaviour(
+            latency=args.zotero_latency,
+            jitter=args.zotero_jitter,
+            failure_rate=args.zotero_failure_rate,
+            seed=args.seed + 1,
+        ),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp, openai_stand_in, zotero_stand_in:
+        # Point the app's clients at the stand-ins and keep spans out of data/
+        os.environ["OPENAI_API_KEY"] = "stand-in"
+        os.environ["OPENAI_BASE_URL"] = openai_stand_in.base_url
+        spans_path = Path(tmp) / "spans.jsonl"
+        tracer = get_tracer()
+        tracer.path = spans_path
+        zotero_client = zotero.Zotero("0", "user", "stand-in")
+        zotero_client.endpoint = zotero_stand_in.url
+
+        throughput: dict[str, float] = {}
+        texts = {item.id: item.text for item in corpus}
+        n = len(corpus) * args.repeat
+        if not args.skip_ocr and (ocr := bench_ocr(corpus, args.images, args.repeat)):
+            texts, elapsed = ocr
+            throughput["ocr"] = n / elapsed
+
+        results, elapsed = bench_citations(
+            corpus, texts, repeat=args.repeat, model_only=args.model_only
+        )
+        throughput["citation"] = n / elapsed
+        _, elapsed = bench_citations_async(
+            corpus,
+            texts,
+            repeat=args.repeat,
+            concurrency=args.concurrency,
+            model_only=args.model_only,
+        )
+        throughput["citation_async"] = n / elapsed
+
+        citations = [c for c in results.values() if c is not None]
+        _, elapsed = bench_zotero(citations, zotero_client, repeat=args.repeat)
+        throughput["zotero_items"] = len(citations) * args.repeat / elapsed
+
+        tracer.close()
+        accuracy = Accuracy()
+        for item in corpus:
+            accuracy.add(item.expected, results[item.id])
+
+        paths: dict[str, int] = {}
+        models: dict[str, dict[str, int]] = {}
+        for span in read_spans(spans_path):
+            if span["stage"] == "citation" and span.get("path"):
+                paths[span["path"]] = paths.get(span["path"], 0) + 1
+            elif span["stage"] == "model":
+                counts = models.setdefault(span["model"], {"calls": 0, "escalated": 0})
+                counts["calls"] += 1
+                counts["escalated"] += span.get("accepted") is False
+
+        return {
+            "config": {
+                k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+            },
+            "stages": stage_stats(spans_path, throughput),
+            "accuracy": accuracy.as_dict(),
+            "paths": paths,
+            "models": models,
+            "stand_ins": {
+                "openai_requests": openai_stand_in.behaviour.requests,
+                "openai_failures": openai_stand_in.behaviour.failures,
+                "zotero_requests": zotero_stand_in.behaviour.requests,
+                "zotero_failures": zotero_stand_in.behaviour.failures,
+            },
+        }
+
+
+def _model_rate(value: str) -> tuple[str, float]:
+    model, _, rate = value.rpartition("=")
+    return model, float(rate)
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Benchmark speed and accuracy against local API stand-ins.",
+    )
+    parser.add_argument("--corpus", type=Path, default=CORPUS_PATH)
+    parser.add_argument(
+        "--images", type=Path, default=None, help="screenshots named <id>.png"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-ocr", action="store_true")
+    parser.add_argument(
+        "--model-only",
+        action="store_true",
+        help="send every citation to the model stand-in, skipping the local parser",
+    )
+    for service, latency in (("openai", 0.5), ("zotero", 0.2)):
+        parser.add_argument(
+            f"--{service}-latency", type=float, default=latency, help="seconds"
+        )
+        parser.add_argument(f"--{service}-jitter", type=float, default=0.0)
+        parser.add_argument(f"--{service}-failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--wrong-answers",
+        type=_model_rate,
+        action="append",
+        default=[],
+        metavar="MODEL=RATE",
+        help="share of answers the stand-in gives with a wrong year for MODEL",
+    )
+    parser.add_argument("--output", type=Path, default=None, help="write JSON results")
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed relative latency/throughput change against the baseline",
+    )
+    args = parser.parse_args()
+
+    result = run(args)
+    print(format_report(result))
+    if args.output is not None:
+        args.output.write_text(json.dumps(result, indent=2) + "\n")
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        changed = [
+            k
+            for k, v in baseline["config"].items()
+            if k not in ("output", "baseline") and result["config"].get(k) != v
+        ]
+        if changed:
+            print(f"\nNote: settings differ from the baseline: {', '.join(changed)}")
+        if regressions := find_regressions(result, baseline, args.tolerance):
+            print("\nRegressions against the baseline:")
+            print("\n".join(f"  {r}" for r in regressions))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    _main()
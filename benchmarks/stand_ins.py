@@ -0,0 +1,263 @@
+"""Local HTTP stand-ins for the OpenAI chat-completions and Zotero write APIs.
+
+Both run in a background thread on 127.0.0.1, answer after a configurable
+latency and fail a configurable share of requests, driven by a seeded random
+generator so that runs are reproducible.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+import typing as typ
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.cache import normalize_citation_text
+
+
+class Behaviour:
+    """Latency and failure injection shared by a stand-in's request handlers."""
+
+    __slots__ = (
+        "latency",
+        "jitter",
+        "failure_rate",
+        "failure_status",
+        "requests",
+        "failures",
+        "_random",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 500,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next(self) -> tuple[float, bool]:
+        """Delay and whether to fail, for the next request."""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.failure_rate
+            self.requests += 1
+            self.failures += fail
+            return delay, fail
+
+
+class StandIn:
+    """An HTTP server on a free local port, serving from a background thread."""
+
+    __slots__ = ("behaviour", "_server", "_thread")
+
+    def __init__(
+        self, handler: type[BaseHTTPRequestHandler], behaviour: Behaviour
+    ) -> None:
+        self.behaviour = behaviour
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self  # type: ignore[attr-defined]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="snapcitr-stand-in", daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> StandIn:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stand_in: StandIn
+
+    def setup(self) -> None:
+        super().setup()
+        self.stand_in = self.server.stand_in  # type: ignore[attr-defined]
+
+    def log_message(self, format: str, *args: typ.Any) -> None:
+        pass  # Keep benchmark output readable
+
+    def read_json(self) -> typ.Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def send_json(
+        self, status: int, body: typ.Any, headers: dict[str, str] | None = None
+    ) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def injected_failure(self) -> bool:
+        """Wait the configured latency; answer with an error if this request fails."""
+        behaviour = self.stand_in.behaviour
+        delay, fail = behaviour.next()
+        time.sleep(delay)
+        if fail:
+            message = {"error": {"message": "Injected failure"}}
+            self.send_json(behaviour.failure_status, message)
+        return fail
+
+
+class OpenAIStandIn(StandIn):
+    """Answers `POST /v1/chat/completions` with recorded structured outputs.
+
+    `answers` maps citation text to the JSON the model should return; a request
+    is matched by its normalized text, else by the largest word overlap.
+    `wrong_answers` maps model names to the share of answers given with a wrong
+    year, to exercise the model cascade.
+    """
+
+    __slots__ = ("answers", "wrong_answers", "_random", "_lock")
+
+    def __init__(
+        self,
+        answers: dict[str, dict[str, typ.Any]],
+        behaviour: Behaviour,
+        *,
+        wrong_answers: dict[str, float] | None = None,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(_OpenAIHandler, behaviour)
+        self.answers = {normalize_citation_text(k): v for k, v in answers.items()}
+        self.wrong_answers = wrong_answers or {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def answer(self, model: str, citation_text: str) -> dict[str, typ.Any]:
+        key = normalize_citation_text(citation_text)
+        if key not in self.answers:
+            words = set(key.split())
+            key = max(self.answers, key=lambda k: len(words & set(k.split())))
+        answer = self.answers[key]
+        with self._lock:
+            wrong = self._random.random() < self.wrong_answers.get(model, 0.0)
+        if wrong and answer.get("year"):
+            return {**answer, "year": answer["year"] + 1}
+        return answer
+
+
+class _OpenAIHandler(_Handler):
+    stand_in: OpenAIStandIn
+
+    def do_POST(self) -> None:
+        request = self.read_json()
+        if self.injected_failure():
+            return
+        prompt = "\n".join(str(m.get("content")) for m in request["messages"])
+        citation_text = request["messages"][-1]["content"]
+        answer = self.stand_in.answer(request["model"], citation_text)
+        content = json.dumps(answer)
+        # Roughly 4 characters per token, like English text
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        self.send_json(
+            200,
+            {
+                "id": "chatcmpl-stand-in",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                            "refusal": None,
+                        },
+                        "finish_reason": "stop",
+                        "logprobs": None,
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+class ZoteroStandIn(StandIn):
+    """Accepts `POST /users/<id>/items` like the Zotero web API, remembering
+    write tokens so that a repeated token is answered with 412."""
+
+    __slots__ = ("items", "version", "_tokens", "_lock")
+
+    def __init__(self, behaviour: Behaviour) -> None:
+        super().__init__(_ZoteroHandler, behaviour)
+        self.items: dict[str, dict[str, typ.Any]] = {}
+        self.version = 0
+        self._tokens: set[str] = set()
+        self._lock = threading.Lock()
+
+    def create(
+        self, items: list[dict[str, typ.Any]], write_token: str | None
+    ) -> tuple[int, dict[str, typ.Any]]:
+        with self._lock:
+            if write_token is not None:
+                if write_token in self._tokens:
+                    return 412, {"error": "Write token already used"}
+                self._tokens.add(write_token)
+            self.version += 1
+            success: dict[str, str] = {}
+            for i, item in enumerate(items):
+                key = f"K{len(self.items):07d}"
+                self.items[key] = item
+                success[str(i)] = key
+            return 200, {
+                "successful": {
+                    i: {"key": key, "version": self.version, "data": items[int(i)]}
+                    for i, key in success.items()
+                },
+                "success": success,
+                "unchanged": {},
+                "failed": {},
+            }
+
+
+class _ZoteroHandler(_Handler):
+    stand_in: ZoteroStandIn
+
+    def do_POST(self) -> None:
+        items = self.read_json()
+        if self.injected_failure():
+            return
+        status, body = self.stand_in.create(
+            items, self.headers.get("Zotero-Write-Token")
+        )
+        self.send_json(
+            status, body, {"Last-Modified-Version": str(self.stand_in.version)}
+        )
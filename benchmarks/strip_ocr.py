@@ -0,0 +1,75 @@
+"""Benchmark of strip-wise OCR: a rendered column of references recognized in
+one piece and in parallel strips, with the text and confidences of both.
+
+Needs a working Tesseract. Usage: python -m benchmarks.strip_ocr [--references 30]
+"""
+
+from __future__ import annotations
+
+import argparse
+import difflib
+import os
+import statistics
+import time
+
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+from benchmarks.run import load_corpus, render
+from src.metrics import get_tracer
+from src.ocr import OCRLine
+from src.processing import extract_lines
+
+
+def reference_list(references: int) -> Image:
+    """The corpus citations stacked into one tall capture."""
+    corpus = load_corpus()
+    images = [
+        render(corpus[i % len(corpus)].text, width=900, font_size=18)
+        for i in range(references)
+    ]
+    column = PILImage.new("RGB", (900, sum(img.height for img in images)), "white")
+    top = 0
+    for img in images:
+        column.paste(img, (0, top))
+        top += img.height
+    return column
+
+
+def summarize(lines: list[OCRLine]) -> str:
+    confidences = [line.confidence for line in lines if line.confidence >= 0]
+    mean = statistics.fmean(confidences) if confidences else float("nan")
+    return f"{len(lines)} lines, mean confidence {mean:.1f}"
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.strip_ocr",
+        description="Compare OCR of a tall capture in one piece and in strips.",
+    )
+    parser.add_argument("--references", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    get_tracer().enabled = False
+    img = reference_list(args.references)
+    print(f"Capture: {img.width}x{img.height} px, {args.references} references")
+
+    results: dict[int, list[OCRLine]] = {}
+    for workers in sorted({1, args.workers}):
+        extract_lines(img, workers=workers)  # Warm up (engines, executor)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            results[workers] = extract_lines(img, workers=workers)
+        seconds = (time.perf_counter() - started) / args.repeat
+        print(f"{workers:>3} worker(s): {seconds:.2f} s, {summarize(results[workers])}")
+
+    if len(results) == 2:
+        one, strips = ("\n".join(line.text for line in r) for r in results.values())
+        ratio = difflib.SequenceMatcher(None, one, strips).ratio()
+        print(f"Text similarity of the two runs: {ratio:.4f}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
-"""Global hotkey listener to launch snapcitr app."""
+"""Global hotkey listener to launch snapcitr app.
+
+If a snapcitr daemon (`main.py --daemon`) is running, the hotkey is forwarded
+to it over its Unix socket; otherwise a fresh `main.py` process is spawned.
+"""
 
 import subprocess
 import sys
@@ -7,6 +11,8 @@ from pathlib import Path
 
 from pynput import keyboard
 
+from src.daemon import CMD_CAPTURE, REPLY_BUSY, send_command
+
 # Configuration
 HOTKEY = {keyboard.Key.ctrl_l, keyboard.Key.print_screen}
 APP_PATH = Path(__file__).parent / "main.py"
@@ -24,9 +30,15 @@ def on_press(key: keyboard.Key | keyboard.KeyCode | None) -> None:
 
     # Check if hotkey combination is pressed
     if current_keys >= HOTKEY:
-        print("Hotkey detected! Launching snapcitr...")
-        # Launch the app in a new process
-        subprocess.Popen([sys.executable, str(APP_PATH)])
+        reply = send_command(CMD_CAPTURE)
+        if reply is None:
+            print("Hotkey detected! Launching snapcitr...")
+            # No daemon running, launch the app in a new process
+            subprocess.Popen([sys.executable, str(APP_PATH)])
+        elif reply == REPLY_BUSY:
+            print("Hotkey detected, but a snapcitr session is already active.")
+        else:
+            print("Hotkey detected! Signalled snapcitr daemon.")
         # Clear keys to prevent repeated launches
         current_keys.clear()
 
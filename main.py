@@ -1,23 +1,85 @@
+import argparse
+import functools
+import logging
+import typing as typ
 from pathlib import Path
 
-from src.import_to_zotero import import_to_zotero
-from src.processing import extract_text, find_citation
+from PIL.Image import Image
+
+from src.bib_export import BibWriter
+from src.cache import get_citation_cache
+from src.capture_cache import get_capture_cache
+from src.daemon import SnapcitrDaemon
+from src.history import get_capture_history
+from src.library_index import sync_in_background
+from src.metrics import (
+    get_tracer,
+    refresh_prometheus_in_background,
+    write_prometheus,
+)
+from src.outbox import get_outbox, get_outbox_sender
+from src.pipeline import (
+    AsyncCapturePipeline,
+    AsyncProcessFn,
+    CapturePipeline,
+    CaptureResult,
+    ProcessFn,
+    StageTimeouts,
+    process_image,
+    process_image_async,
+    process_reference_list,
+    process_reference_list_async,
+)
+from src.processing import DEFAULT_CONCURRENCY, citation_path_stats
 from src.rectangle_selector import RectangleSelector
 from src.utils import get_logger
 
-if __name__ == "__main__":
-    logs_dir = Path(__file__).parent / "logs"
-    logger = get_logger(logs_dir=logs_dir, logger_name=__name__)
-    logger.info("snapcitr started")
-    logger.info("Log file: %s", logs_dir)
 
+def _ms(selector: RectangleSelector) -> str:
+    latency = selector.show_latency_ms
+    return "?" if latency is None else f"{latency:.0f}"
+
+
+def _write_result(bib: BibWriter, result: CaptureResult) -> None:
+    if isinstance(result, list):
+        bib.write_all(result)
+    elif result is not None:
+        bib.write(result)
+
+
+def exporting(process: ProcessFn, bib: BibWriter) -> ProcessFn:
+    """`process`, also writing each new citation to `bib` as it is found."""
+
+    def run(img: Image, logger: logging.Logger) -> CaptureResult:
+        result = process(img, logger)
+        _write_result(bib, result)
+        return result
+
+    return run
+
+
+def exporting_async(process: AsyncProcessFn, bib: BibWriter) -> AsyncProcessFn:
+    """`exporting` for the async pipeline."""
+
+    async def run(
+        img: Image, logger: logging.Logger, **kwargs: typ.Any
+    ) -> CaptureResult:
+        result = await process(img, logger, **kwargs)
+        _write_result(bib, result)
+        return result
+
+    return run
+
+
+def run_sequential(
+    logger: logging.Logger, *, process: ProcessFn, selector: RectangleSelector
+) -> None:
     citation_count = 0
 
     while True:
         logger.info("Ready to process next citation snapshot")
 
         try:
-            selector = RectangleSelector()
             selector.start_selection()
 
             # Check if user cancelled (pressed Escape)
@@ -27,23 +89,266 @@ if __name__ == "__main__":
                 )
                 break
 
-            logger.info("Selection made")
-            img = selector.capture_image(strict=True)
-            text = extract_text(img)
-            logger.info("Extracted text (%d chars): %s...", len(text), text[:100])
-
-            citation = find_citation(text)
-            logger.info(
-                "Citation prrocessed: %s - %s", citation.entry_type, citation.title
-            )
-            citation_formatted = citation.format(with_cite_key=False)
-            logger.info("Formatted citation:\n%s", citation_formatted)
-
-            import_to_zotero(citation)
+            logger.info("Selection made (overlay shown in %s ms)", _ms(selector))
+            with get_tracer().span("capture", freeze=selector.freeze):
+                img = selector.capture_image(strict=True)
+            process(img, logger)
             citation_count += 1
-            logger.info("Citation #%d added to Zotero successfully", citation_count)
+            logger.info("Citation #%d queued for Zotero", citation_count)
 
         except Exception as e:
             logger.error("Error processing citation: %s", e, exc_info=True)
 
+
+def run_pipelined(
+    logger: logging.Logger,
+    *,
+    workers: int,
+    queue_size: int,
+    process: ProcessFn,
+    selector: RectangleSelector,
+) -> None:
+    pipeline = CapturePipeline(
+        logger, workers=workers, queue_size=queue_size, process=process
+    )
+
+    try:
+        while True:
+            logger.info("Ready to process next citation snapshot")
+
+            try:
+                selector.start_selection()
+
+                # Check if user cancelled (pressed Escape)
+                if not selector.selected:
+                    logger.info("User exited, finishing queued captures")
+                    break
+
+                logger.info("Selection made (overlay shown in %s ms)", _ms(selector))
+                with get_tracer().span("capture", freeze=selector.freeze):
+                    img = selector.capture_image(strict=True)
+                pipeline.submit(img)
+
+            except Exception as e:
+                logger.error("Error capturing citation: %s", e, exc_info=True)
+    finally:
+        pipeline.close()
+
+    logger.info(
+        "Total citations processed: %d (failed: %d)",
+        pipeline.succeeded,
+        pipeline.failed,
+    )
+
+
+def run_async(
+    logger: logging.Logger,
+    *,
+    max_in_flight: int,
+    timeouts: StageTimeouts,
+    process: AsyncProcessFn,
+    selector: RectangleSelector,
+) -> None:
+    pipeline = AsyncCapturePipeline(
+        logger, max_in_flight=max_in_flight, timeouts=timeouts, process=process
+    )
+
+    try:
+        while True:
+            logger.info("Ready to process next citation snapshot")
+
+            try:
+                selector.start_selection()
+
+                # Escape abandons the captures still in flight
+                if not selector.selected:
+                    logger.info("User exited")
+                    break
+
+                logger.info("Selection made (overlay shown in %s ms)", _ms(selector))
+                with get_tracer().span("capture", freeze=selector.freeze):
+                    img = selector.capture_image(strict=True)
+                pipeline.submit(img)
+
+            except Exception as e:
+                logger.error("Error capturing citation: %s", e, exc_info=True)
+    finally:
+        pipeline.close(cancel=True)
+
+    logger.info(
+        "Total citations processed: %d (failed: %d, cancelled: %d)",
+        pipeline.succeeded,
+        pipeline.failed,
+        pipeline.cancelled,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot citations into Zotero.")
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="process captures in the background and reopen the overlay immediately",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=2, help="background workers (pipelined mode)"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=4,
+        help="max captures waiting for a worker before selection blocks",
+    )
+    parser.add_argument(
+        "--async",
+        dest="async_engine",
+        action="store_true",
+        help="process captures as asyncio tasks; Escape cancels unfinished ones",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=4,
+        help="captures processed at once before selection blocks (async mode)",
+    )
+    parser.add_argument(
+        "--ocr-timeout", type=float, default=30.0, help="seconds (async mode)"
+    )
+    parser.add_argument(
+        "--citation-timeout",
+        type=float,
+        default=60.0,
+        help="seconds per citation (async mode)",
+    )
+    parser.add_argument(
+        "--zotero-timeout",
+        type=float,
+        default=30.0,
+        help="seconds per Zotero write request (async mode)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="stay resident and start a selection session on each hotkey signal",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run OCR and query the model, bypassing the local caches",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="do not keep the captures in the local history",
+    )
+    parser.add_argument(
+        "--reference-list",
+        action="store_true",
+        help="treat each capture as a reference list and import every entry in it",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="references parsed at once (reference-list mode)",
+    )
+    parser.add_argument(
+        "--freeze-frame",
+        action="store_true",
+        help="grab the screen when the overlay opens and crop the selection from it",
+    )
+    parser.add_argument(
+        "--bib",
+        metavar="PATH",
+        default=None,
+        help="also append the session's new citations to a .bib file (- for stdout)",
+    )
+    args = parser.parse_args()
+
+    logs_dir = Path(__file__).parent / "logs"
+    logger = get_logger(logs_dir=logs_dir, logger_name=__name__)
+    logger.info("snapcitr started")
+    logger.info("Log file: %s", logs_dir)
+
+    # Also resumes items left in the outbox by earlier runs; in async mode each
+    # session writes through its own sender on the event loop instead
+    outbox_sender = None if args.async_engine else get_outbox_sender()
+    sync_in_background()
+
+    if args.no_cache:
+        get_citation_cache().enabled = False
+        get_capture_cache().enabled = False
+    if args.no_history:
+        get_capture_history().enabled = False
+
+    process: ProcessFn = process_image
+    if args.reference_list:
+        process = functools.partial(
+            process_reference_list, concurrency=args.concurrency
+        )
+
+    bib = BibWriter.open(args.bib) if args.bib else None
+    if bib is not None:
+        process = exporting(process, bib)
+
+    # One overlay window and key listener for all selections of the run
+    selector = RectangleSelector(freeze=args.freeze_frame)
+
+    if args.async_engine:
+        async_process: AsyncProcessFn = process_image_async
+        if args.reference_list:
+            async_process = functools.partial(
+                process_reference_list_async, concurrency=args.concurrency
+            )
+        if bib is not None:
+            async_process = exporting_async(async_process, bib)
+        session = functools.partial(
+            run_async,
+            logger,
+            max_in_flight=args.max_in_flight,
+            timeouts=StageTimeouts(
+                ocr=args.ocr_timeout,
+                citation=args.citation_timeout,
+                zotero=args.zotero_timeout,
+            ),
+            process=async_process,
+            selector=selector,
+        )
+    elif args.pipelined:
+        session = functools.partial(
+            run_pipelined,
+            logger,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            process=process,
+            selector=selector,
+        )
+    else:
+        session = functools.partial(
+            run_sequential, logger, process=process, selector=selector
+        )
+
+    try:
+        if args.daemon:
+            # The daemon runs for days; keep the textfile current meanwhile
+            refresh_prometheus_in_background()
+            SnapcitrDaemon(
+                session, logger, thread_sender=not args.async_engine
+            ).serve_forever()
+        else:
+            session()
+    finally:
+        selector.close()
+        if bib is not None:
+            bib.close()
+            logger.info("Wrote %d citation(s) to %s", bib.count, args.bib)
+
+    logger.info("Citation cache: %s", get_citation_cache().stats())
+    logger.info("Capture cache: %s", get_capture_cache().stats())
+    logger.info("Citation sources: %s", citation_path_stats.stats())
+    if outbox_sender is not None:
+        outbox_sender.close()
+    logger.info("Zotero outbox: %s", get_outbox().stats())
+    get_tracer().close()
+    write_prometheus()
     logger.info("snapcitr closed")
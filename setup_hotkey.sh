@@ -5,6 +5,8 @@ set -e
 
 SERVICE_NAME="snapcitr-hotkey"
 SERVICE_FILE="$HOME/.config/systemd/user/${SERVICE_NAME}.service"
+DAEMON_NAME="snapcitr-daemon"
+DAEMON_FILE="$HOME/.config/systemd/user/${DAEMON_NAME}.service"
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
 echo "Setting up snapcitr hotkey listener..."
@@ -14,15 +16,20 @@ mkdir -p "$HOME/.config/systemd/user"
 
 # Copy service file and substitute repo path
 sed "s|REPO_PATH|${SCRIPT_DIR}|g" "${SCRIPT_DIR}/snapcitr-hotkey.service" > "$SERVICE_FILE"
+sed "s|REPO_PATH|${SCRIPT_DIR}|g" "${SCRIPT_DIR}/snapcitr-daemon.service" > "$DAEMON_FILE"
 
 # Reload systemd
 systemctl --user daemon-reload
 
 # Enable and start the service
+# The daemon keeps snapcitr warm so the hotkey opens the overlay instantly
+systemctl --user enable "${DAEMON_NAME}.service"
+systemctl --user start "${DAEMON_NAME}.service"
 systemctl --user enable "${SERVICE_NAME}.service"
 systemctl --user start "${SERVICE_NAME}.service"
 
 # Check status
+systemctl --user status "${DAEMON_NAME}.service" --no-pager
 systemctl --user status "${SERVICE_NAME}.service" --no-pager
 
 echo ""
@@ -34,4 +41,5 @@ echo "  Status:  systemctl --user status ${SERVICE_NAME}"
 echo "  Stop:    systemctl --user stop ${SERVICE_NAME}"
 echo "  Start:   systemctl --user start ${SERVICE_NAME}"
 echo "  Disable: systemctl --user disable ${SERVICE_NAME}"
-echo "  Logs:    journalctl --user -u ${SERVICE_NAME} -f"
\ No newline at end of file
+echo "  Logs:    journalctl --user -u ${SERVICE_NAME} -f"
+echo "  Daemon:  systemctl --user status ${DAEMON_NAME}"
\ No newline at end of file
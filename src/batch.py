@@ -0,0 +1,364 @@
+"""Headless batch processing of saved snapshots and PDF pages.
+
+OCR runs in a process pool (one process per core); citation parsing and the
+OpenAI calls run in a bounded async pool, and parsed citations go to the Zotero
+outbox. Finished inputs are appended to a state file in the input directory,
+so an interrupted run resumes where it stopped.
+
+Usage: python -m src.batch DIR [--reference-list] [--retry-failed] [--bib OUT.bib]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import time
+import typing as typ
+from pathlib import Path
+
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+from src.bib_export import BibWriter
+from src.import_to_zotero import import_many_to_zotero
+from src.library_index import LibraryIndex, get_library_index, sync_in_background
+from src.outbox import get_outbox, get_outbox_sender
+from src.processing import (
+    DEFAULT_CONCURRENCY,
+    citation_path_stats,
+    extract_citation_text,
+    extract_lines,
+    find_citation_async,
+    get_model_cascade,
+)
+from src.normalize import drop_noise
+from src.references import split_references
+from src.utils import make_async_local_openai_client, make_async_openai_client
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+STATE_FILE_NAME = ".snapcitr_batch.jsonl"
+# Resolution PDF pages are rendered at for OCR
+PDF_DPI = 300
+
+# "partial": some references of the input were imported, others failed
+JobStatus = typ.Literal["imported", "partial", "duplicate", "empty", "failed"]
+
+
+class BatchJob(typ.NamedTuple):
+    path: Path
+    # 0-based page for PDFs, None for images
+    page: int | None = None
+
+    @property
+    def id(self) -> str:
+        if self.page is None:
+            return self.path.name
+        return f"{self.path.name}#p{self.page + 1}"
+
+
+class JobResult(typ.NamedTuple):
+    job_id: str
+    status: JobStatus
+    citations: int = 0
+    titles: tuple[str, ...] = ()
+    error: str | None = None
+    # References of a partial input to parse again with --retry-failed
+    failed_texts: tuple[str, ...] = ()
+
+
+def find_jobs(directory: Path) -> list[BatchJob]:
+    jobs = []
+    for path in sorted(directory.iterdir()):
+        suffix = path.suffix.lower()
+        if suffix in IMAGE_SUFFIXES:
+            jobs.append(BatchJob(path))
+        elif suffix == ".pdf":
+            jobs.extend(BatchJob(path, page) for page in range(_pdf_page_count(path)))
+    return jobs
+
+
+def load_image(job: BatchJob) -> Image:
+    if job.page is None:
+        with PILImage.open(job.path) as img:
+            return img.convert("RGB")
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(job.path)
+    try:
+        return pdf[job.page].render(scale=PDF_DPI / 72).to_pil()
+    finally:
+        pdf.close()
+
+
+def _pdf_page_count(path: Path) -> int:
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        logger.warning("Skipping %s: install pypdfium2 to process PDFs", path.name)
+        return 0
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def ocr_job(job: BatchJob, reference_list: bool) -> list[str]:
+    """Runs in a pool process: load, preprocess and OCR one input.
+
+    The pool already keeps every core busy, so pages are not cut into strips.
+    """
+    img = load_image(job)
+    if reference_list:
+        return split_references(drop_noise(extract_lines(img, workers=1)))
+    text = extract_citation_text(img, workers=1).text
+    return [text] if text else []
+
+
+class BatchState:
+    """Append-only record of finished inputs, one JSON object per line."""
+
+    __slots__ = ("path", "results")
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.results: dict[str, JobResult] = {}
+        if path.exists():
+            for line in path.read_text().splitlines():
+                try:
+                    record = json.loads(line)
+                    result = JobResult(
+                        **{
+                            **record,
+                            "titles": tuple(record["titles"]),
+                            "failed_texts": tuple(record.get("failed_texts", ())),
+                        }
+                    )
+                except (ValueError, TypeError, KeyError):
+                    continue  # A line cut short by an interrupted run
+                self.results[result.job_id] = result
+
+    def is_done(self, job: BatchJob, *, retry_failed: bool) -> bool:
+        result = self.results.get(job.id)
+        return result is not None and not (
+            retry_failed and result.status in ("failed", "partial")
+        )
+
+    def record(self, result: JobResult) -> None:
+        self.results[result.job_id] = result
+        with self.path.open("a") as f:
+            f.write(json.dumps(result._asdict()) + "\n")
+
+
+async def run_batch(
+    jobs: typ.Sequence[BatchJob],
+    state: BatchState,
+    *,
+    reference_list: bool = False,
+    ocr_workers: int | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    bib: BibWriter | None = None,
+) -> list[JobResult]:
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    index = get_library_index()
+    done = 0
+
+    with concurrent.futures.ProcessPoolExecutor(ocr_workers or os.cpu_count()) as pool:
+        async with contextlib.AsyncExitStack() as clients:
+            client = await clients.enter_async_context(make_async_openai_client())
+            local_client = None
+            if any(tier.local for tier in get_model_cascade()):
+                local_client = await clients.enter_async_context(
+                    make_async_local_openai_client()
+                )
+
+            async def process(job: BatchJob) -> JobResult:
+                nonlocal done
+                partial = state.results.get(job.id)
+                if partial is not None and partial.status != "partial":
+                    partial = None
+                try:
+                    if partial is not None:
+                        # Only the references that failed before, without OCR
+                        texts = list(partial.failed_texts)
+                    else:
+                        texts = await loop.run_in_executor(
+                            pool, ocr_job, job, reference_list
+                        )
+                    result = await _parse_and_import(job, texts)
+                except Exception as e:
+                    logger.error("%s failed: %s", job.id, e)
+                    result = JobResult(job.id, "failed", error=str(e))
+                if partial is not None:
+                    result = _merge_retry(partial, result)
+                state.record(result)
+                done += 1
+                logger.info("[%d/%d] %s: %s", done, len(jobs), job.id, result.status)
+                return result
+
+            async def _parse_and_import(job: BatchJob, texts: list[str]) -> JobResult:
+                if not texts:
+                    return JobResult(job.id, "empty")
+                # SQLite and the word index, keep them off the loop
+                new_texts = await asyncio.to_thread(_not_in_library, index, texts)
+                if not new_texts:
+                    return JobResult(job.id, "duplicate")
+
+                async def find_one(text: str) -> typ.Any:
+                    async with semaphore:
+                        return await find_citation_async(
+                            client, text, local_client=local_client
+                        )
+
+                results = await asyncio.gather(
+                    *(find_one(text) for text in new_texts), return_exceptions=True
+                )
+                citations = [r for r in results if not isinstance(r, BaseException)]
+                errors = [r for r in results if isinstance(r, BaseException)]
+                if not citations:
+                    raise errors[0]
+                await asyncio.to_thread(import_many_to_zotero, citations)
+                if bib is not None:
+                    bib.write_all(citations)
+                if not errors:
+                    return JobResult(
+                        job.id,
+                        "imported",
+                        citations=len(citations),
+                        titles=tuple(c.title or c.cite_key for c in citations),
+                    )
+                return JobResult(
+                    job.id,
+                    "partial",
+                    citations=len(citations),
+                    titles=tuple(c.title or c.cite_key for c in citations),
+                    error=f"{len(errors)} reference(s) failed, e.g. {errors[0]}",
+                    failed_texts=tuple(
+                        text
+                        for text, r in zip(new_texts, results)
+                        if isinstance(r, BaseException)
+                    ),
+                )
+
+            return await asyncio.gather(*(process(job) for job in jobs))
+
+
+def _not_in_library(index: LibraryIndex, texts: list[str]) -> list[str]:
+    return [text for text in texts if index.match_text(text) is None]
+
+
+def _merge_retry(partial: JobResult, retry: JobResult) -> JobResult:
+    """The result of a partial input after its failed references were retried."""
+    if retry.status == "failed":
+        # Nothing more was imported; keep the references for the next retry
+        return partial._replace(error=retry.error)
+    return JobResult(
+        partial.job_id,
+        "partial" if retry.status == "partial" else "imported",
+        citations=partial.citations + retry.citations,
+        titles=partial.titles + retry.titles,
+        error=retry.error,
+        failed_texts=retry.failed_texts,
+    )
+
+
+def summarize(results: typ.Iterable[JobResult], elapsed: float) -> str:
+    results = list(results)
+    counts = {s: sum(r.status == s for r in results) for s in typ.get_args(JobStatus)}
+    lines = [
+        f"Processed {len(results)} input(s) in {elapsed:.1f} s: "
+        + ", ".join(f"{n} {status}" for status, n in counts.items()),
+        f"Citations queued for Zotero: {sum(r.citations for r in results)}",
+        f"Citation sources: {citation_path_stats.stats()}",
+        f"Zotero outbox: {get_outbox().stats()}",
+    ]
+    failed = [r for r in results if r.status in ("failed", "partial")]
+    if failed:
+        lines.append("Failed:")
+        lines.extend(f"  {r.job_id}: {r.error}" for r in failed)
+    return "\n".join(lines)
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.batch",
+        description="Extract citations from a directory of snapshots or PDFs.",
+    )
+    parser.add_argument("directory", type=Path)
+    parser.add_argument(
+        "--reference-list",
+        action="store_true",
+        help="treat every input as a reference list with many citations",
+    )
+    parser.add_argument(
+        "--ocr-workers", type=int, default=None, help="OCR processes (default: cores)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="citations parsed at once",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="process inputs that failed in an earlier run again",
+    )
+    parser.add_argument(
+        "--bib",
+        metavar="PATH",
+        default=None,
+        help="also append the new citations to a .bib file (- for stdout)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    state = BatchState(args.directory / STATE_FILE_NAME)
+    jobs = find_jobs(args.directory)
+    pending = [j for j in jobs if not state.is_done(j, retry_failed=args.retry_failed)]
+    logger.info(
+        "%d input(s), %d already done, %d to process",
+        len(jobs),
+        len(jobs) - len(pending),
+        len(pending),
+    )
+
+    sender = get_outbox_sender()
+    sync_in_background().join()
+    bib = BibWriter.open(args.bib) if args.bib else None
+    started = time.perf_counter()
+    try:
+        asyncio.run(
+            run_batch(
+                pending,
+                state,
+                reference_list=args.reference_list,
+                ocr_workers=args.ocr_workers,
+                concurrency=args.concurrency,
+                bib=bib,
+            )
+        )
+    finally:
+        if bib is not None:
+            bib.close()
+    sender.close(timeout=60)
+
+    done_ids = {job.id for job in jobs}
+    print(
+        summarize(
+            (r for r in state.results.values() if r.job_id in done_ids),
+            time.perf_counter() - started,
+        )
+    )
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,122 @@
+"""Streaming export of parsed citations to a `.bib` file.
+
+Entries are formatted and written one at a time as they are produced, so the
+citations of a capture session or a batch run can be dumped without keeping
+them all in memory. Cite keys are made unique within a file by appending
+`b`, `c`, ... to repeated keys, as for several papers of one author and year.
+"""
+
+from __future__ import annotations
+
+import itertools
+import re
+import string
+import sys
+import threading
+import typing as typ
+from pathlib import Path
+
+from src.bibtex import BibTeXEntry, BibTeXRecord
+
+Entry = BibTeXEntry | BibTeXRecord
+
+_ENTRY_KEY_RE = re.compile(r"^\s*@\s*\w+\s*\{\s*([^,\s]+)\s*,")
+
+
+class BibWriter:
+    """Writes entries to a text stream as they come. Safe to share between threads.
+
+    Each `write` is flushed, so the file is complete up to the last entry even
+    if the run is interrupted.
+    """
+
+    __slots__ = ("count", "_out", "_owned", "_keys", "_suffixes", "_lock")
+
+    def __init__(
+        self, out: typ.TextIO, *, owned: bool = False, keys: typ.Iterable[str] = ()
+    ) -> None:
+        self.count = 0
+        self._out = out
+        # Whether `close` closes the stream too
+        self._owned = owned
+        # Cite keys already taken
+        self._keys = set(keys)
+        self._suffixes: dict[str, typ.Iterator[str]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: Path | str, *, append: bool = True) -> BibWriter:
+        """Write to `path`, or to stdout for `-`.
+
+        When appending, the cite keys already in the file are kept unique too.
+        """
+        if str(path) == "-":
+            return cls(sys.stdout)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        keys = read_cite_keys(path) if append and path.exists() else ()
+        out = path.open("a" if append else "w", encoding="utf-8")
+        return cls(out, owned=True, keys=keys)
+
+    def write(self, entry: Entry) -> str:
+        """Write one entry and return the cite key it was written with."""
+        with self._lock:
+            key = self._write(entry)
+            self._out.flush()
+        return key
+
+    def write_all(self, entries: typ.Iterable[Entry]) -> int:
+        """Write entries as they are produced; returns how many were written."""
+        written = 0
+        with self._lock:
+            for entry in entries:
+                self._write(entry)
+                written += 1
+            self._out.flush()
+        return written
+
+    def close(self) -> None:
+        with self._lock:
+            if self._owned:
+                self._out.close()
+            else:
+                self._out.flush()
+
+    def __enter__(self) -> BibWriter:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _write(self, entry: Entry) -> str:
+        key = self._unique_key(entry.cite_key)
+        self._out.write(entry.format(cite_key=key))
+        self._out.write("\n\n")
+        self.count += 1
+        return key
+
+    def _unique_key(self, key: str) -> str:
+        if key in self._keys:
+            # Resume where the previous collision on this key stopped
+            suffixes = self._suffixes.setdefault(key, _suffixes(key))
+            key = next(k for k in suffixes if k not in self._keys)
+        self._keys.add(key)
+        return key
+
+
+def _suffixes(key: str) -> typ.Iterator[str]:
+    yield from (f"{key}{c}" for c in string.ascii_lowercase[1:])
+    yield from (f"{key}-{i}" for i in itertools.count(2))
+
+
+def read_cite_keys(path: Path) -> typ.Iterator[str]:
+    with path.open(encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if (match := _ENTRY_KEY_RE.match(line)) is not None:
+                yield match.group(1)
+
+
+def write_bib(entries: typ.Iterable[Entry], path: Path | str) -> int:
+    """Write `entries` to a new `.bib` file (`-` for stdout) as they are produced."""
+    with BibWriter.open(path, append=False) as writer:
+        return writer.write_all(entries)
@@ -0,0 +1,419 @@
+"""Streaming import of `.bib` files into Zotero.
+
+The file is read line by line and parsed into one `BibTeXEntry` at a time, so
+memory use does not grow with the size of the file. Entries go through the
+same Zotero mapping as captured citations and are queued in the outbox in
+batches of up to 50 items, which are written concurrently. A batch that fails
+stays in the outbox and is retried with its write token like any other.
+
+Usage: python -m src.bib_import references.bib [--workers 4] [--dry-run]
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import logging
+import re
+import threading
+import time
+import typing as typ
+import unicodedata
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from src.bibtex import BibTeXEntry
+from src.import_to_zotero import bibtex_to_zotero_item
+from src.library_index import (
+    LibraryIndex,
+    fingerprint,
+    get_library_index,
+    normalize_doi,
+    normalize_isbns,
+)
+from src.outbox import Outbox, OutboxSender, get_outbox, get_outbox_sender
+from src.zotero_writer import MAX_ITEMS_PER_REQUEST, WriteResult
+
+logger = logging.getLogger(__name__)
+
+# biblatex and non-standard types -> the closest standard BibTeX type
+ENTRY_TYPE_ALIASES: dict[str, str] = {
+    "online": "misc",
+    "electronic": "misc",
+    "www": "misc",
+    "software": "misc",
+    "dataset": "misc",
+    "thesis": "phdthesis",
+    "report": "techreport",
+    "collection": "proceedings",
+    "inreference": "incollection",
+    "mvbook": "book",
+    "periodical": "misc",
+}
+
+# biblatex field names -> BibTeXEntry fields
+FIELD_ALIASES: dict[str, str] = {
+    "journaltitle": "journal",
+    "location": "address",
+    "date": "year",
+}
+
+_MONTHS = {
+    m[:3]: m
+    for m in (
+        "january february march april may june july august september october "
+        "november december"
+    ).split()
+}
+
+_ENTRY_START_RE = re.compile(r"^\s*@\s*(\w+)\s*\{")
+_BRACE_RE = re.compile(r"[{}]")
+_FIELD_NAME_RE = re.compile(r"\s*,?\s*([\w\-:.]+)\s*=\s*")
+_ACCENTS = {'"': "\u0308", "'": "\u0301", "`": "\u0300", "^": "\u0302", "~": "\u0303"}
+_ACCENT_RE = re.compile(r"\\([\"'`^~])\s*\{?\\?([A-Za-z])\}?")
+_ESCAPE_RE = re.compile(r"\\([&%$_#{}])")
+
+_FIELDS = set(BibTeXEntry.model_fields) - {"entry_type", "cite_key"}
+
+# Seconds the outbox senders leave a batch alone while the import writes it
+BATCH_LEASE = 300.0
+
+
+class RawBibEntry(typ.NamedTuple):
+    entry_type: str
+    cite_key: str
+    fields: dict[str, str]
+    line: int
+
+
+def iter_raw_entries(lines: typ.Iterable[str]) -> typ.Iterator[RawBibEntry]:
+    """Yield entries of a `.bib` file as they are completed; `@string` macros are
+    expanded, `@comment` and `@preamble` are skipped."""
+    macros = dict(_MONTHS)
+    chunk: list[str] = []
+    depth = 0
+    start_line = 0
+
+    for line_no, line in enumerate(lines, 1):
+        if not chunk:
+            if not _ENTRY_START_RE.match(line):
+                continue  # Text between entries is a comment in BibTeX
+            start_line = line_no
+        chunk.append(line)
+        for brace in _BRACE_RE.findall(line):
+            depth += 1 if brace == "{" else -1
+        if depth > 0:
+            continue
+
+        text = "".join(chunk)
+        chunk, depth = [], 0
+        match = _ENTRY_START_RE.match(text)
+        assert match is not None
+        kind = match.group(1).lower()
+        body = text[match.end() : text.rstrip().rfind("}")]
+
+        if kind in ("comment", "preamble"):
+            continue
+        if kind == "string":
+            macros.update(_parse_fields(body, macros))
+            continue
+        cite_key, _, rest = body.partition(",")
+        yield RawBibEntry(
+            kind, cite_key.strip(), _parse_fields(rest, macros), start_line
+        )
+
+    if chunk:
+        logger.warning("Unterminated entry starting at line %d", start_line)
+
+
+def iter_bib_file(path: Path) -> typ.Iterator[RawBibEntry]:
+    with path.open(encoding="utf-8", errors="replace") as f:
+        yield from iter_raw_entries(f)
+
+
+def to_bibtex_entry(raw: RawBibEntry) -> tuple[BibTeXEntry, bool]:
+    """Build a validated entry; falls back to `misc` when required fields are
+    missing. The flag tells whether the fallback was needed."""
+    entry_type = ENTRY_TYPE_ALIASES.get(raw.entry_type, raw.entry_type)
+    if entry_type not in typ.get_args(
+        BibTeXEntry.model_fields["entry_type"].annotation
+    ):
+        entry_type = "misc"
+
+    fields: dict[str, typ.Any] = {}
+    for name, value in raw.fields.items():
+        name = FIELD_ALIASES.get(name, name)
+        if name in _FIELDS and value and name not in fields:
+            fields[name] = value
+    if "year" in fields:
+        year = re.search(r"\d{4}", fields["year"])
+        fields["year"] = int(year.group()) if year else None
+    if "month" in fields:
+        fields["month"] = _MONTHS.get(fields["month"][:3].lower(), fields["month"])
+
+    try:
+        return (
+            BibTeXEntry(entry_type=entry_type, cite_key=raw.cite_key, **fields),
+            False,
+        )
+    except ValidationError:
+        return BibTeXEntry(entry_type="misc", cite_key=raw.cite_key, **fields), True
+
+
+def _parse_fields(body: str, macros: dict[str, str]) -> dict[str, str]:
+    fields: dict[str, str] = {}
+    pos = 0
+    while (match := _FIELD_NAME_RE.match(body, pos)) is not None:
+        name = match.group(1).lower()
+        value, pos = _parse_value(body, match.end(), macros)
+        fields[name] = _clean(value)
+    return fields
+
+
+def _parse_value(body: str, pos: int, macros: dict[str, str]) -> tuple[str, int]:
+    """Parse `part # part # ...` starting at `pos`; return the value and end offset."""
+    parts = []
+    while True:
+        while pos < len(body) and body[pos].isspace():
+            pos += 1
+        if pos >= len(body):
+            break
+        if body[pos] == "{":
+            end = _matching_brace(body, pos)
+            parts.append(body[pos + 1 : end])
+            pos = end + 1
+        elif body[pos] == '"':
+            end = pos + 1
+            depth = 0
+            while end < len(body) and (body[end] != '"' or depth > 0):
+                depth += {"{": 1, "}": -1}.get(body[end], 0)
+                end += 1
+            parts.append(body[pos + 1 : end])
+            pos = end + 1
+        else:
+            token = re.match(r"[^\s,#}]+", body[pos:])
+            if token is None:
+                break
+            word = token.group()
+            parts.append(macros.get(word.lower(), word))
+            pos += len(word)
+
+        while pos < len(body) and body[pos].isspace():
+            pos += 1
+        if pos < len(body) and body[pos] == "#":
+            pos += 1
+            continue
+        break
+    return "".join(parts), pos
+
+
+def _matching_brace(text: str, start: int) -> int:
+    depth = 0
+    for match in _BRACE_RE.finditer(text, start):
+        depth += 1 if match.group() == "{" else -1
+        if depth == 0:
+            return match.start()
+    return len(text)
+
+
+def _clean(value: str) -> str:
+    value = _ACCENT_RE.sub(lambda m: m.group(2) + _ACCENTS[m.group(1)], value)
+    value = _ESCAPE_RE.sub(r"\1", value).replace("{", "").replace("}", "")
+    value = unicodedata.normalize("NFC", value)
+    return re.sub(r"\s+", " ", value).strip()
+
+
+class ImportProgress:
+    """Thread-safe counters for a running import."""
+
+    __slots__ = (
+        "started",
+        "parsed",
+        "downgraded",
+        "invalid",
+        "duplicates",
+        "written",
+        "unchanged",
+        "failed",
+        "retrying",
+        "_lock",
+    )
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.parsed = 0
+        self.downgraded = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.written = 0
+        self.unchanged = 0
+        self.failed = 0
+        # Left in the outbox after a failed request, to be retried
+        self.retrying = 0
+        self._lock = threading.Lock()
+
+    def record_results(self, results: typ.Sequence[WriteResult]) -> None:
+        with self._lock:
+            for result in results:
+                if result.status == "successful":
+                    self.written += 1
+                elif result.status == "unchanged":
+                    self.unchanged += 1
+                else:
+                    self.failed += 1
+
+    def record_retrying(self, size: int) -> None:
+        with self._lock:
+            self.retrying += size
+
+    @property
+    def entries_per_second(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.parsed / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.parsed} parsed ({self.entries_per_second:.0f}/s), "
+            f"{self.written} written, {self.unchanged} unchanged, "
+            f"{self.duplicates} duplicates, {self.failed} failed, "
+            f"{self.retrying} left in the outbox for retry, "
+            f"{self.invalid} invalid, {self.downgraded} imported as misc"
+        )
+
+
+def import_bib_file(
+    path: Path,
+    *,
+    outbox: Outbox | None = None,
+    sender: OutboxSender | None = None,
+    index: LibraryIndex | None = None,
+    workers: int = 4,
+    dry_run: bool = False,
+    progress_every: float = 2.0,
+) -> ImportProgress:
+    """Stream `path` into Zotero through the outbox, with up to `workers` batch
+    requests in flight.
+
+    With an `index`, entries already in the library or earlier in the file are
+    skipped.
+    """
+    if not dry_run:
+        outbox = outbox or get_outbox()
+        sender = sender or get_outbox_sender()
+    progress = ImportProgress()
+    last_report = time.perf_counter()
+    # DOIs, ISBNs and fingerprints of the entries queued by this import, which
+    # are not in the library index before they are written
+    queued: set[str] = set()
+
+    with concurrent.futures.ThreadPoolExecutor(
+        workers, thread_name_prefix="snapcitr-bib"
+    ) as executor:
+        in_flight: set[concurrent.futures.Future[None]] = set()
+
+        def submit(batch: list[dict[str, typ.Any]]) -> None:
+            # Bound the number of batches held in memory
+            while len(in_flight) >= 2 * workers:
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                in_flight.difference_update(done)
+            assert outbox is not None and sender is not None
+            token, rows = outbox.enqueue_batch(batch, lease=BATCH_LEASE)
+            in_flight.add(executor.submit(_write_batch, sender, token, rows, progress))
+
+        batch: list[dict[str, typ.Any]] = []
+        for raw in iter_bib_file(path):
+            progress.parsed += 1
+            try:
+                entry, downgraded = to_bibtex_entry(raw)
+            except ValidationError as e:
+                progress.invalid += 1
+                logger.warning("Skipping %s (line %d): %s", raw.cite_key, raw.line, e)
+                continue
+            progress.downgraded += downgraded
+
+            item = bibtex_to_zotero_item(entry)
+            if index is not None:
+                keys = _duplicate_keys(item)
+                if not queued.isdisjoint(keys) or index.find_duplicate(item):
+                    progress.duplicates += 1
+                    continue
+                queued.update(keys)
+            if dry_run:
+                continue
+
+            batch.append(item)
+            if len(batch) == MAX_ITEMS_PER_REQUEST:
+                submit(batch)
+                batch = []
+
+            if time.perf_counter() - last_report >= progress_every:
+                logger.info("Progress: %s", progress)
+                last_report = time.perf_counter()
+
+        if batch:
+            submit(batch)
+        concurrent.futures.wait(in_flight)
+
+    logger.info("Done: %s", progress)
+    return progress
+
+
+def _duplicate_keys(item: dict[str, typ.Any]) -> set[str]:
+    """What `LibraryIndex.find_duplicate` compares: DOI, ISBNs and fingerprint."""
+    keys = {f"isbn:{isbn}" for isbn in normalize_isbns(item.get("ISBN") or "")}
+    if item.get("DOI"):
+        keys.add(f"doi:{normalize_doi(item['DOI'])}")
+    if (fp := fingerprint(item)) is not None:
+        keys.add(f"fingerprint:{fp}")
+    return keys
+
+
+def _write_batch(
+    sender: OutboxSender,
+    token: str,
+    rows: list[tuple[int, dict[str, typ.Any]]],
+    progress: ImportProgress,
+) -> None:
+    # Rejected items are logged and marked failed in the outbox by the sender
+    results = sender.send_batch(token, rows)
+    if results is None:
+        progress.record_retrying(len(rows))
+        # Now due for a retry by the sender, after its backoff
+        sender.wake()
+    else:
+        progress.record_results(results)
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.bib_import", description="Import a .bib file into Zotero."
+    )
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--workers", type=int, default=4, help="concurrent requests")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="parse and map only, write nothing"
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="import entries even if they are already in the library",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    index = None
+    if not args.no_dedup:
+        index = get_library_index()
+        index.sync()
+    import_bib_file(args.path, index=index, workers=args.workers, dry_run=args.dry_run)
+    if not args.dry_run:
+        # Give batches that failed a chance to go out before exiting; the rest
+        # stays in the outbox for the next run
+        get_outbox_sender().close(timeout=60)
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import json
+import re
 import typing as typ
 
 from pydantic import BaseModel, model_validator
@@ -46,6 +48,14 @@ REQUIRED_FIELDS: dict[str, list[str]] = {
 AUTHOR_OR_EDITOR_TYPES = {"book", "inbook", "proceedings"}
 
 
+def make_cite_key(last_name: str | None, year: int | None, title: str | None) -> str:
+    """Build an `authorYearTitleword` key, e.g. `lecun2015deep`."""
+    title_words = re.findall(r"[^\W\d_]+", title or "")
+    first_word = next((w for w in title_words if len(w) > 3), "")
+    key = f"{(last_name or 'anon').lower()}{year or ''}{first_word.lower()}"
+    return re.sub(r"\W", "", key)
+
+
 class BibTeXEntry(BaseModel):
     entry_type: BibTeXEntryType
     cite_key: str
@@ -108,16 +118,169 @@ class BibTeXEntry(BaseModel):
             raise ValueError(f"'{entry_type}' requires: {missing}")
         return self
 
-    def format(self, *, with_cite_key: bool = True) -> str:
-        """Format this BibTeX entry into a proper BibTeX string."""
-        lines = [
-            f"@{self.entry_type}{{{self.cite_key + ',' if with_cite_key else ''}",
-        ]
+    def format(self, *, with_cite_key: bool = True, cite_key: str | None = None) -> str:
+        """Format this BibTeX entry into a proper BibTeX string.
+
+        `cite_key` is written instead of the entry's own key, if given.
+        """
+        key = (cite_key or self.cite_key) + "," if with_cite_key else ""
+        values = self.__dict__
+        return _format(
+            self.entry_type, key, ((name, values[name]) for name in _OPTIONAL_FIELDS)
+        )
+
+
+class BibTeXRecord(typ.NamedTuple):
+    """A BibTeX entry as a plain tuple, for bulk work on already validated data.
+
+    Building one skips pydantic entirely and it takes a fraction of the memory
+    of a `BibTeXEntry`, so construct records directly only from trusted data
+    (the citation cache, entries validated earlier) and go through `validate`
+    for anything else. Fields are the same, in the same order.
+    """
+
+    entry_type: BibTeXEntryType
+    cite_key: str
+    author: str | None = None
+    editor: str | None = None
+    title: str | None = None
+    year: int | None = None
+    journal: str | None = None
+    booktitle: str | None = None
+    publisher: str | None = None
+    school: str | None = None
+    institution: str | None = None
+    organization: str | None = None
+    volume: str | None = None
+    number: str | None = None
+    pages: str | None = None
+    chapter: str | None = None
+    series: str | None = None
+    edition: str | None = None
+    doi: str | None = None
+    url: str | None = None
+    isbn: str | None = None
+    issn: str | None = None
+    address: str | None = None
+    month: str | None = None
+    note: str | None = None
+    howpublished: str | None = None
+    type: str | None = None
+    abstract: str | None = None
+    keywords: str | None = None
+
+    @classmethod
+    def validate(cls, **fields: typ.Any) -> BibTeXRecord:
+        """Validate untrusted fields once, like `BibTeXEntry(**fields)`."""
+        return cls.from_entry(BibTeXEntry(**fields))
+
+    @classmethod
+    def from_entry(cls, entry: BibTeXEntry) -> BibTeXRecord:
+        values = entry.__dict__
+        return cls._make([values[name] for name in _FIELDS])
+
+    @classmethod
+    def from_json(cls, data: str | bytes) -> BibTeXRecord:
+        """Read `BibTeXEntry.model_dump_json` output without validating again.
+
+        Keys that are not fields (say, of a field since removed) are ignored.
+        """
+        values = json.loads(data)
+        return cls(**{name: values[name] for name in cls._fields if name in values})
+
+    def to_entry(self) -> BibTeXEntry:
+        """The pydantic model, without validating again."""
+        return BibTeXEntry.model_construct(
+            {name for name, value in zip(_FIELDS, self) if value is not None},
+            **self._asdict(),
+        )
+
+    def format(self, *, with_cite_key: bool = True, cite_key: str | None = None) -> str:
+        """`BibTeXEntry.format` for a record."""
+        key = (cite_key or self.cite_key) + "," if with_cite_key else ""
+        return _format(self.entry_type, key, zip(_OPTIONAL_FIELDS, self[2:]))
+
+
+def _format(
+    entry_type: str, key: str, fields: typ.Iterable[tuple[str, str | int | None]]
+) -> str:
+    lines = [f"@{entry_type}{{{key}"]
+    for name, value in fields:
+        if value is not None:
+            lines.append(f"  {name} = {{{_escape_field(name, value)}}},")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+_FIELDS = tuple(BibTeXEntry.model_fields)
+assert BibTeXRecord._fields == _FIELDS, "BibTeXRecord is out of sync with BibTeXEntry"
+# Fields in declaration order, computed once instead of from the JSON schema on
+# every `format` call
+_OPTIONAL_FIELDS = tuple(
+    name for name, field in BibTeXEntry.model_fields.items() if not field.is_required()
+)
+# Printed as is; braces are percent-encoded so that they cannot end the value
+_VERBATIM_FIELDS = {"url", "doi"}
+_VERBATIM_ESCAPES = str.maketrans({"{": "%7B", "}": "%7D"})
+# Replacements of the characters that are special to (La)TeX
+_ESCAPES = {
+    "\\": r"\textbackslash{}",
+    "{": r"\textbraceleft{}",
+    "}": r"\textbraceright{}",
+    "&": r"\&",
+    "%": r"\%",
+    "$": r"\$",
+    "#": r"\#",
+    "_": r"\_",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}",
+}
+_SPECIAL_RE = re.compile(r"[\\{}&%$#_~^]")
+# A control word or symbol (`\emph`, `\"`, `\&`) or a single special character
+_TOKEN_RE = re.compile(r"\\(?:[A-Za-z]+|[^A-Za-z])|[\\{}&%$#_~^]")
+
+
+def escape_bibtex(text: str) -> str:
+    """Escape the bare characters that are special to (La)TeX in `text`.
+
+    TeX markup is kept: control sequences (`M{\\"u}ller`, `\\&`) and balanced
+    braces (`{RNA}`). Only braces without a partner are replaced, because
+    BibTeX counts every brace, escaped or not, to find the end of the value.
+    """
+    if not _SPECIAL_RE.search(text):
+        return text
+    tokens = list(_TOKEN_RE.finditer(text))
+    unmatched: set[int] = set()
+    opened: list[int] = []
+    for match in tokens:
+        if match.group() in ("{", "\\{"):
+            opened.append(match.start())
+        elif match.group() in ("}", "\\}"):
+            if opened:
+                opened.pop()
+            else:
+                unmatched.add(match.start())
+    unmatched.update(opened)
+
+    parts = []
+    end = 0
+    for match in tokens:
+        token = match.group()
+        parts.append(text[end : match.start()])
+        end = match.end()
+        if match.start() in unmatched:
+            parts.append(_ESCAPES[token[-1]])
+        elif len(token) > 1 or token in "{}":
+            parts.append(token)
+        else:
+            parts.append(_ESCAPES[token])
+    parts.append(text[end:])
+    return "".join(parts)
 
-        schema = BibTeXEntry.model_json_schema()
-        for p in schema["properties"]:
-            if p not in schema["required"] and getattr(self, p) is not None:
-                lines.append(f"  {p} = {{{getattr(self, p)}}},")
 
-        lines.append("}")
-        return "\n".join(lines)
+def _escape_field(name: str, value: str | int) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if name in _VERBATIM_FIELDS:
+        return value.translate(_VERBATIM_ESCAPES)
+    return escape_bibtex(value)
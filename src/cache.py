@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+from src.utils import DATA_DIR
+
+CITATION_CACHE_PATH = DATA_DIR / "citation_cache.sqlite"
+
+
+def normalize_citation_text(text: str) -> str:
+    """Normalize OCR output so that re-captures of the same reference hash equally."""
+    text = unicodedata.normalize("NFKC", text)
+    # Join words hyphenated across line breaks
+    text = re.sub(r"(\w)-\s*\n\s*(\w)", r"\1\2", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip().casefold()
+
+
+def make_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+class SQLiteCache:
+    """Small persistent key -> text cache with entry-count and age based eviction.
+
+    Safe to share between threads. Hit/miss counters are kept per process.
+    """
+
+    __slots__ = (
+        "path",
+        "max_entries",
+        "max_age_seconds",
+        "enabled",
+        "hits",
+        "misses",
+        "_conn",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        max_entries: int = 10_000,
+        max_age_seconds: float | None = None,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.enabled: bool = True
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self._expired(row[1], now):
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                self._conn.commit()
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return (
+            self.max_age_seconds is not None
+            and now - created_at > self.max_age_seconds
+        )
+
+    def _evict(self, now: float) -> None:
+        if self.max_age_seconds is not None:
+            self._conn.execute(
+                "DELETE FROM cache WHERE created_at < ?", (now - self.max_age_seconds,)
+            )
+        # Drop least recently used entries beyond the size limit
+        self._conn.execute(
+            """DELETE FROM cache WHERE key IN (
+                SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+
+
+@lru_cache(maxsize=1)
+def get_citation_cache() -> SQLiteCache:
+    return SQLiteCache(
+        CITATION_CACHE_PATH, max_entries=5_000, max_age_seconds=180 * 24 * 3600
+    )
@@ -0,0 +1,181 @@
+"""Cache of processed captures keyed by the text block in the image.
+
+Selecting the same region again (a little wider or narrower, say after a failed
+Zotero write) gives the same text block pixel for pixel, so its OCR text and
+parsed citation are reused instead of running OCR and parsing it again.
+
+Only identical text blocks match. References that differ in a few characters
+(say, the year and pages) differ in a few pixels only, and no similarity
+threshold tells them apart from a re-render at another zoom level without OCR.
+Such captures are OCRed again; their citation may still come from the citation
+cache, which is keyed by the OCR text.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import typing as typ
+from functools import lru_cache
+from pathlib import Path
+
+from dotenv import load_dotenv
+from PIL import Image as PILImage
+from PIL import ImageChops, ImageOps
+from PIL.Image import Image
+
+from src.bibtex import BibTeXEntry
+from src.processing import PROMPT_VERSION, get_model_cascade
+from src.utils import DATA_DIR
+
+CAPTURE_CACHE_PATH = DATA_DIR / "capture_cache.sqlite"
+
+DEFAULT_MAX_ENTRIES = 1_000
+
+
+def capture_key(img: Image) -> str:
+    """Digest of the text block in `img`: which pixels stand out from the
+    background.
+
+    The image is cropped to what differs from the background (the corner
+    pixel, so dark themes work too) first, so the margins of the selection
+    do not change the key.
+    """
+    gray = ImageOps.autocontrast(img.convert("L"))
+    background = PILImage.new("L", gray.size, gray.getpixel((0, 0)))
+    mask = ImageChops.difference(gray, background).point(lambda v: 255 * (v > 64))
+    if (bbox := mask.getbbox()) is not None:
+        mask = mask.crop(bbox)
+    digest = hashlib.blake2b(f"{mask.width}x{mask.height}".encode(), digest_size=16)
+    digest.update(mask.tobytes())
+    return digest.hexdigest()
+
+
+def parser_version() -> str:
+    """What a parsed citation depends on besides the text: the model cascade and
+    the prompt."""
+    cascade = ",".join(tier.spec for tier in get_model_cascade())
+    return f"{cascade}|{PROMPT_VERSION}"
+
+
+class CachedCapture(typ.NamedTuple):
+    # The normalized OCR text
+    text: str
+    # None when the capture was already in the library, or was parsed with
+    # another model cascade or prompt
+    citation: BibTeXEntry | None
+
+
+class CaptureCache:
+    """Persistent capture key -> (OCR text, citation) cache with least recently
+    used eviction beyond `max_entries`.
+
+    Safe to share between threads. Hit/miss counters are kept per process.
+    """
+
+    __slots__ = ("path", "max_entries", "enabled", "hits", "misses", "_conn", "_lock")
+
+    def __init__(
+        self, path: Path = CAPTURE_CACHE_PATH, *, max_entries: int = DEFAULT_MAX_ENTRIES
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled: bool = True
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Entries of earlier versions, keyed by a perceptual hash
+        self._conn.execute("DROP TABLE IF EXISTS captures")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS text_blocks (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                citation TEXT,
+                parser TEXT NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS text_blocks_accessed ON text_blocks (accessed_at)"
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM text_blocks").fetchone()[0]
+
+    def get(self, key: str) -> CachedCapture | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, citation, parser FROM text_blocks WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE text_blocks SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self._conn.commit()
+            self.hits += 1
+        text, citation, parser = row
+        # The OCR text stays valid, a citation parsed by other models does not
+        if citation is None or parser != parser_version():
+            return CachedCapture(text, None)
+        return CachedCapture(text, BibTeXEntry.model_validate_json(citation))
+
+    def set(self, key: str, text: str, citation: BibTeXEntry | None) -> None:
+        if not self.enabled:
+            return
+        value = None if citation is None else citation.model_dump_json()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO text_blocks VALUES (?, ?, ?, ?, ?)",
+                (key, text, value, parser_version(), time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM text_blocks")
+            self._conn.commit()
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _evict(self) -> None:
+        # Least recently used entries beyond the size limit
+        self._conn.execute(
+            """DELETE FROM text_blocks WHERE key IN (
+                SELECT key FROM text_blocks ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+
+
+@lru_cache(maxsize=1)
+def get_capture_cache() -> CaptureCache:
+    """The cache at `CAPTURE_CACHE_PATH`, holding
+    `SNAPCITR_CAPTURE_CACHE_MAX_ENTRIES` captures."""
+    load_dotenv()
+    return CaptureCache(
+        max_entries=int(
+            os.environ.get("SNAPCITR_CAPTURE_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES
+        )
+    )
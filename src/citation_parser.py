@@ -0,0 +1,277 @@
+"""Local, deterministic parser for common reference styles.
+
+Recognizes APA, MLA, Chicago, IEEE, ACM and Nature-style (numbered) references
+and scores how complete the result is, so that the LLM only has to handle the
+captures this parser is unsure about.
+"""
+
+from __future__ import annotations
+
+import re
+import typing as typ
+
+from pydantic import ValidationError
+
+from src.bibtex import BibTeXEntry, make_cite_key
+
+CitationStyle = typ.Literal["apa", "mla", "chicago", "ieee", "acm", "nature"]
+
+
+class ParsedCitation(typ.NamedTuple):
+    entry: BibTeXEntry
+    confidence: float
+    style: CitationStyle
+
+
+# "LeCun, Y." / "van der Maaten, L. J. P."
+_INVERTED_NAME = r"[^\W\d][\w'’\- ]*?,\s*(?:[A-Z][a-z]?\.\s?-?)+"
+_INVERTED_LIST = (
+    rf"{_INVERTED_NAME}(?:(?:,\s*(?:&\s*|and\s+)?|\s+(?:&|and)\s+){_INVERTED_NAME})*"
+    r"(?:,?\s*et al\.)?"
+)
+_QUOTE_OPEN = '["“]'
+_QUOTE_CLOSE = '["”]'
+
+# Everything before the venue; the venue itself is parsed by `_parse_venue`
+_HEADS: list[tuple[CitationStyle, re.Pattern[str]]] = [
+    (
+        "apa",
+        re.compile(
+            rf"^(?P<authors>{_INVERTED_LIST})\s*\((?P<year>\d{{4}})[a-z]?[^)]*\)\.\s*"
+            r"(?P<title>.+?[.?!])\s+(?P<rest>.+)$"
+        ),
+    ),
+    (
+        "nature",
+        re.compile(
+            rf"^(?P<authors>{_INVERTED_LIST})\s+(?P<title>[^.?!]+[.?!])\s+"
+            r"(?P<rest>.+?\((?P<year>\d{4})\))\.?$"
+        ),
+    ),
+    (
+        "ieee",
+        re.compile(
+            rf"^(?P<authors>[^“\"]+?),\s*{_QUOTE_OPEN}(?P<title>.+?)[,.]?{_QUOTE_CLOSE}"
+            r",?\s*(?P<rest>.+)$"
+        ),
+    ),
+    (
+        "acm",
+        re.compile(
+            r"^(?P<authors>[^“\"]+?)\.\s+(?P<year>\d{4})[a-z]?\.\s+"
+            rf"{_QUOTE_OPEN}?(?P<title>.+?[.?!]){_QUOTE_CLOSE}?\s+(?P<rest>.+)$"
+        ),
+    ),
+    (
+        "mla",
+        re.compile(
+            rf"^(?P<authors>[^“\"]+?)\.\s*{_QUOTE_OPEN}(?P<title>.+?)[.?!]?{_QUOTE_CLOSE}"
+            r"\s*(?P<rest>.+)$"
+        ),
+    ),
+    (
+        # Chicago books: `Last, First. Title. City: Publisher, 2015.`
+        "chicago",
+        re.compile(
+            r"^(?P<authors>[^“\".]+?)\.\s+(?P<title>[^.“\"]+?)\.\s+"
+            r"(?P<rest>[^.:]+:\s*[^.]+?,\s*\d{4})\.?$"
+        ),
+    ),
+]
+
+_LEADING_NUMBER_RE = re.compile(r"^\s*(?:\[\d+\]|\d+\.)\s*")
+_DOI_RE = re.compile(r"(?:https?://(?:dx\.)?doi\.org/|doi:\s*)?(10\.\d{4,9}/\S+)", re.I)
+_URL_RE = re.compile(
+    r"(?:Available(?: at)?:\s*|Retrieved from\s+)?(https?://\S+)", re.I
+)
+_YEAR_RE = re.compile(r"\b(1[5-9]\d{2}|20\d{2})\b")
+_PAGES_RE = re.compile(r"\bpp?\.\s*(\d+(?:\s*[-–—]+\s*\d+)?)|\b(\d+\s*[-–—]+\s*\d+)\b")
+_VOLUME_RE = re.compile(r"\bvol\.\s*(\w+)|^\s*,?\s*(\d+)\b", re.I)
+_NUMBER_RE = re.compile(
+    r"\bno\.\s*(\w+)|^\s*,?\s*\d+\s*\((\w+)\)|^\s*,?\s*\d+,\s*(\d+)\s*\(", re.I
+)
+_CONFERENCE_RE = re.compile(
+    r"\b(?:Proc\.|Proceedings|Conference|Conf\.|Workshop|Symposium|Symp\.)", re.I
+)
+_EDITED_RE = re.compile(r"\((?:Eds?|eds?)\.\)|\bed(?:ited)? by\b|\bEds?\.,", re.I)
+_CITY_PUBLISHER_RE = re.compile(
+    r"(?:^|[.,]\s*)[A-Z][\w .'-]*?:\s*(?P<publisher>[^.:]+?)(?:,\s*\d{4})?(?:\.|$)"
+)
+_CHICAGO_YEAR_RE = re.compile(r"\((?:\w+\.?\s+)?\d{4}\)\s*:")
+
+
+def parse_citation(citation_text: str) -> ParsedCitation | None:
+    """Parse a single reference, returning the most complete interpretation."""
+    text = _LEADING_NUMBER_RE.sub("", re.sub(r"\s+", " ", citation_text)).strip()
+    best: ParsedCitation | None = None
+
+    for style, head in _HEADS:
+        match = head.match(text)
+        if match is None:
+            continue
+        parsed = _build(_refine_style(style, match["rest"]), match)
+        if parsed is not None and (best is None or parsed.confidence > best.confidence):
+            best = parsed
+
+    return best
+
+
+def _refine_style(style: CitationStyle, rest: str) -> CitationStyle:
+    # MLA and Chicago notes share the `Author. "Title."` head
+    if style == "mla" and _CHICAGO_YEAR_RE.search(rest):
+        return "chicago"
+    return style
+
+
+def _build(style: CitationStyle, match: re.Match[str]) -> ParsedCitation | None:
+    authors, complete_authors = _parse_authors(match["authors"])
+    title = match["title"].strip().rstrip(".").strip() or None
+    venue = _parse_venue(match["rest"])
+
+    # Styles that put the year in the head are more reliable than a year in the venue
+    venue_year = venue.pop("year", None)
+    year_text = match.groupdict().get("year") or venue_year
+    year = int(year_text) if year_text else None
+
+    author = " and ".join(
+        f"{last}, {given}" if given else last for last, given in authors
+    )
+    fields: dict[str, typ.Any] = {
+        "cite_key": make_cite_key(authors[0][0] if authors else None, year, title),
+        "author": author or None,
+        "title": title,
+        "year": year,
+        **venue,
+    }
+    try:
+        entry = BibTeXEntry(**fields)
+    except ValidationError:
+        return None
+
+    return ParsedCitation(entry, _confidence(entry, complete_authors), style)
+
+
+def _confidence(entry: BibTeXEntry, complete_authors: bool) -> float:
+    score = 0.0
+    if entry.author:
+        score += 0.3 if complete_authors else 0.15
+    if entry.title and 2 <= len(entry.title.split()) <= 40:
+        score += 0.2
+    if entry.year is not None and 1500 <= entry.year <= 2100:
+        score += 0.2
+    if entry.journal or entry.booktitle or entry.publisher or entry.howpublished:
+        score += 0.2
+    if entry.volume or entry.pages or entry.doi:
+        score += 0.1
+    return round(score, 2)
+
+
+def _parse_authors(text: str) -> tuple[list[tuple[str, str]], bool]:
+    """Split an author list into `(last, given)` pairs.
+
+    The flag is False when the list is truncated (`et al.`) or some name did not
+    look like a personal name.
+    """
+    text, n_et_al = re.subn(r",?\s*et al\.?$", "", text.strip())
+    complete = not n_et_al
+    text = text.rstrip(", ")
+
+    if re.fullmatch(_INVERTED_LIST, text):
+        # APA / Nature: `Last, I., Last, I. & Last, I.`
+        pairs = re.findall(r"([^\W\d][\w'’\- ]*?),\s*((?:[A-Z][a-z]?\.\s?-?)+)", text)
+        authors = [(_strip_conjunction(last), given.strip()) for last, given in pairs]
+    else:
+        pieces = [
+            p.strip()
+            for p in re.split(
+                r",\s*(?:and|&)\s+|\s+(?:and|&)\s+|,\s*", text.rstrip(".")
+            )
+            if p.strip()
+        ]
+        authors = []
+        if len(pieces) >= 2 and " " not in pieces[0]:
+            # MLA / Chicago: only the first author is inverted
+            authors.append((pieces[0], pieces[1]))
+            pieces = pieces[2:]
+        for piece in pieces:
+            given, _, last = piece.rpartition(" ")
+            authors.append((last, given))
+
+    for last, given in authors:
+        if not re.fullmatch(r"[^\W\d][\w'’\-]*(?: [^\W\d][\w'’\-]*){0,2}", last) or (
+            given and not re.fullmatch(r"[\w.'’\- ]+", given)
+        ):
+            return authors, False
+        if len(given.split()) > 3:
+            return authors, False
+    return authors, complete
+
+
+def _strip_conjunction(name: str) -> str:
+    return re.sub(r"^(?:&|and)\s+", "", name.strip())
+
+
+def _parse_venue(rest: str) -> dict[str, typ.Any]:
+    """Pull the container, locators and identifiers out of the text after the title."""
+    fields: dict[str, typ.Any] = {}
+
+    if doi := _DOI_RE.search(rest):
+        fields["doi"] = doi.group(1).rstrip(".,;")
+        rest = rest[: doi.start()] + rest[doi.end() :]
+    if url := _URL_RE.search(rest):
+        fields["url"] = url.group(1).rstrip(".,;")
+        rest = rest[: url.start()] + rest[url.end() :]
+    rest = rest.strip(" .,")
+
+    years = _YEAR_RE.findall(rest)
+    if years:
+        fields["year"] = years[-1]
+
+    if "arxiv" in rest.lower():
+        fields["entry_type"] = "misc"
+        fields["howpublished"] = rest
+        return fields
+
+    in_container = re.match(r"^[Ii]n:?\s+", rest)
+    body = rest[in_container.end() :] if in_container else rest
+
+    if in_container and _EDITED_RE.search(body):
+        # Chapter in an edited book; the editors are not kept
+        fields["entry_type"] = "incollection"
+        booktitle = re.split(r"\s*\((?:pp|Eds?|eds?)\.|,\s*pp?\.|\.\s", body)[0]
+        if _EDITED_RE.search(booktitle):
+            booktitle = _EDITED_RE.split(booktitle)[-1]
+        fields["booktitle"] = booktitle.strip(" ,.")
+        if publisher := _publisher(body):
+            fields["publisher"] = publisher
+    elif in_container or _CONFERENCE_RE.search(body.split(",")[0]):
+        fields["entry_type"] = "inproceedings"
+        booktitle = re.split(
+            r"\s*\(|,\s*(?:pp?\.|vol\.|\d|[A-Z][a-z]{2}\.?\s+\d{4})", body
+        )[0]
+        fields["booktitle"] = booktitle.strip(" ,.")
+    else:
+        container = re.split(r",|\s+(?=\d)|\s+(?=vol\.)|\s*\(", body, maxsplit=1)[0]
+        tail = body[len(container) :]
+        if re.search(r"\d", tail) and not _CITY_PUBLISHER_RE.match(body):
+            fields["entry_type"] = "article"
+            fields["journal"] = container.strip(" ,.")
+            volume = _VOLUME_RE.search(tail)
+            if volume and (volume.group(1) or volume.group(2)) != fields.get("year"):
+                fields["volume"] = volume.group(1) or volume.group(2)
+            if number := _NUMBER_RE.search(tail):
+                fields["number"] = next(g for g in number.groups() if g)
+        else:
+            fields["entry_type"] = "book"
+            fields["publisher"] = _publisher(body) or container.strip(" ,.") or None
+
+    if pages := _PAGES_RE.search(rest):
+        fields["pages"] = re.sub(r"\s*[-–—]+\s*", "-", pages.group(1) or pages.group(2))
+
+    return fields
+
+
+def _publisher(text: str) -> str | None:
+    if match := _CITY_PUBLISHER_RE.search(text):
+        return match["publisher"].strip() or None
+    return None
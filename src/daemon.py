@@ -0,0 +1,172 @@
+"""Resident snapcitr daemon controlled over a local Unix socket.
+
+Only the standard library is imported at module level so that the hotkey
+listener can use `send_command` without paying for the heavy imports.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import socket
+import tempfile
+import threading
+import typing as typ
+from pathlib import Path
+
+SOCKET_PATH = (
+    Path(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()) / "snapcitr.sock"
+)
+
+# Commands understood by the daemon (one line per connection)
+CMD_CAPTURE = "capture"
+CMD_PING = "ping"
+CMD_QUIT = "quit"
+
+# Replies
+REPLY_OK = "ok"
+REPLY_BUSY = "busy"
+REPLY_PONG = "pong"
+REPLY_UNKNOWN = "unknown command"
+
+# Seconds a client gets to send its command and take the reply
+CLIENT_TIMEOUT = 2.0
+
+
+def send_command(
+    command: str, *, socket_path: Path = SOCKET_PATH, timeout: float = 1.0
+) -> str | None:
+    """Send a command to a running daemon; return its reply or None if not running."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(socket_path))
+            sock.sendall(f"{command}\n".encode())
+            return sock.recv(1024).decode().strip()
+    except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+        return None
+
+
+def _warm_up(logger: logging.Logger, *, thread_sender: bool = True) -> None:
+    """Create the API clients and the OCR backend once, before the first hotkey.
+
+    Without `thread_sender` (async sessions, which drain the outbox on their
+    own event loop), the background sender thread is not started.
+    """
+    from src.ocr import get_ocr_backend
+    from src.outbox import get_outbox_sender
+    from src.utils import get_openai_client, get_zotero_client
+
+    get_openai_client()
+    get_zotero_client()
+    if thread_sender:
+        # Resume Zotero writes left over from earlier runs
+        get_outbox_sender()
+    logger.info("OCR backend ready: %s", get_ocr_backend().name)
+
+
+class SnapcitrDaemon:
+    """Accepts commands on a Unix socket and runs capture sessions on the main thread.
+
+    Tk must live on the main thread, so the socket is served from a background
+    thread which only hands capture requests over. A request arriving while a
+    session is running (or already pending) is rejected with `busy`.
+    """
+
+    __slots__ = (
+        "logger",
+        "socket_path",
+        "_session",
+        "_requests",
+        "_busy",
+        "_server",
+        "_thread_sender",
+    )
+
+    def __init__(
+        self,
+        session: typ.Callable[[], None],
+        logger: logging.Logger,
+        *,
+        socket_path: Path = SOCKET_PATH,
+        thread_sender: bool = True,
+    ) -> None:
+        self.logger = logger
+        self.socket_path = socket_path
+        self._session = session
+        self._requests: queue.Queue[str] = queue.Queue()
+        self._busy = threading.Lock()
+        self._server: socket.socket | None = None
+        self._thread_sender = thread_sender
+
+    def serve_forever(self) -> None:
+        self._bind()
+        try:
+            _warm_up(self.logger, thread_sender=self._thread_sender)
+            threading.Thread(target=self._accept_loop, daemon=True).start()
+            self.logger.info("snapcitr daemon listening on %s", self.socket_path)
+            while self._requests.get() != CMD_QUIT:
+                try:
+                    self._session()
+                except Exception as e:
+                    self.logger.error("Session failed: %s", e, exc_info=True)
+                finally:
+                    self._busy.release()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._close()
+
+    def _bind(self) -> None:
+        if self.socket_path.exists():
+            if send_command(CMD_PING, socket_path=self.socket_path) == REPLY_PONG:
+                raise RuntimeError(
+                    f"snapcitr daemon already running ({self.socket_path})"
+                )
+            # Stale socket left behind by a crashed daemon
+            self.socket_path.unlink()
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(str(self.socket_path))
+        os.chmod(self.socket_path, 0o600)
+        self._server.listen()
+
+    def _close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        self.socket_path.unlink(missing_ok=True)
+        self.logger.info("snapcitr daemon stopped")
+
+    def _accept_loop(self) -> None:
+        # `_close` clears the attribute; accepting on the closed socket then fails
+        server = self._server
+        assert server is not None
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            # A client that stalls or hangs up must not stop the hotkey
+            with conn:
+                try:
+                    conn.settimeout(CLIENT_TIMEOUT)
+                    command = conn.recv(1024).decode().strip()
+                    conn.sendall(f"{self._handle(command)}\n".encode())
+                except (OSError, UnicodeDecodeError) as e:
+                    self.logger.warning("Dropped a client connection: %s", e)
+
+    def _handle(self, command: str) -> str:
+        if command == CMD_PING:
+            return REPLY_PONG
+        if command == CMD_CAPTURE:
+            if not self._busy.acquire(blocking=False):
+                self.logger.info("Capture requested during an active session, ignoring")
+                return REPLY_BUSY
+            self._requests.put(CMD_CAPTURE)
+            return REPLY_OK
+        if command == CMD_QUIT:
+            self._requests.put(CMD_QUIT)
+            return REPLY_OK
+        return REPLY_UNKNOWN
@@ -0,0 +1,467 @@
+"""Local history of processed captures, searchable without network calls.
+
+Each capture is kept under the hash of its image, with a thumbnail, the OCR
+text, the citations parsed from it (as `BibTeXEntry` JSON), their outbox rows
+and Zotero keys, and how long each stage took. Titles and text are indexed
+with SQLite FTS5, so a capture can be found again, exported or re-sent without
+capturing it again or paying for another model call. The store is bounded by
+entry count and age (`SNAPCITR_HISTORY_MAX_ENTRIES`, `SNAPCITR_HISTORY_MAX_DAYS`).
+
+Usage: python -m src.history [list | search QUERY | show ID | export [ID ...] |
+    reimport ID [ID ...] | prune]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import typing as typ
+from functools import lru_cache
+from pathlib import Path
+
+from dotenv import load_dotenv
+from PIL.Image import Image
+
+from src.bib_export import write_bib
+from src.bibtex import BibTeXEntry, BibTeXRecord
+from src.import_to_zotero import import_many_to_zotero
+from src.library_index import get_library_index
+from src.outbox import Outbox, get_outbox, get_outbox_sender
+from src.utils import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PATH = DATA_DIR / "history.sqlite"
+
+DEFAULT_MAX_ENTRIES = 2_000
+DEFAULT_MAX_DAYS = 365
+# Bounding box of the stored thumbnails, in pixels
+THUMBNAIL_SIZE = (320, 320)
+# What `CaptureHistory._load` reads from each row of `captures`
+_CAPTURE_COLUMNS = "captures.id, image_hash, created_at, captures.text, timings"
+
+
+class HistoryCitation(typ.NamedTuple):
+    id: int
+    capture_id: int
+    title: str | None
+    # `BibTeXEntry` JSON
+    entry: str
+    outbox_id: int | None
+    zotero_key: str | None
+
+    def record(self) -> BibTeXRecord:
+        # Validated when the capture was processed
+        return BibTeXRecord.from_json(self.entry)
+
+
+class CaptureRecord(typ.NamedTuple):
+    id: int
+    image_hash: str
+    created_at: float
+    text: str
+    # Stage -> milliseconds
+    timings: dict[str, float]
+    citations: list[HistoryCitation]
+
+
+def image_hash(img: Image) -> str:
+    """SHA-256 of the pixels, so a re-capture of the same image hashes equally."""
+    digest = hashlib.sha256(f"{img.mode}:{img.width}x{img.height}:".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def make_thumbnail(img: Image, size: tuple[int, int] = THUMBNAIL_SIZE) -> bytes:
+    thumbnail = img.convert("RGB")
+    thumbnail.thumbnail(size)
+    out = io.BytesIO()
+    thumbnail.save(out, format="PNG")
+    return out.getvalue()
+
+
+def fts_query(query: str) -> str:
+    """Each word of `query` as a quoted FTS5 term, the last one also as a prefix,
+    so that free text (DOIs, hyphens, quotes) cannot break the query syntax."""
+    terms = [f'"{word}"' for word in re.findall(r"\w+", query)]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class CaptureHistory:
+    """SQLite store of processed captures. Safe to share between threads.
+
+    Adding a capture evicts the oldest ones beyond `max_entries` and those
+    older than `max_age_seconds`.
+    """
+
+    __slots__ = ("path", "max_entries", "max_age_seconds", "enabled", "_conn", "_lock")
+
+    def __init__(
+        self,
+        path: Path = HISTORY_PATH,
+        *,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_age_seconds: float | None = DEFAULT_MAX_DAYS * 24 * 3600,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.enabled: bool = True
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS captures (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image_hash TEXT NOT NULL UNIQUE,
+                created_at REAL NOT NULL,
+                thumbnail BLOB,
+                text TEXT NOT NULL,
+                titles TEXT NOT NULL,
+                timings TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS citations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                capture_id INTEGER NOT NULL
+                    REFERENCES captures (id) ON DELETE CASCADE,
+                title TEXT,
+                entry TEXT NOT NULL,
+                outbox_id INTEGER,
+                zotero_key TEXT
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS citations_capture ON citations (capture_id)"
+        )
+        # The index reads titles and text from `captures`; captures are never
+        # updated, so inserts and deletes are all it has to follow
+        self._conn.execute(
+            """CREATE VIRTUAL TABLE IF NOT EXISTS captures_fts USING fts5 (
+                titles, text,
+                content = 'captures', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TRIGGER IF NOT EXISTS captures_fts_insert
+            AFTER INSERT ON captures BEGIN
+                INSERT INTO captures_fts (rowid, titles, text)
+                VALUES (new.id, new.titles, new.text);
+            END"""
+        )
+        self._conn.execute(
+            """CREATE TRIGGER IF NOT EXISTS captures_fts_delete
+            AFTER DELETE ON captures BEGIN
+                INSERT INTO captures_fts (captures_fts, rowid, titles, text)
+                VALUES ('delete', old.id, old.titles, old.text);
+            END"""
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+
+    def add(
+        self,
+        img: Image,
+        text: str,
+        citations: typ.Sequence[BibTeXEntry] = (),
+        *,
+        outbox_ids: typ.Sequence[int | None] = (),
+        timings: dict[str, float] | None = None,
+    ) -> int | None:
+        """Record a processed capture; returns its ID, None while disabled.
+
+        `outbox_ids` are those of the citations, in order. A capture of an image
+        that is in the history already replaces the earlier one, unless it found
+        nothing new (as when the earlier citations went to Zotero meanwhile).
+        """
+        if not self.enabled:
+            return None
+        hash_ = image_hash(img)
+        if not citations:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT id FROM captures WHERE image_hash = ?", (hash_,)
+                ).fetchone()
+            if row is not None:
+                return row[0]
+        thumbnail = make_thumbnail(img)
+        timings = {stage: round(ms, 1) for stage, ms in (timings or {}).items()}
+        titles = "\n".join(c.title for c in citations if c.title)
+        ids = list(outbox_ids) + [None] * (len(citations) - len(outbox_ids))
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM captures WHERE image_hash = ?", (hash_,))
+            cursor = self._conn.execute(
+                """INSERT INTO captures
+                    (image_hash, created_at, thumbnail, text, titles, timings)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (hash_, now, thumbnail, text, titles, json.dumps(timings)),
+            )
+            capture_id = typ.cast(int, cursor.lastrowid)
+            self._conn.executemany(
+                """INSERT INTO citations (capture_id, title, entry, outbox_id)
+                VALUES (?, ?, ?, ?)""",
+                [
+                    (
+                        capture_id,
+                        citation.title,
+                        citation.model_dump_json(exclude_none=True),
+                        outbox_id,
+                    )
+                    for citation, outbox_id in zip(citations, ids)
+                ],
+            )
+            self._evict(now)
+            self._conn.commit()
+        return capture_id
+
+    def search(self, query: str, *, limit: int = 20) -> list[CaptureRecord]:
+        """The newest captures with every word of `query` in their titles or OCR
+        text. Stopping at `limit` keeps this well under a millisecond, where
+        ranking every match by relevance would not be."""
+        if not (match := fts_query(query)):
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT {_CAPTURE_COLUMNS} FROM captures_fts
+                JOIN captures ON captures.id = captures_fts.rowid
+                WHERE captures_fts MATCH ? ORDER BY captures_fts.rowid DESC LIMIT ?""",
+                (match, limit),
+            ).fetchall()
+            return self._load(rows)
+
+    def recent(self, *, limit: int = 20) -> list[CaptureRecord]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_CAPTURE_COLUMNS} FROM captures ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+            return self._load(rows)
+
+    def get(self, ids: typ.Sequence[int]) -> list[CaptureRecord]:
+        """The captures with these IDs that are still in the history, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_CAPTURE_COLUMNS} FROM captures"
+                f" WHERE id IN ({', '.join('?' * len(ids))})",
+                ids,
+            ).fetchall()
+            by_id = {record.id: record for record in self._load(rows)}
+        return [by_id[id_] for id_ in ids if id_ in by_id]
+
+    def thumbnail(self, capture_id: int) -> bytes | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT thumbnail FROM captures WHERE id = ?", (capture_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_outbox_ids(self, outbox_ids: dict[int, int]) -> None:
+        """Point citations (by ID) at new outbox rows, e.g. after a re-import.
+
+        Their Zotero keys are cleared until the new rows have been written.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE citations SET outbox_id = ?, zotero_key = NULL WHERE id = ?",
+                [(outbox_id, id_) for id_, outbox_id in outbox_ids.items()],
+            )
+            self._conn.commit()
+
+    def resolve_zotero_keys(self, outbox: Outbox) -> int:
+        """Copy the keys of citations written since they were recorded from the
+        outbox; returns how many were found."""
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT outbox_id, id FROM citations
+                WHERE outbox_id IS NOT NULL AND zotero_key IS NULL"""
+            ).fetchall()
+        pending = dict(rows)
+        if not pending:
+            return 0
+        keys = outbox.zotero_keys(list(pending))
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE citations SET zotero_key = ? WHERE id = ?",
+                [(key, pending[outbox_id]) for outbox_id, key in keys.items()],
+            )
+            self._conn.commit()
+        return len(keys)
+
+    def prune(self) -> int:
+        """Apply the limits now and reclaim the space; returns the captures removed."""
+        with self._lock:
+            before = self._conn.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+            self._evict(time.time())
+            self._conn.commit()
+            after = self._conn.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+            self._conn.execute("VACUUM")
+        return before - after
+
+    def _evict(self, now: float) -> None:
+        if self.max_age_seconds is not None:
+            self._conn.execute(
+                "DELETE FROM captures WHERE created_at < ?",
+                (now - self.max_age_seconds,),
+            )
+        self._conn.execute(
+            """DELETE FROM captures WHERE id IN (
+                SELECT id FROM captures ORDER BY id DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+
+    def _load(self, rows: list[tuple[typ.Any, ...]]) -> list[CaptureRecord]:
+        citations: dict[int, list[HistoryCitation]] = {row[0]: [] for row in rows}
+        if citations:
+            query = f"""SELECT id, capture_id, title, entry, outbox_id, zotero_key
+                FROM citations WHERE capture_id IN ({', '.join('?' * len(citations))})
+                ORDER BY id"""
+            for row in self._conn.execute(query, list(citations)):
+                citations[row[1]].append(HistoryCitation(*row))
+        return [
+            CaptureRecord(
+                id_, hash_, created_at, text, json.loads(timings), citations[id_]
+            )
+            for id_, hash_, created_at, text, timings in rows
+        ]
+
+
+@lru_cache(maxsize=1)
+def get_capture_history() -> CaptureHistory:
+    """The history at `HISTORY_PATH`, bounded by `SNAPCITR_HISTORY_MAX_ENTRIES`
+    captures and `SNAPCITR_HISTORY_MAX_DAYS` days (0 keeps them forever)."""
+    load_dotenv()
+    max_days = float(os.environ.get("SNAPCITR_HISTORY_MAX_DAYS") or DEFAULT_MAX_DAYS)
+    return CaptureHistory(
+        max_entries=int(
+            os.environ.get("SNAPCITR_HISTORY_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES
+        ),
+        max_age_seconds=max_days * 24 * 3600 if max_days > 0 else None,
+    )
+
+
+def reimport(history: CaptureHistory, records: typ.Sequence[CaptureRecord]) -> int:
+    """Queue the citations of `records` for Zotero again; returns how many were
+    queued. Those already in the library are skipped."""
+    citations = [citation for record in records for citation in record.citations]
+    ids = import_many_to_zotero([citation.record() for citation in citations])
+    # Citations skipped as already in the library keep their outbox row and key
+    queued = {
+        citation.id: outbox_id
+        for citation, outbox_id in zip(citations, ids)
+        if outbox_id is not None
+    }
+    history.set_outbox_ids(queued)
+    return len(queued)
+
+
+def format_record(record: CaptureRecord) -> str:
+    created = time.strftime("%Y-%m-%d %H:%M", time.localtime(record.created_at))
+    titles = "; ".join(c.title or "(untitled)" for c in record.citations)
+    keys = ", ".join(c.zotero_key for c in record.citations if c.zotero_key)
+    line = f"#{record.id:<5} {created}  {titles or '(no new citations)'}"
+    return f"{line}  [{keys}]" if keys else line
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.history", description="Search and reuse past captures."
+    )
+    commands = parser.add_subparsers(dest="command")
+    list_parser = commands.add_parser("list", help="show the latest captures")
+    list_parser.add_argument("--limit", type=int, default=20)
+    search_parser = commands.add_parser("search", help="full-text search")
+    search_parser.add_argument("query", nargs="+")
+    search_parser.add_argument("--limit", type=int, default=20)
+    show_parser = commands.add_parser("show", help="text, timings and BibTeX")
+    show_parser.add_argument("id", type=int)
+    show_parser.add_argument(
+        "--thumbnail", type=Path, default=None, help="save the thumbnail here"
+    )
+    export_parser = commands.add_parser("export", help="write citations as .bib")
+    export_parser.add_argument("ids", nargs="*", type=int, help="default: all")
+    export_parser.add_argument("--query", default=None, help="export search results")
+    export_parser.add_argument("-o", "--output", default="-", help="default: stdout")
+    reimport_parser = commands.add_parser("reimport", help="queue for Zotero again")
+    reimport_parser.add_argument("ids", nargs="+", type=int)
+    commands.add_parser("prune", help="apply the retention limits and compact")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)s - %(message)s", stream=sys.stderr
+    )
+    history = get_capture_history()
+    if args.command in (None, "list", "search", "show"):
+        history.resolve_zotero_keys(get_outbox())
+
+    if args.command in (None, "list"):
+        for record in history.recent(limit=getattr(args, "limit", 20)):
+            print(format_record(record))
+        print(f"{len(history)} capture(s) in {history.path}")
+
+    elif args.command == "search":
+        started = time.perf_counter()
+        records = history.search(" ".join(args.query), limit=args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        for record in records:
+            print(format_record(record))
+        print(f"{len(records)} match(es) in {elapsed:.2f} ms")
+
+    elif args.command == "show":
+        if not (records := history.get([args.id])):
+            parser.error(f"no capture #{args.id} in the history")
+        record = records[0]
+        print(format_record(record))
+        print(
+            "Timings: "
+            + ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in record.timings.items())
+        )
+        print(f"\n{record.text}\n")
+        for citation in record.citations:
+            print(citation.record().format())
+        if args.thumbnail is not None:
+            args.thumbnail.write_bytes(history.thumbnail(record.id) or b"")
+
+    elif args.command == "export":
+        if args.query:
+            records = history.search(args.query, limit=len(history))
+        elif args.ids:
+            records = history.get(args.ids)
+        else:
+            records = history.recent(limit=len(history))[::-1]
+        entries = (c.record() for record in records for c in record.citations)
+        logger.info("Exported %d citation(s)", write_bib(entries, args.output))
+
+    elif args.command == "reimport":
+        get_library_index().sync()
+        queued = reimport(history, history.get(args.ids))
+        logger.info("Queued %d citation(s) for Zotero", queued)
+        get_outbox_sender().close()
+        logger.info("Zotero outbox: %s", get_outbox().stats())
+
+    else:
+        logger.info("Removed %d capture(s), %d left", history.prune(), len(history))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,326 @@
+"""Identifier-first citation resolution (DOI / arXiv / ISBN) ahead of the LLM."""
+
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import os
+import re
+import typing as typ
+import urllib.error
+import urllib.parse
+import urllib.request
+from functools import lru_cache
+
+from pydantic import ValidationError
+
+from src.bibtex import BibTeXEntry, make_cite_key
+from src.cache import SQLiteCache, make_key
+from src.utils import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+RESOLVER_CACHE_PATH = DATA_DIR / "resolver_cache.sqlite"
+
+DOI_RE = re.compile(r"\b(10\.\d{4,9}/[^\s\"<>]+)", re.IGNORECASE)
+ARXIV_RE = re.compile(
+    r"arXiv\s*:?\s*(?:abs/)?(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?",
+    re.IGNORECASE,
+)
+ISBN_RE = re.compile(
+    r"ISBN(?:-1[03])?\s*:?\s*((?:97[89][\s\-]?)?(?:\d[\s\-]?){9}[\dX])"
+)
+
+
+class Identifier(typ.NamedTuple):
+    kind: typ.Literal["doi", "arxiv", "isbn"]
+    value: str
+
+
+def extract_identifiers(text: str) -> list[Identifier]:
+    """Find identifiers in OCR text, most reliable kinds first, without duplicates."""
+    found: list[Identifier] = []
+
+    for match in DOI_RE.finditer(text):
+        doi = match.group(1).rstrip(".,;:)]}")
+        found.append(Identifier("doi", doi.lower()))
+    for match in ARXIV_RE.finditer(text):
+        found.append(Identifier("arxiv", match.group(1)))
+    for match in ISBN_RE.finditer(text):
+        isbn = re.sub(r"[\s\-]", "", match.group(1)).upper()
+        if _valid_isbn(isbn):
+            found.append(Identifier("isbn", isbn))
+
+    return list(dict.fromkeys(found))
+
+
+def _valid_isbn(isbn: str) -> bool:
+    if len(isbn) == 10:
+        digits = [10 if c == "X" else int(c) for c in isbn]
+        return sum((10 - i) * d for i, d in enumerate(digits)) % 11 == 0
+    if len(isbn) == 13 and isbn.isdigit():
+        return sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(isbn)) % 10 == 0
+    return False
+
+
+class MetadataResolver(typ.Protocol):
+    """Turns an identifier into CSL-JSON metadata, or None when it is unknown."""
+
+    def resolve(self, identifier: Identifier) -> dict[str, typ.Any] | None: ...
+
+
+class DOIResolver:
+    """Resolves DOIs (and arXiv IDs via their DataCite DOIs) through doi.org
+    content negotiation, which answers for both Crossref and DataCite."""
+
+    __slots__ = ("timeout", "user_agent")
+
+    def __init__(self, *, timeout: float = 5.0) -> None:
+        self.timeout = timeout
+        contact = os.environ.get("SNAPCITR_CONTACT_EMAIL")
+        self.user_agent = "snapcitr" + (f" (mailto:{contact})" if contact else "")
+
+    def resolve(self, identifier: Identifier) -> dict[str, typ.Any] | None:
+        if identifier.kind == "doi":
+            doi = identifier.value
+        elif identifier.kind == "arxiv":
+            doi = f"10.48550/arXiv.{identifier.value}"
+        else:
+            return None
+        return _get_json(
+            f"https://doi.org/{urllib.parse.quote(doi)}",
+            headers={
+                "Accept": "application/vnd.citationstyles.csl+json",
+                "User-Agent": self.user_agent,
+            },
+            timeout=self.timeout,
+        )
+
+
+class OpenLibraryResolver:
+    """Resolves ISBNs through the Open Library books API."""
+
+    __slots__ = ("timeout",)
+
+    def __init__(self, *, timeout: float = 5.0) -> None:
+        self.timeout = timeout
+
+    def resolve(self, identifier: Identifier) -> dict[str, typ.Any] | None:
+        if identifier.kind != "isbn":
+            return None
+        key = f"ISBN:{identifier.value}"
+        data = _get_json(
+            f"https://openlibrary.org/api/books?bibkeys={key}&format=json&jscmd=data",
+            headers={"User-Agent": "snapcitr"},
+            timeout=self.timeout,
+        )
+        if not data or key not in data:
+            return None
+        book = data[key]
+        return {
+            "type": "book",
+            "title": book.get("title"),
+            "author": [_split_name(a["name"]) for a in book.get("authors", [])],
+            "publisher": ", ".join(p["name"] for p in book.get("publishers", [])),
+            "publisher-place": ", ".join(
+                p["name"] for p in book.get("publish_places", [])
+            ),
+            "issued": {"date-parts": [[_first_year(book.get("publish_date", ""))]]},
+            "ISBN": identifier.value,
+            "URL": book.get("url"),
+        }
+
+
+class LocalResolver:
+    """In-memory stand-in keyed by `"<kind>:<value>"`, for tests and benchmarks."""
+
+    __slots__ = ("records",)
+
+    def __init__(self, records: dict[str, dict[str, typ.Any]]) -> None:
+        self.records = records
+
+    def resolve(self, identifier: Identifier) -> dict[str, typ.Any] | None:
+        return self.records.get(f"{identifier.kind}:{identifier.value}")
+
+
+class ChainResolver:
+    """Asks each resolver in turn until one knows the identifier."""
+
+    __slots__ = ("resolvers",)
+
+    def __init__(self, *resolvers: MetadataResolver) -> None:
+        self.resolvers = resolvers
+
+    def resolve(self, identifier: Identifier) -> dict[str, typ.Any] | None:
+        for resolver in self.resolvers:
+            if (csl := resolver.resolve(identifier)) is not None:
+                return csl
+        return None
+
+
+class CachedResolver:
+    """Remembers answers (including "not found") of another resolver on disk."""
+
+    __slots__ = ("inner", "cache")
+
+    def __init__(self, inner: MetadataResolver, cache: SQLiteCache) -> None:
+        self.inner = inner
+        self.cache = cache
+
+    def resolve(self, identifier: Identifier) -> dict[str, typ.Any] | None:
+        key = make_key(identifier.kind, identifier.value)
+        if (cached := self.cache.get(key)) is not None:
+            return json.loads(cached)
+        try:
+            csl = self.inner.resolve(identifier)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            # Transient failure (network, or a response cut short): don't
+            # remember it, let the LLM handle this capture
+            logger.warning("Could not resolve %s:%s: %s", *identifier, e)
+            return None
+        self.cache.set(key, json.dumps(csl))
+        return csl
+
+
+@lru_cache(maxsize=1)
+def get_resolver() -> MetadataResolver:
+    return CachedResolver(
+        ChainResolver(DOIResolver(), OpenLibraryResolver()),
+        SQLiteCache(RESOLVER_CACHE_PATH, max_age_seconds=365 * 24 * 3600),
+    )
+
+
+def resolve_citation(
+    citation_text: str, resolver: MetadataResolver | None = None
+) -> BibTeXEntry | None:
+    """Build the entry from the first identifier that resolves, if any."""
+    resolver = resolver or get_resolver()
+    for identifier in extract_identifiers(citation_text):
+        csl = resolver.resolve(identifier)
+        if csl is None:
+            continue
+        if (entry := csl_to_bibtex(csl)) is not None:
+            logger.info("Resolved citation via %s:%s", *identifier)
+            return entry
+    return None
+
+
+# CSL item types -> BibTeX entry types
+CSL_TYPE_MAP: dict[str, str] = {
+    "article-journal": "article",
+    "article-magazine": "article",
+    "article-newspaper": "article",
+    "book": "book",
+    "chapter": "incollection",
+    "paper-conference": "inproceedings",
+    "proceedings": "proceedings",
+    "report": "techreport",
+    "thesis": "phdthesis",
+    "manuscript": "unpublished",
+}
+
+
+def csl_to_bibtex(csl: dict[str, typ.Any]) -> BibTeXEntry | None:
+    """Map CSL-JSON (as served by Crossref/DataCite) onto a validated entry."""
+    entry_type = CSL_TYPE_MAP.get(csl.get("type", ""), "misc")
+    year = _csl_year(csl)
+    authors = _csl_names(csl.get("author"))
+    container = _first(csl.get("container-title"))
+
+    fields: dict[str, typ.Any] = {
+        "entry_type": entry_type,
+        "cite_key": _cite_key(csl, year),
+        "author": authors,
+        "editor": _csl_names(csl.get("editor")),
+        "title": _first(csl.get("title")),
+        "year": year,
+        "volume": _str(csl.get("volume")),
+        "number": _str(csl.get("issue")),
+        "pages": _str(csl.get("page")),
+        "publisher": csl.get("publisher") or None,
+        "address": csl.get("publisher-place") or None,
+        "doi": csl.get("DOI"),
+        "url": csl.get("URL"),
+        "isbn": _first(csl.get("ISBN")),
+        "issn": _first(csl.get("ISSN")),
+    }
+    if entry_type == "article":
+        fields["journal"] = container
+    elif entry_type in ("incollection", "inproceedings"):
+        fields["booktitle"] = container
+    elif entry_type == "phdthesis":
+        fields["school"] = csl.get("publisher") or None
+    elif entry_type == "techreport":
+        fields["institution"] = csl.get("publisher") or None
+    elif entry_type == "misc" and csl.get("type") in ("posted-content", "article"):
+        fields["howpublished"] = container or csl.get("publisher") or None
+
+    try:
+        return BibTeXEntry(**fields)
+    except ValidationError as e:
+        logger.info("Resolved metadata incomplete for %s: %s", entry_type, e)
+        return None
+
+
+def _get_json(
+    url: str, *, headers: dict[str, str], timeout: float
+) -> typ.Any | None:
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+
+
+def _csl_year(csl: dict[str, typ.Any]) -> int | None:
+    for key in ("issued", "published-print", "published-online", "created"):
+        try:
+            return int(csl[key]["date-parts"][0][0])
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+    return None
+
+
+def _csl_names(names: list[dict[str, str]] | None) -> str | None:
+    if not names:
+        return None
+    formatted = []
+    for name in names:
+        if "family" in name:
+            given = name.get("given")
+            formatted.append(f"{name['family']}, {given}" if given else name["family"])
+        elif "literal" in name:
+            formatted.append(name["literal"])
+    return " and ".join(formatted) or None
+
+
+def _split_name(name: str) -> dict[str, str]:
+    parts = name.rsplit(" ", 1)
+    if len(parts) == 2:
+        return {"given": parts[0], "family": parts[1]}
+    return {"literal": name}
+
+
+def _first(value: str | list[str] | None) -> str | None:
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value or None
+
+
+def _str(value: typ.Any) -> str | None:
+    return None if value is None else str(value)
+
+
+def _first_year(date: str) -> int | None:
+    match = re.search(r"\b(1[5-9]\d{2}|20\d{2})\b", date)
+    return int(match.group(1)) if match else None
+
+
+def _cite_key(csl: dict[str, typ.Any], year: int | None) -> str:
+    names = csl.get("author") or csl.get("editor") or [{}]
+    family = names[0].get("family") or names[0].get("literal")
+    return make_cite_key(family, year, _first(csl.get("title")))
@@ -1,10 +1,12 @@
-import os
+import logging
 import typing as typ
 
-from dotenv import load_dotenv
-from pyzotero import zotero
+from src.bibtex import BibTeXEntry, BibTeXRecord
+from src.library_index import get_library_index
+from src.metrics import get_tracer
+from src.outbox import AsyncOutboxSender, OutboxSender, get_outbox, get_outbox_sender
 
-from src.bibtex import BibTeXEntry
+logger = logging.getLogger(__name__)
 
 # Map BibTeX entry types to Zotero item types (all 14 types)
 ENTRY_TYPE_MAP: dict[str, str] = {
@@ -26,125 +28,153 @@ ENTRY_TYPE_MAP: dict[str, str] = {
 
 
 def import_to_zotero(bibtex: BibTeXEntry) -> None:
-    load_dotenv()
-    z = zotero.Zotero(
-        library_id=os.environ["ZOTERO_USER_ID"],
-        library_type="user",
-        api_key=os.environ["ZOTERO_API_KEY"],
-    )
-
-    item_type = ENTRY_TYPE_MAP.get(bibtex.entry_type.lower(), "journalArticle")
+    import_many_to_zotero([bibtex])
+
+
+def import_many_to_zotero(
+    bibtexes: typ.Sequence[BibTeXEntry | BibTeXRecord],
+    *,
+    sender: OutboxSender | AsyncOutboxSender | None = None,
+) -> list[int | None]:
+    """Commit entries to the local outbox; the background sender writes them to
+    Zotero in batches. Entries already in the library are skipped. Returns the
+    outbox ID of each entry, None for the skipped ones.
+
+    `sender` is the one to wake, by default the shared background thread.
+    """
+    index = get_library_index()
+    with get_tracer().span("import", entries=len(bibtexes)) as span:
+        items = []
+        queued = []
+        for bibtex in bibtexes:
+            item = bibtex_to_zotero_item(bibtex)
+            if (match := index.find_duplicate(item)) is not None:
+                logger.info(
+                    "Already in Zotero (%s, %s): %s",
+                    match.reason,
+                    match.key,
+                    bibtex.title,
+                )
+                queued.append(False)
+                continue
+            items.append(item)
+            queued.append(True)
+        span["duplicates"] = len(bibtexes) - len(items)
+
+        ids = iter(get_outbox().enqueue(items))
+    (sender or get_outbox_sender()).wake()
+    return [next(ids) if is_queued else None for is_queued in queued]
+
+
+def bibtex_to_zotero_item(
+    bibtex: BibTeXEntry | BibTeXRecord,
+) -> dict[str, typ.Any]:
+    entry_type = bibtex.entry_type.lower()
+    item_type = ENTRY_TYPE_MAP.get(entry_type, "journalArticle")
 
     # Parse creators (authors and editors)
     creators = []
-
     if bibtex.author:
         for author in bibtex.author.split(" and "):
             creators.extend(_parse_multiple_authors(author, "author"))
-
     if bibtex.editor:
         for editor in bibtex.editor.split(" and "):
             creators.extend(_parse_multiple_authors(editor, "editor"))
 
-    # Build item
-    item: dict[str, typ.Any] = {
-        "itemType": item_type,
-        "creators": creators,
-    }
+    item: dict[str, typ.Any] = {"itemType": item_type, "creators": creators}
+    # Records are read by position, models by name, from the same tables
+    by_name = not isinstance(bibtex, tuple)
+    values = bibtex.__dict__ if by_name else bibtex
+    for field, zotero_field in _FIELD_MAPS[item_type][by_name]:
+        if value := values[field]:
+            item[zotero_field] = value
 
-    if bibtex.title:
-        item["title"] = bibtex.title
     if bibtex.year:
         item["date"] = str(bibtex.year)
         if bibtex.month:
             item["date"] = f"{bibtex.month} {bibtex.year}"
-
-    # Publication context fields
-    if bibtex.journal:
-        item["publicationTitle"] = bibtex.journal
-    if bibtex.booktitle:
-        if item_type == "conferencePaper":
-            item["proceedingsTitle"] = bibtex.booktitle
-        else:
-            item["publicationTitle"] = bibtex.booktitle
-    if bibtex.publisher:
-        item["publisher"] = bibtex.publisher
-    if bibtex.school:
-        item["university"] = bibtex.school
-    if bibtex.institution:
-        item["institution"] = bibtex.institution
-
-    # Location/numbering
-    if bibtex.volume:
-        item["volume"] = bibtex.volume
-    if bibtex.number:
-        if item_type == "report":
-            item["reportNumber"] = bibtex.number
-        else:
-            item["issue"] = bibtex.number
-    if bibtex.pages:
-        item["pages"] = bibtex.pages
-    if bibtex.series:
-        item["series"] = bibtex.series
-    if bibtex.edition:
-        item["edition"] = bibtex.edition
-    if bibtex.address:
-        item["place"] = bibtex.address
-
-    # Identifiers
-    if bibtex.doi:
-        item["DOI"] = bibtex.doi
-    if bibtex.url:
-        item["url"] = bibtex.url
-    if bibtex.isbn:
-        item["ISBN"] = bibtex.isbn
-    if bibtex.issn:
-        item["ISSN"] = bibtex.issn
-
-    # Thesis/report type
-    if bibtex.type:
-        if item_type == "thesis":
-            item["thesisType"] = bibtex.type
-        elif item_type == "report":
-            item["reportType"] = bibtex.type
-    elif item_type == "thesis":
-        # Default thesis types based on entry_type
-        if bibtex.entry_type.lower() == "phdthesis":
-            item["thesisType"] = "PhD thesis"
-        elif bibtex.entry_type.lower() == "mastersthesis":
-            item["thesisType"] = "Master's thesis"
-
-    # Other fields → extra
-    extra_parts = []
-    if bibtex.chapter:
-        extra_parts.append(f"Chapter Number: {bibtex.chapter}")
-    if bibtex.note:
-        extra_parts.append(bibtex.note)
-    if bibtex.howpublished:
-        extra_parts.append(f"Published via: {bibtex.howpublished}")
-    if bibtex.organization:
-        extra_parts.append(f"Organization: {bibtex.organization}")
+    if item_type == "thesis" and "thesisType" not in item:
+        if (thesis_type := _DEFAULT_THESIS_TYPES.get(entry_type)) is not None:
+            item["thesisType"] = thesis_type
+
+    # Fields without a Zotero counterpart go to extra
+    extra_parts = [
+        template.format(values[field])
+        for field, template in _EXTRA_FIELDS[by_name]
+        if values[field]
+    ]
     if extra_parts:
         item["extra"] = "\n".join(extra_parts)
 
-    # Abstract
-    if bibtex.abstract:
-        item["abstractNote"] = bibtex.abstract
-
     # Keywords → tags
     if bibtex.keywords:
         item["tags"] = [{"tag": kw.strip()} for kw in bibtex.keywords.split(",")]
 
-    result = z.create_items([item])
+    return item
+
+
+def _field_map(item_type: str) -> list[tuple[str, str]]:
+    """The BibTeX fields that one item type takes and the Zotero fields they go
+    to. Later fields win, so a booktitle replaces the journal as
+    publicationTitle."""
+    fields = [
+        ("title", "title"),
+        ("journal", "publicationTitle"),
+        (
+            "booktitle",
+            (
+                "proceedingsTitle"
+                if item_type == "conferencePaper"
+                else "publicationTitle"
+            ),
+        ),
+        ("publisher", "publisher"),
+        ("school", "university"),
+        ("institution", "institution"),
+        ("volume", "volume"),
+        ("number", "reportNumber" if item_type == "report" else "issue"),
+        ("pages", "pages"),
+        ("series", "series"),
+        ("edition", "edition"),
+        ("address", "place"),
+        ("doi", "DOI"),
+        ("url", "url"),
+        ("isbn", "ISBN"),
+        ("issn", "ISSN"),
+        ("abstract", "abstractNote"),
+    ]
+    # Thesis/report type
+    if item_type == "thesis":
+        fields.append(("type", "thesisType"))
+    elif item_type == "report":
+        fields.append(("type", "reportType"))
+    return fields
+
+
+def _by_position_and_name(
+    fields: list[tuple[str, str]],
+) -> tuple[tuple[tuple[int, str], ...], tuple[tuple[str, str], ...]]:
+    """`fields` keyed by position in a `BibTeXRecord` and by name."""
+    by_position = tuple(
+        (BibTeXRecord._fields.index(field), target) for field, target in fields
+    )
+    return by_position, tuple(fields)
+
 
-    # Check result
-    # print(f"Result: {result}")
-    if result.get("successful"):
-        print(f"Successfully added {len(result['successful'])} item(s)!")
-    if result.get("failed"):
-        print(f"Failed: {result.get('failed')}")
-    if result.get("unchanged"):
-        print(f"Unchanged: {result.get('unchanged')}")
+# Computed once per item type instead of branching on every entry
+_FIELD_MAPS = {
+    item_type: _by_position_and_name(_field_map(item_type))
+    for item_type in {*ENTRY_TYPE_MAP.values(), "journalArticle"}
+}
+_DEFAULT_THESIS_TYPES = {"phdthesis": "PhD thesis", "mastersthesis": "Master's thesis"}
+_EXTRA_FIELDS = _by_position_and_name(
+    [
+        ("chapter", "Chapter Number: {}"),
+        ("note", "{}"),
+        ("howpublished", "Published via: {}"),
+        ("organization", "Organization: {}"),
+    ]
+)
 
 
 def _parse_multiple_authors(
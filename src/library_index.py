@@ -0,0 +1,335 @@
+"""Local index of the Zotero library for duplicate detection without network calls.
+
+Items are indexed by DOI, ISBN and a normalized title + year + first author
+fingerprint. The index is kept current incrementally with the library version
+(`since=`), so only items changed since the last sync are downloaded.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import sqlite3
+import threading
+import typing as typ
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+from pyzotero import zotero
+
+from src.utils import DATA_DIR, get_zotero_client
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_INDEX_PATH = DATA_DIR / "library_index.sqlite"
+
+# Item types that are not references of their own
+SKIPPED_ITEM_TYPES = {"attachment", "note", "annotation"}
+
+# Shorter titles ("Introduction") are too ambiguous to match inside free text
+MIN_TITLE_WORDS = 4
+
+_DOI_RE = re.compile(r"\b(10\.\d{4,9}/[^\s\"<>]+)", re.IGNORECASE)
+
+
+class LibraryMatch(typ.NamedTuple):
+    key: str
+    title: str | None
+    reason: typ.Literal["doi", "isbn", "fingerprint", "title"]
+
+
+def normalize_title(title: str) -> str:
+    text = unicodedata.normalize("NFKC", title).casefold()
+    return " ".join(re.findall(r"\w+", text))
+
+
+def normalize_doi(doi: str) -> str:
+    doi = re.sub(
+        r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", "", doi.strip(), flags=re.I
+    )
+    return doi.rstrip(".,;").lower()
+
+
+def normalize_isbns(isbn: str) -> list[str]:
+    """All ISBNs in a field (Zotero keeps several separated by spaces) as ISBN-13."""
+    found = (
+        re.sub(r"[^\dX]", "", i.upper()) for i in re.findall(r"[\dXx\-]{10,17}", isbn)
+    )
+    return [_isbn13(i) for i in found if len(i) in (10, 13)]
+
+
+def _isbn13(isbn: str) -> str:
+    if len(isbn) == 13:
+        return isbn
+    digits = "978" + isbn[:9]
+    check = (
+        10 - sum((3 if i % 2 else 1) * int(d) for i, d in enumerate(digits)) % 10
+    ) % 10
+    return digits + str(check)
+
+
+def fingerprint(item: dict[str, typ.Any]) -> str | None:
+    """`title|year|first author` of a Zotero item's data, or None without a title."""
+    title = normalize_title(item.get("title") or "")
+    if not title:
+        return None
+    year = re.search(r"\b(\d{4})\b", item.get("date") or "")
+    creators = item.get("creators") or [{}]
+    author = creators[0].get("lastName") or creators[0].get("name") or ""
+    return f"{title}|{year.group(1) if year else ''}|{normalize_title(author)}"
+
+
+class LibraryIndex:
+    """SQLite-backed lookup tables of a Zotero library. Safe to share between threads."""
+
+    __slots__ = ("path", "_conn", "_lock", "_sync_lock", "_words", "_titles")
+
+    def __init__(self, path: Path = LIBRARY_INDEX_PATH) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        # word -> keys of items whose title contains it, built on first text match
+        # and kept current by `_upsert`/`_delete` from then on
+        self._words: dict[str, set[str]] | None = None
+        # key -> title, normalized title, year and first author of the fingerprint
+        self._titles: dict[str, tuple[str | None, str, str, str]] = {}
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS items (
+                key TEXT PRIMARY KEY,
+                title TEXT,
+                norm_title TEXT,
+                fingerprint TEXT
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS identifiers (
+                value TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (kind, value, key)
+            )"""
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS items_fingerprint ON items (fingerprint)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS identifiers_key ON identifiers (key)"
+        )
+        self._conn.commit()
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE name = 'version'"
+            ).fetchone()
+        return int(row[0]) if row else 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def add(self, key: str, item: dict[str, typ.Any]) -> None:
+        """Index (or re-index) one item given its Zotero `data` dict."""
+        with self._lock:
+            self._upsert(key, item)
+            self._conn.commit()
+
+    def sync(self, client: zotero.Zotero | None = None) -> int:
+        """Download what changed since the last sync; return the number of changes."""
+        client = client or get_zotero_client()
+        with self._sync_lock:
+            since = self.version
+            # Read the version first: anything changing meanwhile is fetched next time
+            latest = client.last_modified_version()
+            if latest == since:
+                return 0
+
+            # Trashed items too, so that moving an item to the trash unindexes it
+            changed = list(client.item_versions(since=since, includeTrashed=1))
+            deleted = client.deleted(since=since).get("items", []) if since else []
+
+            for start in range(0, len(changed), 50):
+                chunk = changed[start : start + 50]
+                items = client.items(
+                    itemKey=",".join(chunk), limit=50, includeTrashed=1
+                )
+                with self._lock:
+                    for item in items:
+                        data = item.get("data", item)
+                        if data.get("deleted"):
+                            self._delete(item["key"])
+                        elif data.get("itemType") not in SKIPPED_ITEM_TYPES:
+                            self._upsert(item["key"], data)
+                    self._conn.commit()
+
+            with self._lock:
+                for key in deleted:
+                    self._delete(key)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(latest),)
+                )
+                self._conn.commit()
+
+        logger.info(
+            "Library index synced to version %d (%d changed, %d deleted)",
+            latest,
+            len(changed),
+            len(deleted),
+        )
+        return len(changed) + len(deleted)
+
+    def find_duplicate(self, item: dict[str, typ.Any]) -> LibraryMatch | None:
+        """Look up an item (Zotero `data` dict) by DOI, ISBN and fingerprint."""
+        candidates: list[tuple[typ.Literal["doi", "isbn"], str]] = []
+        if item.get("DOI"):
+            candidates.append(("doi", normalize_doi(item["DOI"])))
+        candidates.extend(
+            ("isbn", isbn) for isbn in normalize_isbns(item.get("ISBN") or "")
+        )
+
+        with self._lock:
+            for kind, value in candidates:
+                row = self._conn.execute(
+                    """SELECT items.key, items.title FROM identifiers
+                    JOIN items ON items.key = identifiers.key
+                    WHERE kind = ? AND value = ? LIMIT 1""",
+                    (kind, value),
+                ).fetchone()
+                if row is not None:
+                    return LibraryMatch(row[0], row[1], kind)
+
+            if (fp := fingerprint(item)) is not None:
+                row = self._conn.execute(
+                    "SELECT key, title FROM items WHERE fingerprint = ? LIMIT 1", (fp,)
+                ).fetchone()
+                if row is not None:
+                    return LibraryMatch(row[0], row[1], "fingerprint")
+        return None
+
+    def match_text(self, text: str) -> LibraryMatch | None:
+        """Find a library item whose DOI occurs in OCR text, or whose whole title
+        does together with its year or first author's surname."""
+        for doi in _DOI_RE.findall(text):
+            if (match := self.find_duplicate({"DOI": doi})) is not None:
+                return match
+
+        words = normalize_title(text).split()
+        if not words:
+            return None
+        present = set(words)
+        phrase = f" {' '.join(words)} "
+
+        with self._lock:
+            if self._words is None:
+                self._build_word_index()
+            assert self._words is not None
+            candidates: set[str] = set()
+            for word in present:
+                candidates |= self._words.get(word, set())
+            titles = [(key, *self._titles[key]) for key in candidates]
+
+        best: tuple[int, int, LibraryMatch] | None = None
+        for key, title, norm_title, year, author in titles:
+            title_words = norm_title.split()
+            if len(title_words) < MIN_TITLE_WORDS or f" {norm_title} " not in phrase:
+                continue
+            # A title alone is not enough: other works reuse it ("Introduction
+            # to Linear Algebra"), so the year or the first author must agree too
+            agreeing = (year in present) + bool(
+                author and present >= set(author.split())
+            )
+            if not agreeing:
+                continue
+            # Prefer the most agreeing, then the longest (most specific) title
+            score = (agreeing, len(title_words), LibraryMatch(key, title, "title"))
+            if best is None or score[:2] > best[:2]:
+                best = score
+        return best[2] if best else None
+
+    def _build_word_index(self) -> None:
+        self._words = {}
+        self._titles = {}
+        rows = self._conn.execute(
+            "SELECT key, title, norm_title, fingerprint FROM items"
+        )
+        for key, title, norm_title, fp in rows:
+            self._index_words(key, title, norm_title, fp)
+
+    def _index_words(
+        self, key: str, title: str | None, norm_title: str | None, fp: str | None
+    ) -> None:
+        assert self._words is not None
+        norm_title = norm_title or ""
+        # Normalized titles and authors are words only, never contain "|"
+        _, year, author = (fp or "||").rsplit("|", 2)
+        self._titles[key] = (title, norm_title, year, author)
+        for word in set(norm_title.split()):
+            # Short words are in almost every title and only widen the search
+            if len(word) > 3:
+                self._words.setdefault(word, set()).add(key)
+
+    def _unindex_words(self, key: str) -> None:
+        assert self._words is not None
+        if (entry := self._titles.pop(key, None)) is None:
+            return
+        for word in set(entry[1].split()):
+            if (keys := self._words.get(word)) is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._words[word]
+
+    def _upsert(self, key: str, item: dict[str, typ.Any]) -> None:
+        self._delete(key)
+        title = item.get("title")
+        norm_title = normalize_title(title or "")
+        fp = fingerprint(item)
+        self._conn.execute(
+            "INSERT INTO items VALUES (?, ?, ?, ?)", (key, title, norm_title, fp)
+        )
+        # Keep a word index that is already built current, rebuilding it would
+        # cost a pass over the whole library
+        if self._words is not None:
+            self._index_words(key, title, norm_title, fp)
+        rows: list[tuple[str, str, str]] = []
+        if item.get("DOI"):
+            rows.append((normalize_doi(item["DOI"]), "doi", key))
+        rows.extend(
+            (isbn, "isbn", key) for isbn in normalize_isbns(item.get("ISBN") or "")
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO identifiers VALUES (?, ?, ?)", rows
+        )
+
+    def _delete(self, key: str) -> None:
+        self._conn.execute("DELETE FROM items WHERE key = ?", (key,))
+        self._conn.execute("DELETE FROM identifiers WHERE key = ?", (key,))
+        if self._words is not None:
+            self._unindex_words(key)
+
+
+@lru_cache(maxsize=1)
+def get_library_index() -> LibraryIndex:
+    return LibraryIndex()
+
+
+def sync_in_background(index: LibraryIndex | None = None) -> threading.Thread:
+    """Bring the index up to date without delaying the first capture."""
+
+    def run() -> None:
+        try:
+            (index or get_library_index()).sync()
+        except Exception as e:
+            logger.warning("Could not sync the library index: %s", e)
+
+    thread = threading.Thread(target=run, name="snapcitr-library-sync", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,354 @@
+"""Timed spans around the stages of a capture, recorded as JSON lines.
+
+Each finished span is appended to `data/metrics.jsonl` as
+`{"ts": ..., "stage": ..., "ms": ..., **attributes}`, e.g. the token usage of a
+model call or which path produced a citation. Past `SNAPCITR_METRICS_MAX_MB`,
+the log is moved to `metrics.jsonl.1` (replacing the one before) and started
+afresh. The log can be summarized (p50/p95 per stage) or exported as a
+Prometheus textfile:
+
+    python -m src.metrics stats [--hours 24]
+    python -m src.metrics prometheus [PATH]
+"""
+
+from __future__ import annotations
+
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+import typing as typ
+from functools import lru_cache
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from src.utils import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = DATA_DIR / "metrics.jsonl"
+PROMETHEUS_PATH = DATA_DIR / "snapcitr.prom"
+
+DEFAULT_METRICS_MAX_MB = 10.0
+# Seconds between rewrites of the Prometheus textfile in long-running modes
+PROMETHEUS_INTERVAL = 60.0
+
+Stage = typ.Literal[
+    "capture",
+    "ocr",
+    "normalize",
+    "citation",
+    "model",
+    "validate",
+    "import",
+    "zotero_post",
+]
+
+# Histogram bucket bounds in seconds for the Prometheus export
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Span attributes summed up as counters
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens")
+
+
+class Tracer:
+    """Appends finished spans to a JSON-lines file, rotated to `<path>.1` beyond
+    `max_bytes`. Safe to share between threads."""
+
+    __slots__ = ("path", "max_bytes", "enabled", "_file", "_size", "_lock")
+
+    def __init__(
+        self,
+        path: Path = METRICS_PATH,
+        *,
+        max_bytes: int = int(DEFAULT_METRICS_MAX_MB * 1024 * 1024),
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled: bool = True
+        self._file: typ.TextIO | None = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, stage: Stage, **attrs: typ.Any) -> typ.Iterator[dict[str, typ.Any]]:
+        """Time the block; the yielded dict takes attributes known only inside it."""
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException:
+            attrs["error"] = True
+            raise
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self.record({"ts": round(started, 3), "stage": stage, "ms": ms, **attrs})
+
+    def record(self, record: dict[str, typ.Any]) -> None:
+        if not self.enabled:
+            return
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._open()
+            assert self._file is not None
+            if self._size and self._size + len(line) > self.max_bytes:
+                self._file.close()
+                self.path.replace(rotated_path(self.path))
+                self._open()
+            self._file.write(line)
+            # JSON is ASCII, so characters are bytes
+            self._size += len(line)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("a", buffering=1)
+        self._size = self._file.tell()
+
+
+def rotated_path(path: Path) -> Path:
+    return path.with_name(path.name + ".1")
+
+
+@lru_cache(maxsize=1)
+def get_tracer() -> Tracer:
+    """The tracer of `METRICS_PATH`, rotated beyond `SNAPCITR_METRICS_MAX_MB`."""
+    load_dotenv()
+    max_mb = float(os.environ.get("SNAPCITR_METRICS_MAX_MB") or DEFAULT_METRICS_MAX_MB)
+    return Tracer(max_bytes=int(max_mb * 1024 * 1024))
+
+
+def read_spans(
+    path: Path = METRICS_PATH, *, since: float | None = None
+) -> typ.Iterator[dict[str, typ.Any]]:
+    """The spans of the rotated log, then of the current one."""
+    for file_path in (rotated_path(path), path):
+        if not file_path.exists():
+            continue
+        with file_path.open() as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+                if since is None or record.get("ts", 0) >= since:
+                    yield record
+
+
+def percentile(sorted_values: typ.Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return math.nan
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class _Summary(typ.NamedTuple):
+    durations: dict[str, list[float]]
+    errors: collections.Counter[str]
+    tokens: collections.Counter[str]
+    paths: collections.Counter[str]
+    # model -> calls, escalated, prompt_tokens, completion_tokens, cost_usd
+    models: dict[str, collections.Counter[str]]
+
+
+def _summarize(spans: typ.Iterable[dict[str, typ.Any]]) -> _Summary:
+    durations: dict[str, list[float]] = {}
+    errors: collections.Counter[str] = collections.Counter()
+    tokens: collections.Counter[str] = collections.Counter()
+    paths: collections.Counter[str] = collections.Counter()
+    models: dict[str, collections.Counter[str]] = {}
+    for span in spans:
+        stage = span["stage"]
+        durations.setdefault(stage, []).append(span["ms"])
+        errors[stage] += bool(span.get("error"))
+        for field in (*TOKEN_FIELDS, "tokens_saved"):
+            tokens[field] += span.get(field) or 0
+        if stage == "citation" and span.get("path"):
+            paths[span["path"]] += 1
+        if stage == "model" and span.get("model"):
+            model = models.setdefault(span["model"], collections.Counter())
+            model["calls"] += 1
+            model["escalated"] += span.get("accepted") is False
+            for field in (*TOKEN_FIELDS, "cost_usd"):
+                model[field] += span.get(field) or 0
+    for values in durations.values():
+        values.sort()
+    return _Summary(durations, errors, tokens, paths, models)
+
+
+def format_stats(spans: typ.Iterable[dict[str, typ.Any]]) -> str:
+    summary = _summarize(spans)
+    if not summary.durations:
+        return "No spans recorded yet."
+
+    lines = [
+        f"{'stage':<12} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'max ms':>9}"
+    ]
+    # Pipeline order first, then anything else that was recorded
+    stages = [s for s in typ.get_args(Stage) if s in summary.durations]
+    stages += sorted(set(summary.durations) - set(stages))
+    for stage in stages:
+        values = summary.durations[stage]
+        lines.append(
+            f"{stage:<12} {len(values):>7} {summary.errors[stage]:>7} "
+            f"{percentile(values, 50):>9.1f} {percentile(values, 95):>9.1f} "
+            f"{values[-1]:>9.1f}"
+        )
+
+    lines.append("")
+    lines.append(
+        "Tokens: "
+        + ", ".join(f"{summary.tokens[field]} {field}" for field in TOKEN_FIELDS)
+    )
+    if normalized := len(summary.durations.get("normalize", [])):
+        saved = summary.tokens["tokens_saved"]
+        lines.append(
+            f"Normalization saved {saved} prompt tokens "
+            f"({saved / normalized:.0f} per capture)"
+        )
+    if summary.paths:
+        total = sum(summary.paths.values())
+        lines.append(
+            "Citation sources: "
+            + ", ".join(f"{n} {path}" for path, n in summary.paths.most_common())
+            + f" (API avoided for {(total - summary.paths['model']) / total:.0%})"
+        )
+        looked_up = summary.paths["cache"] + summary.paths["model"]
+        if looked_up:
+            lines.append(f"Cache hit rate: {summary.paths['cache'] / looked_up:.0%}")
+    for model, counts in summary.models.items():
+        lines.append(
+            f"Model {model}: {counts['calls']} calls, {counts['escalated']} escalated, "
+            f"{counts['prompt_tokens'] + counts['completion_tokens']} tokens, "
+            f"${counts['cost_usd']:.4f}"
+        )
+    return "\n".join(lines)
+
+
+def format_prometheus(spans: typ.Iterable[dict[str, typ.Any]]) -> str:
+    """Cumulative histogram and counters in the Prometheus text format."""
+    summary = _summarize(spans)
+    lines = [
+        "# HELP snapcitr_stage_duration_seconds Time spent in each capture stage.",
+        "# TYPE snapcitr_stage_duration_seconds histogram",
+    ]
+    for stage, values in sorted(summary.durations.items()):
+        seconds = [ms / 1000 for ms in values]
+        name = "snapcitr_stage_duration_seconds"
+        for bound in BUCKETS:
+            count = sum(s <= bound for s in seconds)
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {len(seconds)}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {sum(seconds):.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {len(seconds)}')
+
+    lines.append("# HELP snapcitr_stage_errors_total Spans that ended in an error.")
+    lines.append("# TYPE snapcitr_stage_errors_total counter")
+    for stage in sorted(summary.durations):
+        lines.append(
+            f'snapcitr_stage_errors_total{{stage="{stage}"}} {summary.errors[stage]}'
+        )
+
+    lines.append("# HELP snapcitr_openai_tokens_total Tokens used by model calls.")
+    lines.append("# TYPE snapcitr_openai_tokens_total counter")
+    for field in TOKEN_FIELDS:
+        kind = field.removesuffix("_tokens")
+        lines.append(
+            f'snapcitr_openai_tokens_total{{kind="{kind}"}} {summary.tokens[field]}'
+        )
+
+    lines.append(
+        "# HELP snapcitr_tokens_saved_total OCR tokens removed before the model call."
+    )
+    lines.append("# TYPE snapcitr_tokens_saved_total counter")
+    lines.append(f"snapcitr_tokens_saved_total {summary.tokens['tokens_saved']}")
+
+    lines.append("# HELP snapcitr_citations_total Citations per producing path.")
+    lines.append("# TYPE snapcitr_citations_total counter")
+    for path, count in sorted(summary.paths.items()):
+        lines.append(f'snapcitr_citations_total{{path="{path}"}} {count}')
+
+    lines.append("# HELP snapcitr_model_calls_total Model calls, by cascade outcome.")
+    lines.append("# TYPE snapcitr_model_calls_total counter")
+    for model, counts in sorted(summary.models.items()):
+        outcomes = {
+            "accepted": counts["calls"] - counts["escalated"],
+            "escalated": counts["escalated"],
+        }
+        for outcome, count in outcomes.items():
+            labels = f'model="{model}",outcome="{outcome}"'
+            lines.append(f"snapcitr_model_calls_total{{{labels}}} {count}")
+    lines.append("# HELP snapcitr_model_cost_usd_total Estimated cost of model calls.")
+    lines.append("# TYPE snapcitr_model_cost_usd_total counter")
+    for model, counts in sorted(summary.models.items()):
+        lines.append(
+            f'snapcitr_model_cost_usd_total{{model="{model}"}} {counts["cost_usd"]:.6f}'
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(
+    path: Path = PROMETHEUS_PATH, *, metrics_path: Path = METRICS_PATH
+) -> None:
+    """Write the textfile atomically, as the node exporter may read it any time."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(format_prometheus(read_spans(metrics_path)))
+    tmp.replace(path)
+
+
+def refresh_prometheus_in_background(
+    interval: float = PROMETHEUS_INTERVAL, path: Path = PROMETHEUS_PATH
+) -> threading.Event:
+    """Rewrite the textfile every `interval` seconds until the returned event is
+    set, for processes that do not exit after a session (the daemon)."""
+    stop = threading.Event()
+
+    def run() -> None:
+        while not stop.wait(interval):
+            try:
+                write_prometheus(path)
+            except OSError as e:
+                logger.warning("Could not write %s: %s", path, e)
+
+    threading.Thread(target=run, name="snapcitr-prometheus", daemon=True).start()
+    return stop
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.metrics", description="Summarize recorded stage timings."
+    )
+    parser.add_argument("--metrics", type=Path, default=METRICS_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats = commands.add_parser("stats", help="print p50/p95 per stage")
+    stats.add_argument(
+        "--hours", type=float, default=None, help="only spans of the last N hours"
+    )
+    prometheus = commands.add_parser("prometheus", help="write a Prometheus textfile")
+    prometheus.add_argument("path", type=Path, nargs="?", default=PROMETHEUS_PATH)
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        since = time.time() - args.hours * 3600 if args.hours is not None else None
+        print(format_stats(read_spans(args.metrics, since=since)))
+    else:
+        write_prometheus(args.path, metrics_path=args.metrics)
+        print(f"Wrote {args.path}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,119 @@
+"""Cleanup of OCR output before it is sent to the model.
+
+Selections often catch more than the citation: running headers, page numbers,
+half-recognized fragments at the edges and parts of neighbouring references.
+These lines are dropped, wrapped lines are joined (undoing hyphenation), and
+the result is capped at a token budget, so the prompt only carries the
+citation itself.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import typing as typ
+import unicodedata
+from functools import lru_cache
+
+from src.ocr import OCRLine
+from src.references import group_references, join_lines, lines_from_text
+
+logger = logging.getLogger(__name__)
+
+# A single citation is rarely above 150 tokens; anything past this is noise
+DEFAULT_TOKEN_BUDGET = 400
+# Lines Tesseract is less sure about than this (0-100) are mostly artifacts
+MIN_LINE_CONFIDENCE = 40.0
+# Lines with a smaller share of letters and digits are rules or garbage
+MIN_ALNUM_SHARE = 0.5
+
+_PAGE_NUMBER_RE = re.compile(
+    r"^\s*(?:page\s+)?\d{1,4}(?:\s*(?:/|of)\s*\d{1,4})?\s*$", re.IGNORECASE
+)
+_YEAR_RE = re.compile(r"\b(?:1[5-9]|20)\d{2}\b")
+
+
+class NormalizedText(typ.NamedTuple):
+    text: str
+    raw_tokens: int
+    tokens: int
+    dropped_lines: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.raw_tokens - self.tokens
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> typ.Any:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("o200k_base")  # The gpt-4o tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """Exact with `tiktoken` installed, else about 4 characters per token."""
+    if (encoding := _encoding()) is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    if (encoding := _encoding()) is not None:
+        text = encoding.decode(encoding.encode(text)[:max_tokens])
+    else:
+        text = text[: max_tokens * 4]
+    # Do not end on a partial word
+    return text.rsplit(" ", 1)[0] if " " in text else text
+
+
+def is_noise(line: OCRLine) -> bool:
+    text = line.text.strip()
+    if 0 <= line.confidence < MIN_LINE_CONFIDENCE:
+        return True
+    if _PAGE_NUMBER_RE.match(text):
+        return True
+    alnum = sum(c.isalnum() for c in text)
+    return alnum < MIN_ALNUM_SHARE * len(text.replace(" ", ""))
+
+
+def drop_noise(lines: typ.Sequence[OCRLine]) -> list[OCRLine]:
+    return [line for line in lines if line.text.strip() and not is_noise(line)]
+
+
+def normalize_lines(
+    lines: typ.Sequence[OCRLine], *, max_tokens: int = DEFAULT_TOKEN_BUDGET
+) -> NormalizedText:
+    """The single citation in a selection, as one clean line within the budget."""
+    raw = "\n".join(line.text for line in lines)
+    kept = drop_noise(lines)
+    dropped = len(lines) - len(kept)
+
+    # Several dated references: the selection caught neighbours, keep the most
+    # complete one. A single dated group means the split cut one reference apart.
+    groups = [g for g in group_references(kept) if _has_year(g)]
+    if len(groups) > 1:
+        main = max(groups, key=lambda g: sum(len(line.text) for line in g))
+        dropped += len(kept) - len(main)
+        kept = main
+
+    text = join_lines(kept) if kept else ""
+    text = unicodedata.normalize("NFKC", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    text = truncate_to_tokens(text, max_tokens)
+    return NormalizedText(text, count_tokens(raw), count_tokens(text), dropped)
+
+
+def normalize_text(
+    text: str, *, max_tokens: int = DEFAULT_TOKEN_BUDGET
+) -> NormalizedText:
+    """`normalize_lines` for plain OCR text, without confidences or geometry."""
+    return normalize_lines(lines_from_text(text), max_tokens=max_tokens)
+
+
+def _has_year(lines: list[OCRLine]) -> bool:
+    return any(_YEAR_RE.search(line.text) for line in lines)
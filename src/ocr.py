@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import logging
+import os
+import queue
+import threading
+import typing as typ
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from PIL.Image import Image
+import pytesseract
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANG = "eng"
+
+
+class OCRLine(typ.NamedTuple):
+    """A recognized text line with its bounding box in image pixels."""
+
+    text: str
+    left: int
+    top: int
+    width: int
+    height: int
+    # Mean word confidence (0-100) as reported by Tesseract, -1 if unknown
+    confidence: float = -1.0
+
+
+class OCRBackend(typ.Protocol):
+    name: str
+
+    def image_to_string(self, img: Image) -> str: ...
+
+    def image_to_lines(self, img: Image) -> list[OCRLine]: ...
+
+
+class PytesseractBackend:
+    """Runs the `tesseract` binary once per image (temp file + fork per call)."""
+
+    __slots__ = ("lang",)
+    name = "pytesseract"
+
+    def __init__(self, *, lang: str = DEFAULT_LANG) -> None:
+        self.lang = lang
+
+    def image_to_string(self, img: Image) -> str:
+        return pytesseract.image_to_string(img, lang=self.lang)
+
+    def image_to_lines(self, img: Image) -> list[OCRLine]:
+        data = pytesseract.image_to_data(
+            img, lang=self.lang, output_type=pytesseract.Output.DICT
+        )
+        # Words share (block, paragraph, line) numbers; merge them into line boxes
+        words: dict[tuple[int, int, int], list[int]] = {}
+        for i, text in enumerate(data["text"]):
+            if text.strip():
+                line_id = (
+                    data["block_num"][i],
+                    data["par_num"][i],
+                    data["line_num"][i],
+                )
+                words.setdefault(line_id, []).append(i)
+
+        lines = []
+        for indices in words.values():
+            left = min(data["left"][i] for i in indices)
+            top = min(data["top"][i] for i in indices)
+            right = max(data["left"][i] + data["width"][i] for i in indices)
+            bottom = max(data["top"][i] + data["height"][i] for i in indices)
+            text = " ".join(data["text"][i] for i in indices)
+            confidence = sum(float(data["conf"][i]) for i in indices) / len(indices)
+            lines.append(
+                OCRLine(text, left, top, right - left, bottom - top, confidence)
+            )
+        return sorted(lines, key=lambda line: line.top)
+
+
+class TesserocrBackend:
+    """In-process libtesseract engines, created lazily and reused across captures.
+
+    Each `PyTessBaseAPI` holds a loaded language model and is not thread-safe,
+    so up to `pool_size` engines are kept and each call borrows one exclusively.
+    tesserocr releases the GIL while recognizing, so borrowed engines run in
+    parallel.
+    """
+
+    __slots__ = ("lang", "pool_size", "_idle", "_created", "_lock")
+    name = "tesserocr"
+
+    def __init__(
+        self, *, lang: str = DEFAULT_LANG, pool_size: int | None = None
+    ) -> None:
+        import tesserocr  # noqa: F401 - fail early if the binding is missing
+
+        self.lang = lang
+        self.pool_size = pool_size or os.cpu_count() or 1
+        self._idle: queue.LifoQueue[typ.Any] = queue.LifoQueue()
+        self._created: int = 0
+        self._lock = threading.Lock()
+
+    def image_to_string(self, img: Image) -> str:
+        with self._engine() as api:
+            api.SetImage(img)
+            return api.GetUTF8Text()
+
+    def image_to_lines(self, img: Image) -> list[OCRLine]:
+        from tesserocr import RIL, iterate_level
+
+        lines = []
+        with self._engine() as api:
+            api.SetImage(img)
+            api.Recognize()
+            for item in iterate_level(api.GetIterator(), RIL.TEXTLINE):
+                text = (item.GetUTF8Text(RIL.TEXTLINE) or "").strip()
+                if not text:
+                    continue
+                left, top, right, bottom = item.BoundingBox(RIL.TEXTLINE)
+                confidence = item.Confidence(RIL.TEXTLINE)
+                lines.append(
+                    OCRLine(text, left, top, right - left, bottom - top, confidence)
+                )
+        return lines
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().End()
+            except queue.Empty:
+                break
+
+    @contextlib.contextmanager
+    def _engine(self) -> typ.Iterator[typ.Any]:
+        api = self._acquire()
+        try:
+            yield api
+        finally:
+            api.Clear()
+            self._idle.put(api)
+
+    def _acquire(self) -> typ.Any:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                from tesserocr import PyTessBaseAPI
+
+                logger.info(
+                    "Loading tesseract engine %d/%d", self._created, self.pool_size
+                )
+                return PyTessBaseAPI(lang=self.lang)
+        # Pool exhausted, wait for an engine to be returned
+        return self._idle.get()
+
+
+@lru_cache(maxsize=1)
+def get_ocr_backend() -> OCRBackend:
+    """Pick the OCR backend from `SNAPCITR_OCR_BACKEND` (auto|tesserocr|pytesseract).
+
+    `auto` prefers in-process tesserocr and falls back to pytesseract when the
+    binding is not installed.
+    """
+    load_dotenv()
+    choice = os.environ.get("SNAPCITR_OCR_BACKEND", "auto").lower()
+    lang = os.environ.get("SNAPCITR_OCR_LANG", DEFAULT_LANG)
+
+    if choice in ("auto", "tesserocr"):
+        try:
+            return TesserocrBackend(lang=lang)
+        except ImportError:
+            if choice == "tesserocr":
+                raise
+            logger.info("tesserocr not installed, falling back to pytesseract")
+    elif choice != "pytesseract":
+        raise ValueError(f"Unknown OCR backend: {choice!r}")
+
+    return PytesseractBackend(lang=lang)
+
+
+def image_to_lines_in_strips(
+    backend: OCRBackend,
+    img: Image,
+    bounds: typ.Sequence[tuple[int, int]],
+    *,
+    executor: concurrent.futures.Executor,
+) -> list[OCRLine]:
+    """OCR the full-width strips `bounds` (top, bottom rows) of `img` at once.
+
+    The lines come back in strip order, with their boxes in `img` coordinates.
+    """
+    strips = [img.crop((0, top, img.width, bottom)) for top, bottom in bounds]
+    return [
+        line._replace(top=line.top + top)
+        for (top, _), lines in zip(bounds, executor.map(backend.image_to_lines, strips))
+        for line in lines
+    ]
+
+
+@lru_cache(maxsize=1)
+def get_ocr_workers() -> int:
+    """How many strips of a tall capture are recognized at once, from
+    `SNAPCITR_OCR_WORKERS` (1 OCRs every capture in one piece)."""
+    load_dotenv()
+    return int(os.environ.get("SNAPCITR_OCR_WORKERS") or os.cpu_count() or 1)
+
+
+@lru_cache(maxsize=1)
+def get_ocr_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Threads for strip-wise OCR. Both backends recognize outside the GIL (in
+    the `tesseract` process, or in libtesseract with the GIL released), so
+    threads run the strips in parallel without copying them to other processes.
+    """
+    return concurrent.futures.ThreadPoolExecutor(
+        get_ocr_workers(), thread_name_prefix="ocr"
+    )
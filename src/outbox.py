@@ -0,0 +1,518 @@
+"""Durable outbox between citation parsing and the Zotero write.
+
+Items are committed to a local SQLite table before anything touches the
+network, and a background sender drains them in batches. A batch keeps its
+Zotero write token across retries, so a retry of a request that actually went
+through is recognized instead of creating duplicates.
+
+Usage: python -m src.outbox [list [--all] | replay [ID ...] | send]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import typing as typ
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from src.library_index import get_library_index
+from src.utils import DATA_DIR
+from src.zotero_writer import (
+    MAX_ITEMS_PER_REQUEST,
+    AsyncZoteroWriter,
+    WriteResult,
+    WriteTokenUsedError,
+    ZoteroWriter,
+    get_zotero_writer,
+)
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = DATA_DIR / "outbox.sqlite"
+
+OutboxStatus = typ.Literal["pending", "sent", "failed"]
+
+
+class OutboxRow(typ.NamedTuple):
+    id: int
+    title: str | None
+    status: OutboxStatus
+    attempts: int
+    next_attempt_at: float
+    last_error: str | None
+    zotero_key: str | None
+    created_at: float
+
+
+class Outbox:
+    """Persistent queue of Zotero items. Safe to share between threads."""
+
+    __slots__ = ("path", "_conn", "_lock")
+
+    def __init__(self, path: Path = OUTBOX_PATH) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                item TEXT NOT NULL,
+                title TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                batch_token TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                zotero_key TEXT,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)"
+        )
+        self._conn.commit()
+
+    def enqueue(self, items: typ.Sequence[dict[str, typ.Any]]) -> list[int]:
+        now = time.time()
+        with self._lock:
+            ids = []
+            for item in items:
+                cursor = self._conn.execute(
+                    """INSERT INTO outbox (item, title, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, ?)""",
+                    (json.dumps(item), item.get("title"), now, now),
+                )
+                ids.append(typ.cast(int, cursor.lastrowid))
+            self._conn.commit()
+        return ids
+
+    def enqueue_batch(
+        self, items: typ.Sequence[dict[str, typ.Any]], *, lease: float
+    ) -> tuple[str, list[tuple[int, dict[str, typ.Any]]]]:
+        """Queue `items` as one batch with a write token of its own, for a caller
+        that sends it itself (`OutboxSender.send_batch`).
+
+        Senders leave the batch alone for `lease` seconds; if it is still pending
+        then (the caller failed or died), they retry it with the same token.
+        """
+        ids = self.enqueue(items)
+        token = uuid.uuid4().hex
+        self._update(
+            "UPDATE outbox SET batch_token = ?, next_attempt_at = ?"
+            f" WHERE id IN ({', '.join('?' * len(ids))})",
+            (token, time.time() + lease, *ids),
+        )
+        return token, list(zip(ids, items))
+
+    def next_batch(
+        self, *, limit: int = MAX_ITEMS_PER_REQUEST, now: float | None = None
+    ) -> tuple[str, list[tuple[int, dict[str, typ.Any]]]] | None:
+        """Return the next due batch and its write token, or None if nothing is due.
+
+        A batch that was already attempted is retried with the same rows and token.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT batch_token FROM outbox
+                WHERE status = 'pending' AND batch_token IS NOT NULL
+                    AND next_attempt_at <= ?
+                ORDER BY id LIMIT 1""",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                token = row[0]
+            else:
+                token = uuid.uuid4().hex
+                self._conn.execute(
+                    """UPDATE outbox SET batch_token = ? WHERE id IN (
+                        SELECT id FROM outbox
+                        WHERE status = 'pending' AND batch_token IS NULL
+                            AND next_attempt_at <= ?
+                        ORDER BY id LIMIT ?
+                    )""",
+                    (token, now, limit),
+                )
+                self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT id, item FROM outbox WHERE batch_token = ? AND status = 'pending'"
+                " ORDER BY id",
+                (token,),
+            ).fetchall()
+        if not rows:
+            return None
+        return token, [(id_, json.loads(item)) for id_, item in rows]
+
+    def next_due(self) -> float | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()
+        return row[0]
+
+    def mark_sent(self, id_: int, zotero_key: str | None) -> None:
+        self._update(
+            "UPDATE outbox SET status = 'sent', zotero_key = ?, last_error = NULL"
+            " WHERE id = ?",
+            (zotero_key, id_),
+        )
+
+    def mark_failed(self, id_: int, error: str) -> None:
+        self._update(
+            "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?",
+            (error, id_),
+        )
+
+    def mark_batch_sent(self, token: str) -> None:
+        self._update(
+            "UPDATE outbox SET status = 'sent', last_error = NULL"
+            " WHERE batch_token = ? AND status = 'pending'",
+            (token,),
+        )
+
+    def postpone_batch(
+        self, token: str, error: str, *, backoff: float, max_attempts: int
+    ) -> None:
+        """Record a failed attempt; give up on the batch after `max_attempts`."""
+        self._update(
+            """UPDATE outbox SET
+                attempts = attempts + 1,
+                last_error = ?,
+                next_attempt_at = ?,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+            WHERE batch_token = ? AND status = 'pending'""",
+            (error, time.time() + backoff, max_attempts, token),
+        )
+
+    def attempts(self, token: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(attempts) FROM outbox WHERE batch_token = ?", (token,)
+            ).fetchone()
+        return row[0] or 0
+
+    def replay(self, ids: typ.Sequence[int] | None = None) -> int:
+        """Put failed items (all, or the given ones) back into the queue."""
+        query = """UPDATE outbox SET
+            status = 'pending', attempts = 0, batch_token = NULL, next_attempt_at = ?
+        WHERE status = 'failed'"""
+        params: list[typ.Any] = [time.time()]
+        if ids:
+            query += f" AND id IN ({', '.join('?' * len(ids))})"
+            params.extend(ids)
+        with self._lock:
+            count = self._conn.execute(query, params).rowcount
+            self._conn.commit()
+        return count
+
+    def zotero_keys(self, ids: typ.Sequence[int]) -> dict[int, str]:
+        """The Zotero keys of those of the given items that were written."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, zotero_key FROM outbox WHERE zotero_key IS NOT NULL"
+                f" AND id IN ({', '.join('?' * len(ids))})",
+                ids,
+            ).fetchall()
+        return dict(rows)
+
+    def rows(self, *, include_sent: bool = False) -> list[OutboxRow]:
+        query = """SELECT id, title, status, attempts, next_attempt_at, last_error,
+            zotero_key, created_at FROM outbox"""
+        if not include_sent:
+            query += " WHERE status != 'sent'"
+        with self._lock:
+            return [
+                OutboxRow(*row) for row in self._conn.execute(query + " ORDER BY id")
+            ]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            counts = dict(
+                self._conn.execute(
+                    "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+                ).fetchall()
+            )
+        return {status: counts.get(status, 0) for status in typ.get_args(OutboxStatus)}
+
+    def _update(self, query: str, params: tuple[typ.Any, ...]) -> None:
+        with self._lock:
+            self._conn.execute(query, params)
+            self._conn.commit()
+
+
+class _Sender:
+    """Retry bookkeeping and result handling shared by the outbox senders.
+
+    Failed requests are retried with exponential backoff (`base_delay`,
+    doubling up to `max_delay`); after `max_attempts` the batch is marked
+    failed and waits for `python -m src.outbox replay`.
+    """
+
+    __slots__ = ("outbox", "base_delay", "max_delay", "max_attempts", "on_sent")
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        *,
+        base_delay: float = 2.0,
+        max_delay: float = 600.0,
+        max_attempts: int = 10,
+        on_sent: typ.Callable[[str, dict[str, typ.Any]], None] | None = None,
+    ) -> None:
+        self.outbox = outbox
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.on_sent = on_sent
+
+    def _postpone(self, token: str, error: Exception) -> None:
+        attempt = self.outbox.attempts(token) + 1
+        backoff = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        logger.warning(
+            "Zotero write failed (attempt %d/%d), retrying in %.1f s: %s",
+            attempt,
+            self.max_attempts,
+            backoff,
+            error,
+        )
+        self.outbox.postpone_batch(
+            token, str(error), backoff=backoff, max_attempts=self.max_attempts
+        )
+
+    def _record(
+        self, batch: list[tuple[int, dict[str, typ.Any]]], results: list[WriteResult]
+    ) -> None:
+        for (id_, item), result in zip(batch, results):
+            if result.status == "failed":
+                logger.error(
+                    "Zotero rejected %r: %s", item.get("title"), result.message
+                )
+                self.outbox.mark_failed(id_, result.message or "rejected")
+            else:
+                logger.info("Added to Zotero: %r (%s)", item.get("title"), result.key)
+                self.outbox.mark_sent(id_, result.key)
+                if self.on_sent is not None and result.key is not None:
+                    self.on_sent(result.key, item)
+
+
+class OutboxSender(_Sender):
+    """Background thread that drains an `Outbox` into Zotero."""
+
+    __slots__ = ("writer", "_wake", "_idle", "_stopping", "_thread")
+
+    def __init__(self, outbox: Outbox, writer: ZoteroWriter, **retry: typ.Any) -> None:
+        super().__init__(outbox, **retry)
+        self.writer = writer
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> OutboxSender:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="snapcitr-outbox", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def wake(self) -> None:
+        """Signal that new items were enqueued."""
+        self._idle.clear()
+        self._wake.set()
+
+    def close(self, *, timeout: float = 10.0) -> None:
+        """Give queued items up to `timeout` seconds to go out, then stop.
+
+        Whatever is still pending stays on disk for the next run.
+        """
+        if self._thread is None:
+            return
+        self._idle.wait(timeout)
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def send_due(self) -> int:
+        """Send every batch that is due now; return the number of requests made."""
+        requests = 0
+        while (batch := self.outbox.next_batch()) is not None:
+            self.send_batch(*batch)
+            requests += 1
+        return requests
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                self.send_due()
+            except Exception as e:
+                logger.error("Outbox sender failed: %s", e, exc_info=True)
+            next_due = self.outbox.next_due()
+            if next_due is None:
+                self._idle.set()
+            timeout = None if next_due is None else max(next_due - time.time(), 0.1)
+            self._wake.wait(timeout)
+
+    def send_batch(
+        self, token: str, batch: list[tuple[int, dict[str, typ.Any]]]
+    ) -> list[WriteResult] | None:
+        """Write one batch and record the outcome in the outbox. Safe to call
+        from other threads.
+
+        Returns None if the request failed (the batch is retried later) or had
+        already gone through.
+        """
+        try:
+            results = self.writer.send([item for _, item in batch], write_token=token)
+        except WriteTokenUsedError:
+            logger.info("Outbox batch %s was already written", token)
+            self.outbox.mark_batch_sent(token)
+            return None
+        except Exception as e:
+            self._postpone(token, e)
+            return None
+        self._record(batch, results)
+        return results
+
+
+class AsyncOutboxSender(_Sender):
+    """`OutboxSender` as a task on a running event loop, writing through an
+    `AsyncZoteroWriter`. The SQLite bookkeeping runs in worker threads."""
+
+    __slots__ = ("writer", "_loop", "_wake", "_idle", "_task")
+
+    def __init__(
+        self, outbox: Outbox, writer: AsyncZoteroWriter, **retry: typ.Any
+    ) -> None:
+        super().__init__(outbox, **retry)
+        self.writer = writer
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> AsyncOutboxSender:
+        """Start sending; must be called from the event loop."""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._run())
+        return self
+
+    def wake(self) -> None:
+        """Signal that new items were enqueued. Safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._signal)
+
+    async def close(self, *, timeout: float = 10.0) -> None:
+        """Give queued items up to `timeout` seconds to go out, then stop."""
+        if self._task is None:
+            return
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        await self.writer.aclose()
+
+    async def send_due(self) -> int:
+        requests = 0
+        while (batch := await asyncio.to_thread(self.outbox.next_batch)) is not None:
+            await self._send(*batch)
+            requests += 1
+        return requests
+
+    def _signal(self) -> None:
+        self._idle.clear()
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self.send_due()
+            except Exception as e:
+                logger.error("Outbox sender failed: %s", e, exc_info=True)
+            next_due = await asyncio.to_thread(self.outbox.next_due)
+            if next_due is None:
+                self._idle.set()
+            timeout = None if next_due is None else max(next_due - time.time(), 0.1)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), timeout)
+
+    async def _send(
+        self, token: str, batch: list[tuple[int, dict[str, typ.Any]]]
+    ) -> None:
+        try:
+            results = await self.writer.send(
+                [item for _, item in batch], write_token=token
+            )
+        except WriteTokenUsedError:
+            logger.info("Outbox batch %s was already written", token)
+            await asyncio.to_thread(self.outbox.mark_batch_sent, token)
+        except Exception as e:
+            await asyncio.to_thread(self._postpone, token, e)
+        else:
+            await asyncio.to_thread(self._record, batch, results)
+
+
+@lru_cache(maxsize=1)
+def get_outbox() -> Outbox:
+    return Outbox()
+
+
+@lru_cache(maxsize=1)
+def get_outbox_sender() -> OutboxSender:
+    # Written items go into the library index right away, before the next sync
+    index = get_library_index()
+    return OutboxSender(get_outbox(), get_zotero_writer(), on_sent=index.add).start()
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.outbox", description="Inspect the Zotero outbox."
+    )
+    commands = parser.add_subparsers(dest="command")
+    list_parser = commands.add_parser("list", help="show pending and failed items")
+    list_parser.add_argument("--all", action="store_true", help="include sent items")
+    replay_parser = commands.add_parser("replay", help="requeue failed items and send")
+    replay_parser.add_argument("ids", nargs="*", type=int, help="default: all failed")
+    commands.add_parser("send", help="send everything that is due now")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    outbox = get_outbox()
+
+    if args.command in (None, "list"):
+        for row in outbox.rows(include_sent=getattr(args, "all", False)):
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(row.created_at))
+            print(
+                f"#{row.id:<5} {row.status:<8} {created}  attempts={row.attempts}"
+                f"  {row.title or '(untitled)'}"
+            )
+            if row.last_error:
+                print(f"       {row.last_error}")
+        print(outbox.stats())
+        return
+
+    if args.command == "replay":
+        print(f"Requeued {outbox.replay(args.ids)} item(s)")
+    OutboxSender(outbox, get_zotero_writer()).send_due()
+    print(outbox.stats())
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,568 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import logging
+import queue
+import threading
+import time
+import typing as typ
+
+from openai import AsyncOpenAI
+from PIL.Image import Image
+
+from src.bibtex import BibTeXEntry
+from src.capture_cache import CachedCapture, capture_key, get_capture_cache
+from src.history import get_capture_history
+from src.import_to_zotero import import_many_to_zotero
+from src.library_index import get_library_index
+from src.metrics import get_tracer
+from src.normalize import drop_noise
+from src.outbox import AsyncOutboxSender, OutboxSender, get_outbox
+from src.processing import (
+    DEFAULT_CONCURRENCY,
+    citation_path_stats,
+    extract_citation_text,
+    extract_lines,
+    find_citation_async,
+    find_citations,
+    get_model_cascade,
+)
+from src.references import split_references
+from src.utils import make_async_local_openai_client, make_async_openai_client
+from src.zotero_writer import AsyncZoteroWriter
+
+T = typ.TypeVar("T")
+
+
+class StageTimeouts(typ.NamedTuple):
+    """Seconds each stage of a capture may take before it is given up."""
+
+    ocr: float = 30.0
+    # Per reference in reference-list captures
+    citation: float = 60.0
+    # Per Zotero write request
+    zotero: float = 30.0
+
+
+DEFAULT_TIMEOUTS = StageTimeouts()
+
+
+class StageTimeoutError(Exception):
+    """A stage of a capture took longer than its timeout."""
+
+
+class EventLoopThread:
+    """An event loop running on a daemon thread, shared by all captures.
+
+    The async OpenAI clients (and the one of a local model server) live as long
+    as the loop, so their connections are reused from one capture to the next.
+    """
+
+    __slots__ = ("loop", "_client", "_local_client", "_thread")
+
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self._client: AsyncOpenAI | None = None
+        self._local_client: AsyncOpenAI | None = None
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="snapcitr-loop", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = make_async_openai_client()
+        return self._client
+
+    @property
+    def local_client(self) -> AsyncOpenAI | None:
+        """Client of the local model server, None without `local:` tiers."""
+        if self._local_client is None and any(t.local for t in get_model_cascade()):
+            self._local_client = make_async_local_openai_client()
+        return self._local_client
+
+    def submit(
+        self, coro: typ.Coroutine[typ.Any, typ.Any, T]
+    ) -> concurrent.futures.Future[T]:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: typ.Coroutine[typ.Any, typ.Any, T]) -> T:
+        """Run a coroutine on the loop and wait for its result."""
+        return self.submit(coro).result()
+
+
+@functools.lru_cache(maxsize=1)
+def get_event_loop_thread() -> EventLoopThread:
+    return EventLoopThread()
+
+
+async def _stage(name: str, awaitable: typ.Awaitable[T], timeout: float) -> T:
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise StageTimeoutError(f"{name} took longer than {timeout:g} s") from None
+
+
+@contextlib.contextmanager
+def _timed(timings: dict[str, float], stage: str) -> typ.Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = (time.perf_counter() - started) * 1000
+
+
+async def _add_to_history(
+    logger: logging.Logger,
+    img: Image,
+    text: str,
+    citations: typ.Sequence[BibTeXEntry],
+    outbox_ids: typ.Sequence[int | None],
+    timings: dict[str, float],
+) -> None:
+    # Hashing and the thumbnail take a few ms, keep them off the loop
+    try:
+        await asyncio.to_thread(
+            get_capture_history().add,
+            img,
+            text,
+            citations,
+            outbox_ids=outbox_ids,
+            timings=timings,
+        )
+    except Exception as e:
+        logger.warning("Could not add the capture to the history: %s", e)
+
+
+def _look_up_capture(img: Image) -> tuple[str | None, CachedCapture | None]:
+    """The capture key of `img` and the cached capture with the same text block,
+    if any."""
+    cache = get_capture_cache()
+    if not cache.enabled:
+        return None, None
+    key = capture_key(img)
+    return key, cache.get(key)
+
+
+def process_image(img: Image, logger: logging.Logger) -> BibTeXEntry | None:
+    """Run a single capture through OCR -> citation parsing -> Zotero import.
+
+    Returns None when the capture is already in the library.
+    """
+    loop_thread = get_event_loop_thread()
+    return loop_thread.run(
+        process_image_async(
+            img,
+            logger,
+            client=loop_thread.client,
+            local_client=loop_thread.local_client,
+        )
+    )
+
+
+async def process_image_async(
+    img: Image,
+    logger: logging.Logger,
+    *,
+    client: AsyncOpenAI,
+    local_client: AsyncOpenAI | None = None,
+    timeouts: StageTimeouts = DEFAULT_TIMEOUTS,
+    sender: OutboxSender | AsyncOutboxSender | None = None,
+) -> BibTeXEntry | None:
+    """`process_image` on the running event loop, with OCR in a worker thread.
+
+    A capture with the same text block as one processed before reuses its OCR
+    text and citation from the capture cache.
+    """
+    loop = asyncio.get_running_loop()
+    timings: dict[str, float] = {}
+    with _timed(timings, "capture_cache"):
+        key, cached = await asyncio.to_thread(_look_up_capture, img)
+    if cached is not None:
+        text = cached.text
+        logger.info("Capture cache hit, OCR skipped: %s...", text[:100])
+    else:
+        with _timed(timings, "ocr"):
+            normalized = await _stage(
+                "OCR",
+                loop.run_in_executor(None, extract_citation_text, img),
+                timeouts.ocr,
+            )
+        text = normalized.text
+        logger.info("Extracted text (%d chars): %s...", len(text), text[:100])
+        logger.info(
+            "Normalized OCR text: %d -> %d tokens (%d saved, %d line(s) dropped)",
+            normalized.raw_tokens,
+            normalized.tokens,
+            normalized.tokens_saved,
+            normalized.dropped_lines,
+        )
+
+    # Also for cache hits: the item may have been added to or removed from Zotero
+    if (match := get_library_index().match_text(text)) is not None:
+        logger.info(
+            "Already in Zotero (%s, %s): %s", match.reason, match.key, match.title
+        )
+        if key is not None and cached is None:
+            await asyncio.to_thread(get_capture_cache().set, key, text, None)
+        await _add_to_history(logger, img, text, [], [], timings)
+        return None
+
+    if cached is not None and cached.citation is not None:
+        citation = cached.citation
+        with get_tracer().span("citation", path="capture"):
+            citation_path_stats.record("capture")
+    else:
+        with _timed(timings, "citation"):
+            citation = await _stage(
+                "Citation parsing",
+                find_citation_async(client, text, local_client=local_client),
+                timeouts.citation,
+            )
+        if key is not None:
+            await asyncio.to_thread(get_capture_cache().set, key, text, citation)
+    logger.info("Citation processed: %s - %s", citation.entry_type, citation.title)
+    logger.info("Formatted citation:\n%s", citation.format(with_cite_key=False))
+
+    with _timed(timings, "import"):
+        ids = await asyncio.to_thread(import_many_to_zotero, [citation], sender=sender)
+    await _add_to_history(logger, img, text, [citation], ids, timings)
+    return citation
+
+
+def process_reference_list(
+    img: Image, logger: logging.Logger, *, concurrency: int = DEFAULT_CONCURRENCY
+) -> list[BibTeXEntry]:
+    """Split a captured reference list, parse the entries concurrently, import them."""
+    loop_thread = get_event_loop_thread()
+    return loop_thread.run(
+        process_reference_list_async(
+            img,
+            logger,
+            client=loop_thread.client,
+            local_client=loop_thread.local_client,
+            concurrency=concurrency,
+        )
+    )
+
+
+async def process_reference_list_async(
+    img: Image,
+    logger: logging.Logger,
+    *,
+    client: AsyncOpenAI,
+    local_client: AsyncOpenAI | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeouts: StageTimeouts = DEFAULT_TIMEOUTS,
+    sender: OutboxSender | AsyncOutboxSender | None = None,
+) -> list[BibTeXEntry]:
+    """`process_reference_list` on the running event loop."""
+    loop = asyncio.get_running_loop()
+    timings: dict[str, float] = {}
+    with _timed(timings, "ocr"):
+        lines = await _stage(
+            "OCR", loop.run_in_executor(None, extract_lines, img), timeouts.ocr
+        )
+    references = split_references(drop_noise(lines))
+    logger.info("Found %d reference(s) in capture", len(references))
+    # What the history indexes, including references already in the library
+    text = "\n\n".join(references)
+
+    index = get_library_index()
+    new_references = []
+    for reference in references:
+        if (match := index.match_text(reference)) is not None:
+            logger.info(
+                "Already in Zotero (%s, %s): %s", match.reason, match.key, match.title
+            )
+        else:
+            new_references.append(reference)
+    references = new_references
+
+    with _timed(timings, "citation"):
+        results = await find_citations(
+            references,
+            concurrency=concurrency,
+            client=client,
+            local_client=local_client,
+            timeout=timeouts.citation,
+        )
+    citations = []
+    for reference, result in zip(references, results):
+        if isinstance(result, asyncio.TimeoutError):
+            logger.error(
+                "Gave up on reference %r after %g s", reference[:100], timeouts.citation
+            )
+        elif isinstance(result, BaseException):
+            logger.error("Could not parse reference %r: %s", reference[:100], result)
+        else:
+            logger.info("Citation processed: %s - %s", result.entry_type, result.title)
+            citations.append(result)
+
+    ids: list[int | None] = []
+    if citations:
+        with _timed(timings, "import"):
+            ids = await asyncio.to_thread(
+                import_many_to_zotero, citations, sender=sender
+            )
+    await _add_to_history(logger, img, text, citations, ids, timings)
+    return citations
+
+
+# A single citation (None if already in the library), or every new citation
+# found in a reference-list capture
+CaptureResult = BibTeXEntry | list[BibTeXEntry] | None
+ProcessFn = typ.Callable[[Image, logging.Logger], CaptureResult]
+# `process_image_async` or `process_reference_list_async`
+AsyncProcessFn = typ.Callable[..., typ.Coroutine[typ.Any, typ.Any, CaptureResult]]
+
+
+class _Job(typ.NamedTuple):
+    seq: int
+    img: Image
+
+
+class _InOrderLog:
+    """Logs capture results in submission order, whichever finishes first."""
+
+    __slots__ = (
+        "logger",
+        "succeeded",
+        "failed",
+        "cancelled",
+        "_lock",
+        "_next_seq",
+        "_next_to_report",
+        "_finished",
+    )
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.logger = logger
+        self.succeeded: int = 0
+        self.failed: int = 0
+        self.cancelled: int = 0
+        self._lock = threading.Lock()
+        self._next_seq: int = 1
+        self._next_to_report: int = 1
+        self._finished: dict[int, CaptureResult | BaseException] = {}
+
+    @property
+    def pending(self) -> int:
+        return self._next_seq - self._next_to_report
+
+    def next_seq(self) -> int:
+        seq = self._next_seq
+        self._next_seq += 1
+        return seq
+
+    def complete(self, seq: int, result: CaptureResult | BaseException) -> None:
+        with self._lock:
+            self._finished[seq] = result
+            while self._next_to_report in self._finished:
+                n = self._next_to_report
+                self._report(n, self._finished.pop(n))
+                self._next_to_report += 1
+
+    def _report(self, n: int, done: CaptureResult | BaseException) -> None:
+        if isinstance(done, asyncio.CancelledError):
+            self.cancelled += 1
+            self.logger.info("Capture #%d cancelled", n)
+        elif isinstance(done, BaseException):
+            self.failed += 1
+            self.logger.error("Capture #%d failed: %s", n, done, exc_info=done)
+        elif done is None:
+            self.succeeded += 1
+            self.logger.info("Capture #%d already in Zotero, skipped", n)
+        elif isinstance(done, list):
+            self.succeeded += 1
+            self.logger.info(
+                "Capture #%d queued %d reference(s) for Zotero", n, len(done)
+            )
+        else:
+            self.succeeded += 1
+            self.logger.info("Capture #%d queued for Zotero: %s", n, done.title)
+
+
+class CapturePipeline:
+    """Bounded background queue that processes captures while the next one is selected.
+
+    `submit` blocks when `queue_size` captures are already waiting (backpressure),
+    results are logged in submission order regardless of which worker finishes
+    first, and `close` drains everything that was queued before returning.
+    """
+
+    __slots__ = ("logger", "process", "_log", "_queue", "_workers")
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        *,
+        workers: int = 2,
+        queue_size: int = 4,
+        process: ProcessFn = process_image,
+    ) -> None:
+        self.logger = logger
+        self.process = process
+        self._log = _InOrderLog(logger)
+        self._queue: queue.Queue[_Job | None] = queue.Queue(maxsize=queue_size)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"snapcitr-worker-{i}")
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def succeeded(self) -> int:
+        return self._log.succeeded
+
+    @property
+    def failed(self) -> int:
+        return self._log.failed
+
+    def submit(self, img: Image) -> int:
+        """Queue a captured image; blocks while the queue is full."""
+        seq = self._log.next_seq()
+        if self._queue.full():
+            self.logger.info("Work queue full, waiting for a free slot...")
+        self._queue.put(_Job(seq, img))
+        self.logger.info("Capture #%d queued (%d waiting)", seq, self._queue.qsize())
+        return seq
+
+    def close(self) -> None:
+        """Stop accepting captures and wait until all queued ones are processed."""
+        if pending := self._log.pending:
+            self.logger.info("Draining %d pending capture(s)...", pending)
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self) -> None:
+        while (job := self._queue.get()) is not None:
+            try:
+                result: CaptureResult | Exception = self.process(job.img, self.logger)
+            except Exception as e:
+                result = e
+            self._log.complete(job.seq, result)
+
+
+class AsyncCapturePipeline:
+    """Processes captures as tasks on the shared event loop while the next one is
+    selected, with at most `max_in_flight` of them between OCR and the outbox.
+
+    `submit` returns as soon as the capture is scheduled and only blocks while
+    the limit is reached. Each stage is bounded by `timeouts`, results are logged
+    in submission order, and `close(cancel=True)` abandons unfinished captures.
+    Zotero writes go out through an `AsyncOutboxSender` on the same loop.
+    """
+
+    __slots__ = (
+        "logger",
+        "process",
+        "timeouts",
+        "_log",
+        "_loop_thread",
+        "_slots",
+        "_futures",
+        "_lock",
+        "_sender",
+    )
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        *,
+        max_in_flight: int = 4,
+        timeouts: StageTimeouts = DEFAULT_TIMEOUTS,
+        process: AsyncProcessFn = process_image_async,
+    ) -> None:
+        self.logger = logger
+        self.process = process
+        self.timeouts = timeouts
+        self._log = _InOrderLog(logger)
+        self._loop_thread = get_event_loop_thread()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._futures: set[concurrent.futures.Future[CaptureResult]] = set()
+        self._lock = threading.Lock()
+        # Also resumes items left in the outbox by earlier runs
+        self._sender = self._loop_thread.run(self._start_sender())
+
+    @property
+    def succeeded(self) -> int:
+        return self._log.succeeded
+
+    @property
+    def failed(self) -> int:
+        return self._log.failed
+
+    @property
+    def cancelled(self) -> int:
+        return self._log.cancelled
+
+    def submit(self, img: Image) -> int:
+        """Start processing a captured image; blocks while too many are in flight."""
+        seq = self._log.next_seq()
+        if not self._slots.acquire(blocking=False):
+            self.logger.info("Too many captures in flight, waiting for one...")
+            self._slots.acquire()
+        future = self._loop_thread.submit(
+            self.process(
+                img,
+                self.logger,
+                client=self._loop_thread.client,
+                local_client=self._loop_thread.local_client,
+                timeouts=self.timeouts,
+                sender=self._sender,
+            )
+        )
+        with self._lock:
+            self._futures.add(future)
+        # Also runs for captures cancelled before their task got to start
+        future.add_done_callback(functools.partial(self._done, seq))
+        self.logger.info("Capture #%d started (%d in flight)", seq, self._log.pending)
+        return seq
+
+    def cancel(self) -> int:
+        """Cancel every unfinished capture; returns how many were cancelled."""
+        with self._lock:
+            futures = list(self._futures)
+        return sum(future.cancel() for future in futures)
+
+    def close(self, *, cancel: bool = False) -> None:
+        """Wait for the captures in flight (or cancel them), then stop the sender.
+
+        Citations already committed to the outbox get a few seconds to be written;
+        whatever is left is sent on the next run.
+        """
+        if pending := self._log.pending:
+            action = "Cancelling" if cancel else "Waiting for"
+            self.logger.info("%s %d capture(s) in flight", action, pending)
+        if cancel:
+            self.cancel()
+        with self._lock:
+            futures = list(self._futures)
+        concurrent.futures.wait(futures)
+        self._loop_thread.run(self._sender.close())
+
+    async def _start_sender(self) -> AsyncOutboxSender:
+        writer = AsyncZoteroWriter(timeout=self.timeouts.zotero)
+        index = get_library_index()
+        return AsyncOutboxSender(get_outbox(), writer, on_sent=index.add).start()
+
+    def _done(self, seq: int, future: concurrent.futures.Future[CaptureResult]) -> None:
+        with self._lock:
+            self._futures.discard(future)
+        self._slots.release()
+        result: CaptureResult | BaseException
+        if future.cancelled():
+            result = asyncio.CancelledError()
+        elif (error := future.exception()) is not None:
+            result = error
+        else:
+            result = future.result()
+        self._log.complete(seq, result)
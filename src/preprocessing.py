@@ -0,0 +1,169 @@
+"""Image clean-up applied to captures before OCR, and the cutting of tall
+captures into strips of text lines.
+
+The analysis steps run as NumPy array operations on the PIL buffer; only the
+grayscale conversion and resampling are delegated back to PIL.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL.Image import Image
+from pydantic import BaseModel
+
+
+class PreprocessConfig(BaseModel):
+    enabled: bool = True
+    # Selections larger than this are downscaled before anything else
+    max_pixels: int = 8_000_000
+    # Invert light-on-dark (dark mode) captures
+    invert_dark: bool = True
+    # Crop uniform background around the text, keeping this much padding
+    crop_border: bool = True
+    border_padding: int = 12
+    # Tesseract works best with text lines roughly this tall (in pixels)
+    target_line_height: int = 40
+    max_upscale: float = 4.0
+    binarize: bool = True
+
+
+DEFAULT_CONFIG = PreprocessConfig()
+
+# Every strip pays the per-call overhead of Tesseract, so it should hold at
+# least this many lines of text
+MIN_STRIP_LINES = 6
+# Blank rows between two bands must be this fraction of the line height to
+# separate lines; narrower gaps are the dots and accents above a line
+MIN_LINE_GAP = 0.2
+
+
+def preprocess(img: Image, config: PreprocessConfig = DEFAULT_CONFIG) -> Image:
+    if not config.enabled:
+        return img
+
+    img = _limit_size(img, config.max_pixels)
+    gray = _to_grayscale(img)
+
+    if config.invert_dark and _is_dark(gray):
+        gray = 255 - gray
+
+    threshold = otsu_threshold(gray)
+    ink = gray < threshold
+
+    if config.crop_border:
+        gray, ink = _crop_to_ink(gray, ink, config.border_padding)
+
+    line_height = estimate_line_height(ink)
+    if line_height:
+        scale = min(config.target_line_height / line_height, config.max_upscale)
+        if scale > 1.1:
+            gray = _resize(gray, scale)
+
+    if config.binarize:
+        gray = np.where(gray < otsu_threshold(gray), 0, 255).astype(np.uint8)
+
+    return PILImage.fromarray(gray)
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Global Otsu threshold of an 8-bit grayscale array."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    prob = hist / hist.sum()
+    omega = np.cumsum(prob)
+    mu = np.cumsum(prob * np.arange(256))
+    mu_total = mu[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu_total * omega - mu) ** 2 / (omega * (1.0 - omega))
+    return int(np.nanargmax(between)) + 1 if np.isfinite(between).any() else 128
+
+
+def estimate_line_height(ink: np.ndarray) -> float | None:
+    """Median height of the horizontal bands that contain ink, if any."""
+    starts, ends = ink_bands(ink)
+    heights = ends - starts
+    # Ignore specks and rules
+    heights = heights[heights >= 4]
+    if heights.size == 0:
+        return None
+    return float(np.median(heights))
+
+
+def ink_bands(ink: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """First and past-the-end rows of each run of rows that contain ink (the
+    projection profile of the image)."""
+    rows = ink.any(axis=1).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], rows, [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def strip_bounds(
+    img: Image, max_strips: int, *, min_lines: int = MIN_STRIP_LINES
+) -> list[tuple[int, int]]:
+    """Rows (top, bottom) that cut a preprocessed (dark on light) capture into
+    up to `max_strips` strips of about the same number of text lines.
+
+    Cuts go through the middle of the blank rows between two lines, so no line
+    is split, and every strip holds at least `min_lines` lines. Captures too
+    short to split give a single strip.
+    """
+    whole = [(0, img.height)]
+    if max_strips < 2:
+        return whole
+    # Already binarized (or at least dark on light), no threshold to search
+    ink = _to_grayscale(img) < 128
+    starts, ends = ink_bands(ink)
+    if starts.size < 2 * min_lines:
+        return whole
+    line_height = estimate_line_height(ink) or 0.0
+    gaps = starts[1:] - ends[:-1]
+    line_gaps = np.flatnonzero(gaps >= max(MIN_LINE_GAP * line_height, 2))
+    cuts = (ends[:-1][line_gaps] + starts[1:][line_gaps]) // 2
+    lines = cuts.size + 1
+    strips = min(max_strips, lines // min_lines)
+    if strips < 2:
+        return whole
+    # Cut after every `lines / strips` lines
+    after = [round(k * lines / strips) - 1 for k in range(1, strips)]
+    rows = [0, *(int(cuts[i]) for i in after), img.height]
+    return list(zip(rows, rows[1:]))
+
+
+def _limit_size(img: Image, max_pixels: int) -> Image:
+    pixels = img.width * img.height
+    if pixels <= max_pixels:
+        return img
+    factor = (max_pixels / pixels) ** 0.5
+    size = (max(1, int(img.width * factor)), max(1, int(img.height * factor)))
+    return img.resize(size, PILImage.Resampling.BOX)
+
+
+def _to_grayscale(img: Image) -> np.ndarray:
+    # PIL's C luma conversion is several times faster than a float matmul here
+    return np.asarray(img.convert("L"), dtype=np.uint8)
+
+
+def _is_dark(gray: np.ndarray) -> bool:
+    # The background dominates a text selection, so the median is its brightness
+    return float(np.median(gray)) < 128
+
+
+def _crop_to_ink(
+    gray: np.ndarray, ink: np.ndarray, padding: int
+) -> tuple[np.ndarray, np.ndarray]:
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return gray, ink
+    top = max(rows[0] - padding, 0)
+    bottom = min(rows[-1] + padding + 1, gray.shape[0])
+    left = max(cols[0] - padding, 0)
+    right = min(cols[-1] + padding + 1, gray.shape[1])
+    return gray[top:bottom, left:right], ink[top:bottom, left:right]
+
+
+def _resize(gray: np.ndarray, scale: float) -> np.ndarray:
+    height, width = gray.shape
+    size = (int(width * scale), int(height * scale))
+    img = PILImage.fromarray(gray).resize(size, PILImage.Resampling.LANCZOS)
+    return np.asarray(img)
@@ -1,24 +1,72 @@
+import asyncio
+import collections
+from functools import lru_cache
+import logging
+import os
+import threading
+import typing as typ
+
+from dotenv import load_dotenv
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessageParam, ParsedChatCompletion
 from PIL.Image import Image
-import pytesseract
+from pydantic import ValidationError
 
 from src.bibtex import BibTeXEntry
-from src.utils import get_openai_client
+from src.cache import get_citation_cache, make_key, normalize_citation_text
+from src.citation_parser import parse_citation
+from src.identifiers import resolve_citation
+from src.library_index import normalize_doi, normalize_title
+from src.metrics import get_tracer
+from src.normalize import DEFAULT_TOKEN_BUDGET, NormalizedText, normalize_lines
+from src.ocr import (
+    OCRLine,
+    get_ocr_backend,
+    get_ocr_executor,
+    get_ocr_workers,
+    image_to_lines_in_strips,
+)
+from src.preprocessing import (
+    DEFAULT_CONFIG,
+    PreprocessConfig,
+    preprocess,
+    strip_bounds,
+)
+from src.utils import (
+    get_local_openai_client,
+    get_openai_client,
+    make_async_local_openai_client,
+    make_async_openai_client,
+)
+
+logger = logging.getLogger(__name__)
 
+# Comma-separated, cheapest first. A tier's answer is accepted when it validates
+# and fits the OCR text, otherwise the next tier is asked. `local:<model>` tiers
+# go to the OpenAI-compatible server at SNAPCITR_LOCAL_MODEL_URL.
+DEFAULT_MODEL_CASCADE = "gpt-4o-mini-2024-07-18,gpt-4o-2024-08-06"
+# USD per million prompt / completion tokens, to track what the cascade costs
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+    "gpt-4o-mini-2024-07-18": (0.15, 0.60),
+}
+# Share of a model's title that must occur in the OCR text to accept the answer
+MIN_TITLE_COVERAGE = 0.8
+# Bump whenever SYSTEM_PROMPT changes so that stale cached answers are not reused
+PROMPT_VERSION = "2"
+# Heuristic parses scoring below this are handed to the model instead
+HEURISTIC_MIN_CONFIDENCE = 0.8
+# Requests in flight at once when parsing a whole reference list
+DEFAULT_CONCURRENCY = 8
 
-def extract_text(img: Image) -> str:
-    return pytesseract.image_to_string(img)
+# Kept byte-for-byte identical between requests and placed before the citation,
+# so the API can reuse its cached prefix; only the user message varies
+SYSTEM_PROMPT = """Extract bibliographic information as BibTeX.
 
+The user message is the OCR text of a single citation, already cleaned up. It
+may still contain OCR errors; correct obvious ones, but do not invent data.
 
-def find_citation(citation_text: str) -> BibTeXEntry:
-    # for later improvements/generalizations
-    client = get_openai_client()
-    response = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {
-                "role": "system",
-                "content": """Extract bibliographic information as BibTeX.
-                
 Extract ALL available fields from the citation, including:
 - entry_type: one of article, book, booklet, conference, inbook, incollection, inproceedings, manual, mastersthesis, misc, phdthesis, proceedings, techreport, unpublished
 - cite_key: generate a sensible citation key (e.g., authorYear or authorTitleYear)
@@ -29,12 +77,427 @@ Extract ALL available fields from the citation, including:
 - address, month, note, howpublished, type_field (for thesis/report type)
 - abstract, keywords
 
-Only include fields that are present or can be inferred from the citation text.""",
-            },
-            {"role": "user", "content": f"Paper: {citation_text}"},
-        ],
-        response_format=BibTeXEntry,
+Only include fields that are present or can be inferred from the citation text."""
+
+
+def extract_text(img: Image, *, config: PreprocessConfig = DEFAULT_CONFIG) -> str:
+    with get_tracer().span("ocr", pixels=img.width * img.height):
+        return get_ocr_backend().image_to_string(preprocess(img, config))
+
+
+def extract_lines(
+    img: Image,
+    *,
+    config: PreprocessConfig = DEFAULT_CONFIG,
+    workers: int | None = None,
+) -> list[OCRLine]:
+    """Text lines of a capture with their boxes and confidences.
+
+    Tall captures (a column of references) are cut into strips between text
+    lines, and up to `workers` strips (by default `SNAPCITR_OCR_WORKERS`) are
+    recognized at once.
+    """
+    if workers is None:
+        workers = get_ocr_workers()
+    with get_tracer().span("ocr", pixels=img.width * img.height, lines=True) as span:
+        prepared = preprocess(img, config)
+        bounds = strip_bounds(prepared, workers)
+        if len(bounds) == 1:
+            lines = get_ocr_backend().image_to_lines(prepared)
+        else:
+            lines = image_to_lines_in_strips(
+                get_ocr_backend(), prepared, bounds, executor=get_ocr_executor()
+            )
+        span["strips"] = len(bounds)
+        if confidences := [line.confidence for line in lines if line.confidence >= 0]:
+            span["confidence"] = round(sum(confidences) / len(confidences), 1)
+    return lines
+
+
+def extract_citation_text(
+    img: Image,
+    *,
+    config: PreprocessConfig = DEFAULT_CONFIG,
+    max_tokens: int = DEFAULT_TOKEN_BUDGET,
+    workers: int | None = None,
+) -> NormalizedText:
+    """OCR a single-citation capture and strip what does not belong to it."""
+    lines = extract_lines(img, config=config, workers=workers)
+    with get_tracer().span("normalize") as span:
+        normalized = normalize_lines(lines, max_tokens=max_tokens)
+        span["raw_tokens"] = normalized.raw_tokens
+        span["tokens"] = normalized.tokens
+        span["tokens_saved"] = normalized.tokens_saved
+        span["dropped_lines"] = normalized.dropped_lines
+    return normalized
+
+
+class ModelRefusalError(Exception):
+    """The last model of the cascade refused to answer."""
+
+
+class ModelTier(typ.NamedTuple):
+    model: str
+    local: bool = False
+
+    @property
+    def spec(self) -> str:
+        """The tier as written in `SNAPCITR_MODEL_CASCADE`."""
+        return f"local:{self.model}" if self.local else self.model
+
+
+def parse_model_cascade(spec: str) -> tuple[ModelTier, ...]:
+    tiers = tuple(
+        ModelTier(part.removeprefix("local:"), local=part.startswith("local:"))
+        for part in (p.strip() for p in spec.split(","))
+        if part
     )
-    bibtex = response.choices[0].message.parsed
-    assert bibtex is not None
+    if not tiers:
+        raise ValueError(f"No models in cascade {spec!r}")
+    return tiers
+
+
+@lru_cache(maxsize=1)
+def get_model_cascade() -> tuple[ModelTier, ...]:
+    """The cascade from `SNAPCITR_MODEL_CASCADE`, or the default one."""
+    load_dotenv()
+    return parse_model_cascade(
+        os.environ.get("SNAPCITR_MODEL_CASCADE") or DEFAULT_MODEL_CASCADE
+    )
+
+
+# "capture": reused with its OCR text from the capture cache
+CitationPath = typ.Literal["identifier", "heuristic", "cache", "capture", "model"]
+
+
+class CitationPathStats:
+    """Counts which path produced each citation, to see how often the API is avoided."""
+
+    __slots__ = ("_counts", "_lock")
+
+    def __init__(self) -> None:
+        self._counts: collections.Counter[CitationPath] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, path: CitationPath) -> None:
+        with self._lock:
+            self._counts[path] += 1
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        result: dict[str, int | float] = {
+            path: counts.get(path, 0) for path in typ.get_args(CitationPath)
+        }
+        result["total"] = total
+        result["api_avoided_rate"] = (
+            (total - counts.get("model", 0)) / total if total else 0.0
+        )
+        return result
+
+
+citation_path_stats = CitationPathStats()
+
+
+def find_citation(
+    citation_text: str,
+    *,
+    use_cache: bool = True,
+    use_identifiers: bool = True,
+    use_heuristics: bool = True,
+) -> BibTeXEntry:
+    with get_tracer().span("citation") as span:
+        found = _find_without_model(
+            citation_text,
+            use_cache=use_cache,
+            use_identifiers=use_identifiers,
+            use_heuristics=use_heuristics,
+        )
+        if found is not None:
+            span["path"] = found[1]
+            return found[0]
+
+        bibtex = _query_model(citation_text)
+        span["path"] = "model"
+        _remember(citation_text, bibtex, use_cache=use_cache)
+        return bibtex
+
+
+async def find_citations(
+    citation_texts: typ.Sequence[str],
+    *,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: AsyncOpenAI | None = None,
+    local_client: AsyncOpenAI | None = None,
+    timeout: float | None = None,
+    use_cache: bool = True,
+    use_identifiers: bool = True,
+    use_heuristics: bool = True,
+) -> list[BibTeXEntry | BaseException]:
+    """Parse many references at once, at most `concurrency` of them in flight.
+
+    Results are in input order; a reference that could not be parsed (or took
+    longer than `timeout` seconds) yields its exception instead of failing the
+    whole batch. Without a `client`, one is created for this call.
+    """
+    if client is None:
+        async with make_async_openai_client() as client:
+            return await find_citations(
+                citation_texts,
+                concurrency=concurrency,
+                client=client,
+                local_client=local_client,
+                timeout=timeout,
+                use_cache=use_cache,
+                use_identifiers=use_identifiers,
+                use_heuristics=use_heuristics,
+            )
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def find_one(citation_text: str) -> BibTeXEntry:
+        assert client is not None
+        async with semaphore:
+            return await asyncio.wait_for(
+                find_citation_async(
+                    client,
+                    citation_text,
+                    local_client=local_client,
+                    use_cache=use_cache,
+                    use_identifiers=use_identifiers,
+                    use_heuristics=use_heuristics,
+                ),
+                timeout,
+            )
+
+    return await asyncio.gather(
+        *(find_one(text) for text in citation_texts), return_exceptions=True
+    )
+
+
+async def find_citation_async(
+    client: AsyncOpenAI,
+    citation_text: str,
+    *,
+    local_client: AsyncOpenAI | None = None,
+    use_cache: bool = True,
+    use_identifiers: bool = True,
+    use_heuristics: bool = True,
+) -> BibTeXEntry:
+    """`find_citation` for callers that run their own event loop and client.
+
+    `local_client` serves the `local:` tiers of the cascade; without it, a
+    client is created for each request to the local server.
+    """
+    with get_tracer().span("citation") as span:
+        # Identifier lookups and the cache block, keep them off the loop
+        found = await asyncio.to_thread(
+            _find_without_model,
+            citation_text,
+            use_cache=use_cache,
+            use_identifiers=use_identifiers,
+            use_heuristics=use_heuristics,
+        )
+        if found is not None:
+            span["path"] = found[1]
+            return found[0]
+        bibtex = await _query_model_async(client, citation_text, local_client)
+        span["path"] = "model"
+        _remember(citation_text, bibtex, use_cache=use_cache)
+        return bibtex
+
+
+def _find_without_model(
+    citation_text: str,
+    *,
+    use_cache: bool = True,
+    use_identifiers: bool = True,
+    use_heuristics: bool = True,
+) -> tuple[BibTeXEntry, CitationPath] | None:
+    # DOIs/arXiv IDs/ISBNs resolve to authoritative metadata without the LLM
+    if use_identifiers and (resolved := resolve_citation(citation_text)) is not None:
+        citation_path_stats.record("identifier")
+        return resolved, "identifier"
+
+    # Cleanly formatted references are parsed locally; doubtful ones go to the model
+    if use_heuristics and (parsed := parse_citation(citation_text)) is not None:
+        if parsed.confidence >= HEURISTIC_MIN_CONFIDENCE:
+            logger.info(
+                "Parsed citation locally (%s, confidence %.2f)",
+                parsed.style,
+                parsed.confidence,
+            )
+            citation_path_stats.record("heuristic")
+            return parsed.entry, "heuristic"
+        logger.info(
+            "Local parse not confident enough (%s, %.2f), asking the model",
+            parsed.style,
+            parsed.confidence,
+        )
+
+    cache = get_citation_cache()
+    if use_cache and (cached := cache.get(_cache_key(citation_text))) is not None:
+        logger.info("Citation cache hit (%s)", cache.stats())
+        citation_path_stats.record("cache")
+        with get_tracer().span("validate", source="cache"):
+            return BibTeXEntry.model_validate_json(cached), "cache"
+
+    return None
+
+
+def _remember(citation_text: str, bibtex: BibTeXEntry, *, use_cache: bool) -> None:
+    citation_path_stats.record("model")
+    if use_cache:
+        get_citation_cache().set(_cache_key(citation_text), bibtex.model_dump_json())
+
+
+def _cache_key(citation_text: str) -> str:
+    # Answers may come from any tier, so changing the cascade starts a new namespace
+    cascade = ",".join(tier.spec for tier in get_model_cascade())
+    return make_key(normalize_citation_text(citation_text), cascade, PROMPT_VERSION)
+
+
+def _messages(citation_text: str) -> list[ChatCompletionMessageParam]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": citation_text},
+    ]
+
+
+def _query_model(citation_text: str) -> BibTeXEntry:
+    tiers = get_model_cascade()
+    for i, tier in enumerate(tiers):
+        last = i == len(tiers) - 1
+        client = get_local_openai_client() if tier.local else get_openai_client()
+        with get_tracer().span("model", model=tier.model, tier=i) as span:
+            try:
+                response = client.beta.chat.completions.parse(
+                    model=tier.model,
+                    messages=_messages(citation_text),
+                    response_format=BibTeXEntry,
+                )
+            except _ESCALATION_ERRORS as e:
+                if last:
+                    raise
+                _escalate(span, tier, f"{type(e).__name__}: {e}")
+                continue
+            bibtex = _accept(span, tier, response, citation_text, last)
+            if bibtex is not None:
+                return bibtex
+    raise AssertionError("The last tier either answers or raises")
+
+
+async def _query_model_async(
+    client: AsyncOpenAI, citation_text: str, local_client: AsyncOpenAI | None = None
+) -> BibTeXEntry:
+    tiers = get_model_cascade()
+    for i, tier in enumerate(tiers):
+        last = i == len(tiers) - 1
+        with get_tracer().span("model", model=tier.model, tier=i) as span:
+            try:
+                if tier.local and local_client is None:
+                    async with make_async_local_openai_client() as own_client:
+                        response = await own_client.beta.chat.completions.parse(
+                            model=tier.model,
+                            messages=_messages(citation_text),
+                            response_format=BibTeXEntry,
+                        )
+                else:
+                    tier_client = local_client if tier.local else client
+                    assert tier_client is not None
+                    response = await tier_client.beta.chat.completions.parse(
+                        model=tier.model,
+                        messages=_messages(citation_text),
+                        response_format=BibTeXEntry,
+                    )
+            except _ESCALATION_ERRORS as e:
+                if last:
+                    raise
+                _escalate(span, tier, f"{type(e).__name__}: {e}")
+                continue
+            bibtex = _accept(span, tier, response, citation_text, last)
+            if bibtex is not None:
+                return bibtex
+    raise AssertionError("The last tier either answers or raises")
+
+
+def _accept(
+    span: dict[str, typ.Any],
+    tier: ModelTier,
+    response: ParsedChatCompletion[BibTeXEntry],
+    citation_text: str,
+    last: bool,
+) -> BibTeXEntry | None:
+    """The tier's answer, or None if it has to be escalated to the next tier."""
+    _record_usage(span, tier.model, response)
+    if (bibtex := _parsed_entry(response)) is None:
+        reason = f"refused: {response.choices[0].message.refusal}"
+        if last:
+            span["reason"] = reason[:200]
+            raise ModelRefusalError(f"{tier.model} {reason}")
+        _escalate(span, tier, reason)
+        return None
+    # The last tier is trusted as is, there is nobody left to ask
+    if not last and (problem := find_inconsistency(bibtex, citation_text)):
+        _escalate(span, tier, problem)
+        return None
+    span["accepted"] = True
     return bibtex
+
+
+def _escalate(span: dict[str, typ.Any], tier: ModelTier, reason: str) -> None:
+    logger.info("Escalating past %s: %s", tier.model, reason)
+    span["accepted"] = False
+    span["reason"] = reason[:200]
+
+
+def find_inconsistency(bibtex: BibTeXEntry, citation_text: str) -> str | None:
+    """Why a model answer does not fit the OCR text it came from, if it does not."""
+    words = set(normalize_title(citation_text).split())
+    if bibtex.year is not None and str(bibtex.year) not in citation_text:
+        return f"year {bibtex.year} not in text"
+    if bibtex.title:
+        title_words = normalize_title(bibtex.title).split()
+        present = sum(w in words for w in title_words)
+        if title_words and present / len(title_words) < MIN_TITLE_COVERAGE:
+            return "title not in text"
+    if bibtex.author:
+        first = bibtex.author.split(" and ")[0]
+        last_name = first.split(",")[0] if "," in first else first.split()[-1]
+        if not set(normalize_title(last_name).split()) <= words:
+            return f"first author {last_name!r} not in text"
+    if bibtex.doi and normalize_doi(bibtex.doi) not in citation_text.lower():
+        return "DOI not in text"
+    return None
+
+
+def _record_usage(
+    span: dict[str, typ.Any], model: str, response: ParsedChatCompletion[BibTeXEntry]
+) -> None:
+    if response.usage is None:
+        return
+    span["prompt_tokens"] = response.usage.prompt_tokens
+    span["completion_tokens"] = response.usage.completion_tokens
+    if (prices := MODEL_PRICES.get(model)) is not None:
+        span["cost_usd"] = (
+            response.usage.prompt_tokens * prices[0]
+            + response.usage.completion_tokens * prices[1]
+        ) / 1_000_000
+
+
+# Failures of a lower tier that the next tier may not have
+_ESCALATION_ERRORS = (
+    ValidationError,
+    openai.APIError,
+    openai.LengthFinishReasonError,
+    openai.ContentFilterFinishReasonError,
+)
+
+
+def _parsed_entry(
+    response: ParsedChatCompletion[BibTeXEntry],
+) -> BibTeXEntry | None:
+    """The answer, already validated by the SDK while parsing inside the "model"
+    span, or None if the model refused."""
+    return response.choices[0].message.parsed
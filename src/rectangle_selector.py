@@ -1,16 +1,32 @@
 from datetime import datetime
+import logging
 import os
 import time
 import tkinter as tk
 import typing as typ
 
-from PIL import ImageGrab
+from PIL import ImageGrab, ImageTk
 from PIL.Image import Image
 from pynput import keyboard
 
+logger = logging.getLogger(__name__)
+
 
 class RectangleSelector:
+    """Fullscreen overlay for selecting a screen region.
+
+    The overlay window, its canvas and the global key listener are created on
+    the first selection and kept (hidden) between selections, so reopening the
+    overlay only has to show the window again. Call `close` when done.
+
+    With `freeze=True` the screen is grabbed once when the selection starts and
+    shown as the overlay background; the selection is then cropped from that
+    image instead of grabbing the screen again after the overlay closes.
+    """
+
     __slots__ = (
+        "freeze",
+        "frozen",
         "x1",
         "y1",
         "x2",
@@ -19,12 +35,22 @@ class RectangleSelector:
         "selected",
         "screen_width",
         "screen_height",
+        "show_latency_ms",
         "_root",
+        "_canvas",
+        "_background_item",
+        "_listener",
+        "_active",
         "_hidden",
         "_alt_pressed_alone",
+        "_background",
+        "_redraw_pending",
+        "_started",
     )
 
-    def __init__(self) -> None:
+    def __init__(self, *, freeze: bool = False) -> None:
+        self.freeze = freeze
+        self.frozen: Image | None = None
         self.x1: int = 0
         self.y1: int = 0
         self.x2: int = 0
@@ -33,12 +59,22 @@ class RectangleSelector:
         self.selected: bool = False
         self.screen_width: int | None = None
         self.screen_height: int | None = None
+        # Time from `start_selection` until the overlay was on screen
+        self.show_latency_ms: float | None = None
         self._root: tk.Tk | None = None
+        self._canvas: tk.Canvas | None = None
+        self._background_item: int | None = None
+        self._listener: keyboard.Listener | None = None
+        # Whether a selection is in progress (the listener outlives selections)
+        self._active: bool = False
         self._hidden: bool = False
         self._alt_pressed_alone: bool = False
+        self._background: ImageTk.PhotoImage | None = None
+        self._redraw_pending: bool = False
+        self._started: float = 0.0
 
     def start_selection(self, *, delay_seconds: int = 0) -> None:
-        """Open a fullscreen window for rectangle selection
+        """Show the fullscreen overlay and wait for a rectangle selection
 
         Controls:
             - Click and drag to select area
@@ -56,56 +92,130 @@ class RectangleSelector:
             "Controls: Alt (alone) = hide/show overlay | Esc = cancel | Click+drag = select"
         )
 
-        self._root = tk.Tk()
-        self._root.attributes("-type", "splash")  # Make window borderless
-        self._root.attributes("-alpha", 0.3)  # Semi-transparent
+        self._started = time.perf_counter()
+        self.x1 = self.y1 = self.x2 = self.y2 = 0
+        self.selected = False
+        self.show_latency_ms = None
+
+        if self.freeze:
+            # Grab before the overlay is shown, so it is not in the picture
+            self.frozen = ImageGrab.grab()
+
+        root, canvas = self._ensure_window()
+        assert self.rect is not None
+        canvas.coords(self.rect, 0, 0, 0, 0)
+        canvas.itemconfigure(self.rect, state=tk.HIDDEN)
+        self._show_frozen(canvas)
+
         self._hidden = False
+        self._active = True
+        root.deiconify()
+        root.attributes("-fullscreen", True)
+        root.lift()
+        root.focus_force()
+        root.mainloop()
+
+        self._active = False
+        root.withdraw()
+        # Process the withdraw now, so the overlay is gone before any screen grab
+        root.update_idletasks()
+
+    def close(self) -> None:
+        """Stop the key listener and destroy the overlay window"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._root is not None:
+            self._root.destroy()
+            self._root = None
+            self._canvas = None
+            self._background_item = None
+            self.rect = None
+        self._background = None
+
+    def __enter__(self) -> "RectangleSelector":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _ensure_window(self) -> tuple[tk.Tk, tk.Canvas]:
+        if self._root is not None and self._canvas is not None:
+            return self._root, self._canvas
+
+        root = tk.Tk()
+        root.withdraw()
+        root.attributes("-type", "splash")  # Make window borderless
+        # Semi-transparent, unless the frozen screen is shown as the background
+        root.attributes("-alpha", 1.0 if self.freeze else 0.3)
 
         # Get screen dimensions
-        self.screen_width = self._root.winfo_screenwidth()
-        self.screen_height = self._root.winfo_screenheight()
+        self.screen_width = root.winfo_screenwidth()
+        self.screen_height = root.winfo_screenheight()
 
         # Set geometry to cover entire screen
-        self._root.geometry(f"{self.screen_width}x{self.screen_height}+0+0")
-        self._root.attributes("-fullscreen", True)
+        root.geometry(f"{self.screen_width}x{self.screen_height}+0+0")
 
-        canvas = tk.Canvas(self._root, bg="white", highlightthickness=0)
+        canvas = tk.Canvas(root, bg="white", highlightthickness=0)
         canvas.pack(fill=tk.BOTH, expand=True)
+        if self.freeze:
+            self._background_item = canvas.create_image(0, 0, anchor=tk.NW)
+        # One rectangle for all selections, moved with `coords` while dragging
+        self.rect = canvas.create_rectangle(
+            0, 0, 0, 0, outline="red", width=2, state=tk.HIDDEN
+        )
 
         def on_press(event: tk.Event) -> None:
-            self.x1 = event.x
-            self.y1 = event.y
+            self.x1 = self.x2 = event.x
+            self.y1 = self.y2 = event.y
+            canvas.coords(self.rect, self.x1, self.y1, self.x2, self.y2)
+            canvas.itemconfigure(self.rect, state=tk.NORMAL)
 
         def on_drag(event: tk.Event) -> None:
             self.x2 = event.x
             self.y2 = event.y
+            # Coalesce motion events into one redraw per idle cycle
+            if not self._redraw_pending:
+                self._redraw_pending = True
+                canvas.after_idle(redraw)
 
-            # Redraw rectangle
-            if self.rect:
-                canvas.delete(self.rect)
-
-            self.rect = canvas.create_rectangle(
-                self.x1, self.y1, self.x2, self.y2, outline="red", width=2
-            )
+        def redraw() -> None:
+            self._redraw_pending = False
+            canvas.coords(self.rect, self.x1, self.y1, self.x2, self.y2)
 
-        def on_release(_: tk.Event) -> None:
+        def on_release(event: tk.Event) -> None:
+            self.x2 = event.x
+            self.y2 = event.y
             self.selected = True
-            if self._root:
-                self._root.quit()
+            root.quit()
 
         def on_key(event: tk.Event) -> None:
             if event.keysym == "Escape":
                 self.selected = False
-                if self._root:
-                    self._root.quit()
+                root.quit()
+
+        def on_map(_: tk.Event) -> None:
+            if self._active and self.show_latency_ms is None:
+                self.show_latency_ms = (time.perf_counter() - self._started) * 1000
+                logger.debug("Overlay shown in %.1f ms", self.show_latency_ms)
 
         canvas.bind("<Button-1>", on_press)
         canvas.bind("<B1-Motion>", on_drag)
         canvas.bind("<ButtonRelease-1>", on_release)
-        self._root.bind("<Key>", on_key)
+        root.bind("<Key>", on_key)
+        root.bind("<Map>", on_map)
+
+        self._root = root
+        self._canvas = canvas
+        self._start_listener()
+        return root, canvas
+
+    def _start_listener(self) -> None:
+        """Global hotkey listener for Alt alone and Escape"""
 
-        # Global hotkey listener for Alt alone and Escape
         def on_global_key_press(key: keyboard.Key | keyboard.KeyCode | None) -> None:
+            if not self._active:
+                return
             if key == keyboard.Key.alt_l or key == keyboard.Key.alt_r:
                 self._alt_pressed_alone = True
             elif key == keyboard.Key.esc:
@@ -115,6 +225,8 @@ class RectangleSelector:
                     self._root.after(0, self._root.quit)
 
         def on_global_key_release(key: keyboard.Key | keyboard.KeyCode | None) -> None:
+            if not self._active:
+                return
             if key == keyboard.Key.alt_l or key == keyboard.Key.alt_r:
                 if self._alt_pressed_alone and self._root:
                     # Toggle overlay visibility
@@ -123,21 +235,27 @@ class RectangleSelector:
                 # Another key was pressed, so Alt is a combo
                 self._alt_pressed_alone = False
 
-        listener = keyboard.Listener(
+        self._listener = keyboard.Listener(
             on_press=on_global_key_press,
             on_release=on_global_key_release,
         )
-        listener.start()
-
-        self._root.mainloop()
+        self._listener.start()
 
-        listener.stop()
-        self._root.destroy()
-        self._root = None
+    def _show_frozen(self, canvas: tk.Canvas) -> None:
+        if self.frozen is None or self._background_item is None:
+            return
+        assert self.screen_width and self.screen_height
+        background = self.frozen
+        if background.size != (self.screen_width, self.screen_height):
+            # HiDPI: the grab is in device pixels, the canvas in logical ones
+            size = (self.screen_width, self.screen_height)
+            background = background.resize(size)
+        self._background = ImageTk.PhotoImage(background, master=self._root)
+        canvas.itemconfigure(self._background_item, image=self._background)
 
     def _toggle_overlay(self) -> None:
         """Toggle overlay visibility"""
-        if self._root is None:
+        if self._root is None or not self._active:
             return
         if self._hidden:
             self._root.deiconify()
@@ -158,6 +276,21 @@ class RectangleSelector:
         y2 = max(self.y1, self.y2)
         return (x1, y1, x2, y2)
 
+    def get_frozen_bbox(self) -> tuple[int, int, int, int]:
+        """Selection in pixels of the frozen screen grab"""
+        assert self.frozen is not None and self.screen_width and self.screen_height
+        # The grab can be larger than the logical screen (HiDPI scaling), and
+        # differently so per axis when it spans several monitors
+        scale_x = self.frozen.width / self.screen_width
+        scale_y = self.frozen.height / self.screen_height
+        x1, y1, x2, y2 = self.get_coordinates()
+        return (
+            round(x1 * scale_x),
+            round(y1 * scale_y),
+            round(x2 * scale_x),
+            round(y2 * scale_y),
+        )
+
     @typ.overload
     def capture_image(self, *, strict: typ.Literal[False]) -> Image | None: ...
     @typ.overload
@@ -168,6 +301,9 @@ class RectangleSelector:
             print("No region selected.")
             return
 
+        if self.frozen is not None:
+            return self.frozen.crop(self.get_frozen_bbox())
+
         # Longer delay to ensure overlay is fully cleared and focus is restored
         time.sleep(0.2)
         bbox = self.get_coordinates()
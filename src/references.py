@@ -0,0 +1,98 @@
+"""Splitting a captured bibliography page into individual references.
+
+Three cues are tried in order of reliability: explicit numbering (`[1]`, `1.`,
+`(1)`), hanging indents (continuation lines sit to the right of the first line
+of each entry) and author/year anchors (a line that opens with `Surname, X`
+after a line that closed a sentence).
+"""
+
+from __future__ import annotations
+
+import re
+import statistics
+import typing as typ
+
+from src.ocr import OCRLine
+
+_NUMBERED_RE = re.compile(r"^\s*(?:\[\d{1,4}\]|\(\d{1,4}\)|\d{1,4}\.\s)")
+_AUTHOR_ANCHOR_RE = re.compile(
+    r"^[A-Z][\w'’\-]+(?: [a-z]{1,3})?,\s*(?:[A-Z]\.|[A-Z][a-z]+)"
+    r"|^(?:[A-Z]\.\s?)+[A-Z][\w'’\-]+,"
+)
+_YEAR_ANCHOR_RE = re.compile(r"^.{0,120}?\(\d{4}[a-z]?\)\.")
+# Hanging indents are at least this fraction of the line height
+_INDENT_FACTOR = 0.6
+
+
+def lines_from_text(text: str) -> list[OCRLine]:
+    """Wrap plain text as lines without geometry, e.g. for pasted references."""
+    return [
+        OCRLine(line, 0, i, 0, 0)
+        for i, line in enumerate(text.splitlines())
+        if line.strip()
+    ]
+
+
+def split_references(lines: typ.Sequence[OCRLine]) -> list[str]:
+    """Group OCR lines into references and join each group into one string."""
+    return [join_lines(group) for group in group_references(lines)]
+
+
+def group_references(lines: typ.Sequence[OCRLine]) -> list[list[OCRLine]]:
+    """Group OCR lines into the lines of each reference."""
+    lines = [line for line in lines if line.text.strip()]
+    if not lines:
+        return []
+
+    starts = (
+        _numbered_starts(lines)
+        or _hanging_indent_starts(lines)
+        or _anchor_starts(lines)
+    )
+    starts = sorted({0, *starts})
+    bounds = zip(starts, [*starts[1:], len(lines)])
+    return [lines[start:end] for start, end in bounds]
+
+
+def _numbered_starts(lines: list[OCRLine]) -> list[int]:
+    starts = [i for i, line in enumerate(lines) if _NUMBERED_RE.match(line.text)]
+    return starts if len(starts) >= 2 else []
+
+
+def _hanging_indent_starts(lines: list[OCRLine]) -> list[int]:
+    heights = [line.height for line in lines if line.height > 0]
+    if not heights:
+        return []
+    margin = min(line.left for line in lines)
+    indent = _INDENT_FACTOR * statistics.median(heights)
+
+    flush = [i for i, line in enumerate(lines) if line.left - margin < indent]
+    # Needs several entries and at least one continuation line to be a hanging layout
+    if len(flush) < 2 or len(flush) == len(lines):
+        return []
+    return flush
+
+
+def _anchor_starts(lines: list[OCRLine]) -> list[int]:
+    starts = []
+    for i in range(1, len(lines)):
+        text = lines[i].text.strip()
+        closes_sentence = lines[i - 1].text.rstrip().endswith((".", ")"))
+        if closes_sentence and (
+            _AUTHOR_ANCHOR_RE.match(text) or _YEAR_ANCHOR_RE.match(text)
+        ):
+            starts.append(i)
+    return starts
+
+
+def join_lines(lines: typ.Sequence[OCRLine]) -> str:
+    """Join wrapped lines into one string, undoing hyphenation at line breaks."""
+    text = lines[0].text.strip()
+    for line in lines[1:]:
+        nxt = line.text.strip()
+        if text.endswith("-") and nxt[:1].islower():
+            # Word hyphenated across the line break
+            text = text[:-1] + nxt
+        else:
+            text = f"{text} {nxt}"
+    return text
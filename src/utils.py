@@ -4,7 +4,11 @@ import logging
 import os
 from pathlib import Path
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from pyzotero import zotero
+
+# Local state (caches, queues, indexes) lives next to `logs/` in the repo
+DATA_DIR = Path(__file__).parent.parent / "data"
 
 
 @lru_cache(maxsize=1)
@@ -13,6 +17,40 @@ def get_openai_client() -> OpenAI:
     return OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 
 
+def make_async_openai_client() -> AsyncOpenAI:
+    # Not cached: its HTTP pool is bound to the event loop it was first used on
+    load_dotenv()
+    return AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
+
+@lru_cache(maxsize=1)
+def get_local_openai_client() -> OpenAI:
+    # Any OpenAI-compatible server on this machine (llama.cpp, Ollama, vLLM, ...)
+    load_dotenv()
+    return OpenAI(
+        base_url=os.environ["SNAPCITR_LOCAL_MODEL_URL"],
+        api_key=os.environ.get("SNAPCITR_LOCAL_MODEL_KEY") or "local",
+    )
+
+
+def make_async_local_openai_client() -> AsyncOpenAI:
+    load_dotenv()
+    return AsyncOpenAI(
+        base_url=os.environ["SNAPCITR_LOCAL_MODEL_URL"],
+        api_key=os.environ.get("SNAPCITR_LOCAL_MODEL_KEY") or "local",
+    )
+
+
+@lru_cache(maxsize=1)
+def get_zotero_client() -> zotero.Zotero:
+    load_dotenv()
+    return zotero.Zotero(
+        library_id=os.environ["ZOTERO_USER_ID"],
+        library_type="user",
+        api_key=os.environ["ZOTERO_API_KEY"],
+    )
+
+
 @lru_cache(maxsize=1)
 def get_logger(logs_dir: Path, logger_name: str) -> logging.Logger:
     # Setup logging
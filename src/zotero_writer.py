@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import json
+import logging
+import urllib.error
+import urllib.request
+import typing as typ
+from functools import lru_cache
+
+import httpx
+from pyzotero import zotero
+
+from src.metrics import get_tracer
+from src.utils import get_zotero_client
+
+logger = logging.getLogger(__name__)
+
+# Zotero accepts at most this many items per write request
+MAX_ITEMS_PER_REQUEST = 50
+
+WriteStatus = typ.Literal["successful", "unchanged", "failed"]
+
+
+class WriteResult(typ.NamedTuple):
+    item: dict[str, typ.Any]
+    status: WriteStatus
+    key: str | None = None
+    message: str | None = None
+
+
+class WriteTokenUsedError(Exception):
+    """Zotero already processed a request with this write token (HTTP 412)."""
+
+
+class ZoteroWriter:
+    """Writes batches of Zotero items through one shared pyzotero client."""
+
+    __slots__ = ("_client",)
+
+    def __init__(self, client: zotero.Zotero | None = None) -> None:
+        self._client = client
+
+    @property
+    def client(self) -> zotero.Zotero:
+        if self._client is None:
+            self._client = get_zotero_client()
+        return self._client
+
+    def send(
+        self, items: typ.Sequence[dict[str, typ.Any]], *, write_token: str | None = None
+    ) -> list[WriteResult]:
+        """Write one batch (at most `MAX_ITEMS_PER_REQUEST` items) synchronously.
+
+        Passing the same `write_token` when retrying a batch makes the retry
+        idempotent: Zotero answers `WriteTokenUsedError` if the first attempt
+        already went through.
+        """
+        if len(items) > MAX_ITEMS_PER_REQUEST:
+            raise ValueError(f"At most {MAX_ITEMS_PER_REQUEST} items per request")
+        with get_tracer().span("zotero_post", items=len(items)) as span:
+            if write_token is None:
+                response = self.client.create_items(list(items))
+            else:
+                response = _post_items(self.client, items, write_token)
+            results = parse_write_response(response, items)
+            span["failed"] = sum(r.status == "failed" for r in results)
+        _log_results(results)
+        return results
+
+
+class AsyncZoteroWriter:
+    """`ZoteroWriter.send` over an asyncio HTTP client, for the async pipeline.
+
+    The pyzotero client only supplies the endpoint and the credentials; the
+    HTTP connection pool is bound to the event loop it is first used on.
+    """
+
+    __slots__ = ("timeout", "_client", "_http")
+
+    def __init__(
+        self, client: zotero.Zotero | None = None, *, timeout: float = 30.0
+    ) -> None:
+        self.timeout = timeout
+        self._client = client
+        self._http: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> zotero.Zotero:
+        if self._client is None:
+            self._client = get_zotero_client()
+        return self._client
+
+    async def send(
+        self, items: typ.Sequence[dict[str, typ.Any]], *, write_token: str
+    ) -> list[WriteResult]:
+        """Write one batch; see `ZoteroWriter.send` for the write token."""
+        if len(items) > MAX_ITEMS_PER_REQUEST:
+            raise ValueError(f"At most {MAX_ITEMS_PER_REQUEST} items per request")
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=self.timeout)
+        client = self.client
+        with get_tracer().span("zotero_post", items=len(items)) as span:
+            response = await self._http.post(
+                _items_url(client),
+                json=list(items),
+                headers={
+                    **client.default_headers(),
+                    "Zotero-Write-Token": write_token,
+                },
+            )
+            if response.status_code == 412:
+                raise WriteTokenUsedError(write_token)
+            response.raise_for_status()
+            results = parse_write_response(response.json(), items)
+            span["failed"] = sum(r.status == "failed" for r in results)
+        _log_results(results)
+        return results
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+def parse_write_response(
+    response: dict[str, typ.Any], items: typ.Sequence[dict[str, typ.Any]]
+) -> list[WriteResult]:
+    """Map a multi-object write response (keyed by payload index) back onto items.
+
+    Items the response does not mention at all count as failed, so that they are
+    kept for a retry rather than taken as written.
+    """
+    keys = response.get("success") or {}
+    unchanged = response.get("unchanged") or {}
+    failed = response.get("failed") or {}
+
+    results = []
+    missing = []
+    for i, item in enumerate(items):
+        index = str(i)
+        if index in failed:
+            error = failed[index]
+            message = f"{error.get('code')}: {error.get('message')}"
+            results.append(WriteResult(item, "failed", message=message))
+        elif index in unchanged:
+            results.append(WriteResult(item, "unchanged", key=unchanged[index]))
+        elif index in keys:
+            results.append(WriteResult(item, "successful", key=keys[index]))
+        else:
+            missing.append(index)
+            message = "missing from the Zotero write response"
+            results.append(WriteResult(item, "failed", message=message))
+    if missing:
+        logger.warning(
+            "Zotero write response left out item(s) %s of %d, marked as failed",
+            ", ".join(missing),
+            len(items),
+        )
+    return results
+
+
+def _log_results(results: typ.Sequence[WriteResult]) -> None:
+    logger.info(
+        "Zotero batch of %d: %s",
+        len(results),
+        {s: sum(r.status == s for r in results) for s in typ.get_args(WriteStatus)},
+    )
+
+
+def _items_url(client: zotero.Zotero) -> str:
+    return f"{client.endpoint}/{client.library_type}/{client.library_id}/items"
+
+
+def _post_items(
+    client: zotero.Zotero, items: typ.Sequence[dict[str, typ.Any]], write_token: str
+) -> dict[str, typ.Any]:
+    # pyzotero generates a fresh write token per call, so post with our own
+    request = urllib.request.Request(
+        _items_url(client),
+        data=json.dumps(list(items)).encode(),
+        method="POST",
+        headers={
+            **client.default_headers(),
+            "Content-Type": "application/json",
+            "Zotero-Write-Token": write_token,
+        },
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        if e.code == 412:
+            raise WriteTokenUsedError(write_token) from e
+        raise
+
+
+@lru_cache(maxsize=1)
+def get_zotero_writer() -> ZoteroWriter:
+    return ZoteroWriter()